@@ -1,8 +1,10 @@
-from model import find_schedule, read_instance
+import json
+from urllib.error import HTTPError, URLError
+from model import SolveCache, find_schedule, read_instance
+from service import nurse_preferences, result_frames, satisfaction_frame, submit_job, wait_for_job
 import streamlit as st
 import pandas as pd
 import numpy as np
-filepath = 'C:/Users/EvavR/OneDrive/Documenten/GitHub/thesis_MSc/NSP_benchmark/instances1_24'
 
 st.title('Hello World! [nurse view]')
 
@@ -14,11 +16,78 @@ st.sidebar.header('Preferences')
 st.sidebar.write('Select a nurse')
 
 inst = 1
-# @st.cache_data
-# def load_instance(inst):
-#     return read_instance(inst)
 
-instance = read_instance(inst)
+
+# parsed instance, a fresh copy on every rerun (cache_data returns copies) so the preferences set below do not leak
+@st.cache_data(max_entries=8)
+def load_instance(inst):
+    return read_instance(inst)
+
+
+# one cache of solve results for all sessions, keyed by instance and nurse preferences (see SolveCache)
+@st.cache_resource
+def solve_cache():
+    return SolveCache(max_entries=32)
+
+
+# schedule, coverage and satisfaction scores of the instance with its current preferences, solved once per configuration
+# by the solve service (python service.py), or in the app when no service runs
+def solve(instance):
+    cache = solve_cache()
+    key = cache.key(instance)
+    result = cache.get(key)
+    if result is None:
+        try:
+            result = solve_on_service(instance)
+        except HTTPError as e:  # the service answered, with an error
+            st.error(f'Solve service error {e.code}: {service_error(e)}')
+            st.stop()
+        except OSError as e:
+            if not connection_refused(e):  # a service runs but the connection failed, e.g. dropped or timed out
+                st.error(f'Solve service connection failed: {e}')
+                st.stop()
+            st.info('No solve service running (python service.py), solving in the app')
+            result = solve_in_app(instance)
+        cache.put(key, result)
+    return result
+
+
+# True if no service listens on this machine (the only case the app solves itself)
+def connection_refused(error):
+    return isinstance(error, ConnectionRefusedError) or \
+        isinstance(error, URLError) and isinstance(error.reason, ConnectionRefusedError)
+
+
+# error message of a service reply with an error status
+def service_error(error):
+    try:
+        return json.loads(error.read())['error']
+    except (ValueError, KeyError, TypeError):
+        return error.reason
+
+
+# the incumbents of the solve are shown while the app waits for the job
+def solve_on_service(instance):
+    job_id = submit_job(instance.instance_ID, nurse_preferences(instance))
+    progress = st.empty()
+    job = wait_for_job(job_id, on_incumbent=lambda incumbent: progress.write(
+        f"Solving: objective {incumbent['objective']} after {incumbent['seconds']} s"))
+    progress.empty()
+    if job['status'] != 'done':
+        st.error(f"Solve job {job_id} {job['status']}: {job['error']}")
+        st.stop()
+    schedule, scores = result_frames(job['result'])
+    return {**job['result'], 'schedule': schedule, 'scores': scores}
+
+
+def solve_in_app(instance):
+    schedule = find_schedule(instance)[0]
+    return {'schedule': schedule, 'scores': satisfaction_frame(instance), 'best_undercover': instance.best_undercover,
+            'best_overcover': instance.best_overcover, 'worst_off_sat': instance.worst_off_sat,
+            'total_dissat': instance.total_dissat}
+
+
+instance = load_instance(inst)
 list_of_nurse_IDs = []
 for nurse in instance.N:
     list_of_nurse_IDs.append(nurse.nurse_ID)
@@ -37,16 +106,20 @@ for nurse in instance.N:
 st.sidebar.subheader('Set weights')
 st.sidebar.write('alpha is the weight assigned to consecutiveness compared to incidental requests')
 st.sidebar.checkbox('Simulate alphas [0,1]')
+# drawn once per session, new alphas on every rerun would make every widget change a new configuration
+if 'alphas' not in st.session_state:
+    st.session_state.alphas = {nurse.nurse_ID: round(np.random.normal(0.5, 1, 1)[0]) for nurse in instance.N}
 for nurse in instance.N:
     #if nurse.nurse_ID == nurse_ID:
-    nurse.pref_alpha = round(np.random.normal(0.5, 1, 1)[0]) #st.sidebar.slider('alpha*', 0.0, 1.0, 0.5, step=0.1)
+    nurse.pref_alpha = st.session_state.alphas[nurse.nurse_ID] #st.sidebar.slider('alpha*', 0.0, 1.0, 0.5, step=0.1)
 
-schedule = find_schedule(instance)  # returns NSP and sol
+result = solve(instance)
+schedule = result['schedule']
 
 st.write(
-    f'Best we can do for instance {inst} is undercoverage of {instance.best_undercover} and overcoverage of {instance.best_overcover}')
-st.write(f'Worst-off nurse has penalty off {instance.worst_off_sat}')
-st.write(f'Sum of dissatisfaction penalties {instance.total_dissat}')
+    f'Best we can do for instance {inst} is undercoverage of {result["best_undercover"]} and overcoverage of {result["best_overcover"]}')
+st.write(f'Worst-off nurse has penalty off {result["worst_off_sat"]}')
+st.write(f'Sum of dissatisfaction penalties {result["total_dissat"]}')
 
 show_nurses = st.checkbox('Show nurses ')
 if show_nurses:
@@ -61,6 +134,6 @@ if show_schedule:
 # print coverage scores
 
 # print satisfaction scores
-scores = pd.read_csv(f'{filepath}/instance{instance.instance_ID}/satisfaction_scores{instance.instance_ID}.csv')
+scores = result['scores']
 st.subheader('Satisfaction scores (unscaled)')
 st.dataframe(scores.sort_values('NurseID').set_index('NurseID'))
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+from model import ProgressLog, read_instance, find_schedule
+
+try:
+    import resource  # peak RSS, not available on Windows
+except ImportError:
+    resource = None
+
+results_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_results.jsonl')
+
+# best known objective and lower bound per instance from Curtois & Qu (2014), computational results on new staff
+# scheduling benchmark instances (the PDF in this folder): best solution of the ejection chain, branch and price and
+# Gurobi columns, lower bound of branch and price or Gurobi (None where neither found one)
+best_known = {1: (607, 607), 2: (828, 828), 3: (1001, 1001), 4: (1716, 1716), 5: (1143, 1143), 6: (1950, 1950),
+              7: (1056, 1056), 8: (1308, 1297), 9: (439, 406), 10: (4631, 4631), 11: (3443, 3443),
+              12: (4040, 4040), 13: (3037, 1346), 14: (1280, 1277), 15: (4964, 3806), 16: (3233, 3224),
+              17: (5851, 5726), 18: (4760, 4351), 19: (5420, 2945), 20: (9750, 4743), 21: (36688, 20868),
+              22: (516686, None), 23: (54384, None), 24: (156858, None)}
+
+default_config = {'cons_formulation': 'linear', 'include_satisf': True, 'weight_under': None, 'weight_over': None,
+                  'time_limit': 5 * 60, 'backend': 'cplex', 'symmetry': False}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024)  # bytes on macOS, KB on Linux
+
+
+# one instance with one configuration, runs in its own process so peak RSS belongs to this run only,
+# stop holds the early stop rules of a ProgressLog (gap, stall, target), the incumbents are kept for the anytime metrics
+def run_instance(inst_id, config, stop=None):
+    record = {'instance': inst_id, 'config': config, **({'stop': stop} if stop else {})}
+    start = time.perf_counter()
+    instance = read_instance(inst_id)
+    record['load_s'] = round(time.perf_counter() - start, 4)
+    progress = ProgressLog(**(stop or {}))
+    try:
+        find_schedule(instance, vis_schedule=False, profile=True, progress=progress, **config)
+    except Exception as e:  # e.g. CPLEX community edition size limit or no solution within the time limit
+        record.update(status='error', error=str(e).splitlines()[0], peak_rss_mb=peak_rss_mb())
+        return record
+    families = instance.build_profile['families']
+    record['build_s'] = round(sum(family['seconds'] for name, family in families.items()
+                                  if name not in ['solve', 'post-processing']), 4)
+    record['solve_s'] = families['solve']['seconds']
+    record['status'] = instance.solve_details['status']
+    record['objective'] = instance.solve_details['objective']
+    record['gap'] = instance.solve_details['gap']
+    # objective of the benchmark (requests and coverage, no consecutiveness preferences) of this schedule
+    cover_penalty = instance.solve_details['coverage_penalty']
+    record['benchmark_objective'] = round(instance.best_sum_viol_req + cover_penalty, 4)
+    record['undercover'] = instance.best_undercover
+    record['overcover'] = instance.best_overcover
+    record['request_penalty'] = instance.best_sum_viol_req
+    record['worst_off'] = instance.worst_off_sat
+    record['total_dissat'] = instance.total_dissat
+    record['peak_rss_mb'] = peak_rss_mb()
+    if 'symmetry' in instance.solve_details:  # classes of interchangeable nurses and order constraints
+        record['symmetry'] = instance.solve_details['symmetry']
+    record.update(anytime_metrics(progress))
+    return record
+
+
+# incumbents found, seconds to the first one and to within 0, 1, 5 and 10% of the final objective, stop rule that
+# ended the solve (None: the solver did)
+def anytime_metrics(progress):
+    metrics = {'incumbents': len(progress.incumbents), 'stopped': progress.stopped}
+    if progress.incumbents:
+        final = progress.incumbents[-1]['objective']
+        metrics['first_incumbent_s'] = progress.incumbents[0]['seconds']
+        metrics['time_to_target_s'] = {f'{percent}%': progress.time_to(final + abs(final) * percent / 100)
+                                       for percent in [0, 1, 5, 10]}
+    return metrics
+
+
+# compare a record against the best known values and the last earlier run of the same instance and configuration
+def flag(record, previous, time_tolerance=0.2, min_seconds=1.0):
+    flags = []
+    objective = record.get('benchmark_objective')
+    best, lower_bound = best_known.get(record['instance'], (None, None))
+    if objective is not None and best is not None:
+        record['best_known'] = best
+        record['gap_to_best_known'] = round((objective - best) / best, 4)
+        if lower_bound is not None and objective < lower_bound - 1e-6:
+            flags.append('below published lower bound')  # the model is not the benchmark problem
+    if previous is not None:
+        if record['status'] == 'error' and previous['status'] != 'error':
+            flags.append('error')
+        if objective is not None and previous.get('benchmark_objective') is not None and \
+                objective > previous['benchmark_objective'] + 1e-6:
+            flags.append('quality regression')
+        for phase in ['build_s', 'solve_s']:
+            now, before = record.get(phase), previous.get(phase)
+            if now is not None and before is not None and now > max(before * (1 + time_tolerance), min_seconds):
+                flags.append(f'{phase[:-2]} time regression')
+    record['flags'] = flags
+    return record
+
+
+def read_results(file=results_file):
+    if not os.path.exists(file):
+        return []
+    with open(file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(instances=range(1, 25), config=None, file=results_file, stop=None):
+    config = {**default_config, **(config or {})}
+    history = read_results(file)
+    run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    revision = git_revision()
+    records = []
+    for inst_id in instances:
+        # a fresh process per instance: own peak RSS, and an instance that runs out of memory does not end the run
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            try:
+                record = pool.submit(run_instance, inst_id, config, stop).result()
+            except BrokenProcessPool:
+                record = {'instance': inst_id, 'config': config, 'status': 'crashed',
+                          'error': 'worker process died (out of memory?)'}
+        # records from before the backend and symmetry options are CPLEX runs without symmetry breaking
+        previous = [old for old in history if old['instance'] == inst_id and
+                    {'backend': 'cplex', 'symmetry': False, **old['config']} == config]
+        record = flag(record, previous[-1] if previous else None)
+        record = {'run_id': run_id, 'revision': revision, **record}
+        with open(file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        records.append(record)
+        print(f"Instance {inst_id}: {record['status']}, benchmark objective {record.get('benchmark_objective')} "
+              f"(best known {best_known[inst_id][0]}), solve time {record.get('solve_s')} {record['flags']}")
+    return records
+
+
+# solve time and objective per instance of a run without (off) and with (on) symmetry breaking
+def compare_symmetry(off, on):
+    for before, after in zip(off, on):
+        symmetry = after.get('symmetry', {}).get('identical', {})
+        print(f"Instance {before['instance']}: {symmetry.get('nurses', 0)} interchangeable nurses in "
+              f"{symmetry.get('classes', 0)} classes, solve time {before.get('solve_s')} -> {after.get('solve_s')}, "
+              f"objective {before.get('objective')} -> {after.get('objective')}")
+
+
+def parse_instances(text):
+    instances = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        instances.extend(range(int(first), int(last or first) + 1))
+    return instances
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run find_schedule over the benchmark instances (JSON lines)')
+    parser.add_argument('--instances', default='1-24', help='e.g. 1-7 or 1,3,12')
+    parser.add_argument('--formulation', default=default_config['cons_formulation'], choices=['indicator', 'linear'])
+    parser.add_argument('--backend', default=default_config['backend'], choices=['cplex', 'cpsat'])
+    parser.add_argument('--coverage-only', action='store_true', help='objective without nurse satisfaction')
+    parser.add_argument('--time-limit', type=float, default=default_config['time_limit'], help='seconds per solve')
+    parser.add_argument('--stop-gap', type=float, default=None, help='stop a solve at this relative gap')
+    parser.add_argument('--stop-stall', type=float, default=None, help='stop a solve after this many seconds '
+                                                                       'without a better incumbent')
+    parser.add_argument('--symmetry', default='off', choices=['off', 'on', 'both'],
+                        help='symmetry breaking for interchangeable nurses, both runs without and with and compares')
+    parser.add_argument('--out', default=results_file)
+    args = parser.parse_args()
+    stop = {key: value for key, value in [('gap', args.stop_gap), ('stall', args.stop_stall)] if value is not None}
+    config = {'cons_formulation': args.formulation, 'include_satisf': not args.coverage_only,
+              'time_limit': args.time_limit, 'backend': args.backend}
+    runs = {symmetry: run_benchmark(parse_instances(args.instances), {**config, 'symmetry': symmetry == 'on'},
+                                    args.out, stop or None)
+            for symmetry in (['off', 'on'] if args.symmetry == 'both' else [args.symmetry])}
+    if args.symmetry == 'both':
+        compare_symmetry(runs['off'], runs['on'])
@@ -0,0 +1,318 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from docplex.mp.model import Model
+
+from model import penalized_lengths, read_instance, report_schedule
+from evaluate import block_counts, evaluate
+
+# a roster is the row of one nurse in a schedule array (day -> shift worked or -1), the master problem chooses one
+# roster per nurse, the pricing problem of a nurse is a resource constrained shortest path over the days
+
+
+# everything the pricing problem of a nurse needs, plain arrays and numbers so it can be sent to a worker process
+# requests holds the request penalty of every choice per day (last column: the day off), the shift and weekend limits
+# are only tracked where they can bind
+def nurse_spec(instance, nurse):
+    shifts = sorted(instance.S, key=lambda shift: shift.numerical_ID)
+    i = nurse.numerical_ID
+    off_weights, on_weights = instance.req_off_weights[i], instance.req_on_weights[i]
+    on_total = on_weights.sum(axis=1, keepdims=True)
+    weekend = np.zeros(instance.horizon, dtype=int)  # 1 on saturdays, 2 on sundays of the weekends in instance.W
+    for w in instance.W:
+        weekend[7 * w - 2], weekend[7 * w - 1] = 1, 2
+    domain = instance.domain[i]
+    max_shifts = [nurse.max_shifts.get(shift.shift_ID) for shift in shifts]
+    return {'numerical_ID': i, 'horizon': instance.horizon, 'domain': domain,
+            'requests': np.concatenate([off_weights + on_total - on_weights, on_total], axis=1).astype(float),
+            'lengths': [shift.length_in_min for shift in shifts],
+            'cannot_follow': [set(shift.shifts_cannot_follow_this) for shift in shifts],
+            'tracked': [s for s in range(len(shifts)) if max_shifts[s] < domain[:, s].sum()],
+            'max_shifts': max_shifts, 'weekend': weekend,
+            'max_weekends': nurse.max_weekends if nurse.max_weekends < len(instance.W) else None,
+            'max_total_minutes': nurse.max_total_minutes, 'min_total_minutes': nurse.min_total_minutes,
+            'max_consecutive_shifts': nurse.max_consecutive_shifts,
+            'min_consecutive_shifts': nurse.min_consecutive_shifts,
+            'min_consecutive_days_off': nurse.min_consecutive_days_off,
+            'penalized': set(penalized_lengths(nurse, instance.horizon)), 'alpha': nurse.pref_alpha}
+
+
+# penalty of a roster as in find_schedule: (1 - alpha) * request penalty + alpha * nr. of blocks of a penalized length
+def roster_penalty(spec, roster):
+    requests = spec['requests'][np.arange(spec['horizon']), roster].sum()
+    blocks = block_counts(roster)
+    consecutiveness = sum(blocks[r] for r in spec['penalized'])
+    return (1 - spec['alpha']) * requests + spec['alpha'] * consecutiveness
+
+
+# keeps the labels that no other label beats on cost, shifts worked of the tracked types and weekends worked
+def pareto(labels):
+    kept = []
+    for label in sorted(labels, key=lambda label: label[0]):
+        if not any(all(a <= b for a, b in zip(other[1], label[1])) and other[2] <= label[2] for other in kept):
+            kept.append(label)
+    return kept
+
+
+# pricing: the rosters of a nurse with the lowest cost, sigma * roster penalty - the duals (day x shift) of the shifts
+# worked, by labelling over the days; a label's state is (last shift or -1, length of the current block of days
+# worked or off, whether that block started on the first day, minutes worked) with a Pareto set of (cost, shifts of
+# the tracked types, weekends, path) per state
+# the hard constraints are those of find_schedule's model, including its edges: min consecutive shifts and days off
+# only hold for blocks with a neighbour on both sides that end before the last day
+def price_rosters(spec, duals, sigma=1.0, columns=5):
+    horizon, domain, lengths = spec['horizon'], spec['domain'], spec['lengths']
+    tracked, max_shifts, weekend = spec['tracked'], spec['max_shifts'], spec['weekend']
+    max_weekends = spec['max_weekends']
+    max_minutes, min_minutes = spec['max_total_minutes'], spec['min_total_minutes']
+    max_cons, min_cons = spec['max_consecutive_shifts'], spec['min_consecutive_shifts']
+    min_off = spec['min_consecutive_days_off']
+    costs = sigma * (1 - spec['alpha']) * spec['requests']
+    costs[:, :-1] -= duals
+    block_cost = [sigma * spec['alpha'] * (r in spec['penalized']) for r in range(max_cons + 1)]
+    longest = max(lengths)
+
+    labels = {(-1, 0, True, 0): [(0.0, (0,) * len(tracked), 0, None)]}
+    for t in range(horizon):
+        # a label that can not reach the min minutes anymore with days t, ... is dropped
+        min_after = min_minutes - longest * (horizon - t)
+        checked = t <= horizon - 2  # min consecutiveness is not checked for blocks ending on the last day
+        new = {}
+        for (last, run, start, minutes), bucket in labels.items():
+            if minutes < min_after:
+                continue
+            # day off
+            if last >= 0:
+                if checked and run < min_cons and not start:
+                    off = None
+                else:
+                    off = (-1, 1, False, minutes), block_cost[run]
+            else:
+                off = (-1, min(run + 1, min_off), start and run + 1 < min_off, minutes), 0
+            if off:
+                key, extra = off
+                extra += costs[t, -1]
+                new.setdefault(key, []).extend((cost + extra, counts, weekends, (-1, path))
+                                               for cost, counts, weekends, path in bucket)
+
+            # shifts
+            if last == -1 and checked and run < min_off and not start:
+                continue
+            if last >= 0 and run == max_cons:
+                continue
+            block = run + 1 if last >= 0 else 1
+            block_start = start if last >= 0 else t == 0
+            for s in np.flatnonzero(domain[t]).tolist():
+                if last >= 0 and s in spec['cannot_follow'][last] or minutes + lengths[s] > max_minutes:
+                    continue
+                key = (s, block, block_start and block < min_cons, minutes + lengths[s])
+                new_weekend = weekend[t] == 1 or weekend[t] == 2 and last == -1
+                for cost, counts, weekends, path in bucket:
+                    if s in tracked:
+                        counts = tuple(count + (u == s) for u, count in zip(tracked, counts))
+                        if counts[tracked.index(s)] > max_shifts[s]:
+                            continue
+                    if max_weekends is not None and new_weekend:
+                        if weekends == max_weekends:
+                            continue
+                        weekends += 1
+                    new.setdefault(key, []).append((cost + costs[t, s], counts, weekends, (s, path)))
+        labels = {key: pareto(bucket) for key, bucket in new.items()}
+
+    rosters = []
+    for (last, run, start, minutes), bucket in labels.items():
+        if minutes < min_minutes:
+            continue
+        for cost, counts, weekends, path in bucket:
+            rosters.append((cost + (block_cost[run] if last >= 0 else 0), path))
+    rosters.sort(key=lambda roster: roster[0])
+    result = []
+    for cost, path in rosters[:columns]:
+        roster = []
+        while path:
+            roster.append(path[0])
+            path = path[1]
+        result.append((float(cost), np.array(roster[::-1])))
+    return result
+
+
+# worker state: the nurse specs are sent once per worker, every pricing round only sends the duals
+worker_specs = None
+
+
+def init_worker(specs):
+    global worker_specs
+    worker_specs = specs
+
+
+def price_worker(args):
+    i, duals, sigma, columns = args
+    return price_rosters(worker_specs[i], duals, sigma, columns)
+
+
+# master problem: a roster per nurse, the cover rows with under- and overcover and the worst-off penalty at least the
+# penalty of every nurse's roster, as in find_schedule; rosters are added as columns, continuous for the LP relaxation
+# or binary; the rows only become constraints at the first solve, docplex rejects a row without variables (0 == 1)
+class MasterProblem:
+    def __init__(self, instance, specs, under, over, include_satisf=True, binary=False, threads=None):
+        horizon, nr_shifts = instance.cover_req.shape
+        master = Model('NSP master')
+        if threads is not None:
+            master.context.cplex_parameters.threads = threads
+        master.context.cplex_parameters.mip.tolerances.mipgap = 0
+        y = master.continuous_var_list(horizon * nr_shifts, lb=0, name='y')
+        z = master.continuous_var_list(horizon * nr_shifts, lb=0, name='z')
+        worst_off = master.continuous_var(lb=0, name='worst-off penalty')
+        master.minimize(master.scal_prod(y, under.ravel().tolist()) + master.scal_prod(z, over.ravel().tolist()) +
+                        (worst_off if include_satisf else 0))
+
+        self.convexity = [master.linear_expr() for _ in specs]
+        self.cover = [master.linear_expr() for _ in range(horizon * nr_shifts)]
+        for cell, expr in enumerate(self.cover):
+            expr.add_term(y[cell], 1)
+            expr.add_term(z[cell], -1)
+        self.penalty = [master.linear_expr() for _ in specs]
+        for expr in self.penalty:
+            expr.add_term(worst_off, 1)
+        self.instance, self.specs, self.master, self.binary = instance, specs, master, binary
+        self.constraints = None
+        self.rosters, self.variables, self.seen = [], [], set()
+
+    # adds roster (the row of nurse i in a schedule array) unless it is in already
+    def add_column(self, i, roster):
+        if (i, roster.tobytes()) in self.seen:
+            return False
+        self.seen.add((i, roster.tobytes()))
+        name = f'roster_{i}_{len(self.rosters)}'
+        var = self.master.binary_var(name=name) if self.binary else self.master.continuous_var(lb=0, name=name)
+        self.convexity[i].add_term(var, 1)
+        nr_shifts = self.instance.cover_req.shape[1]
+        for day in np.flatnonzero(roster >= 0).tolist():
+            self.cover[day * nr_shifts + roster[day]].add_term(var, 1)
+        self.penalty[i].add_term(var, -roster_penalty(self.specs[i], roster))
+        self.rosters.append((i, roster))
+        self.variables.append(var)
+        return True
+
+    def solve(self, time_limit):
+        if self.constraints is None:
+            cover_req = self.instance.cover_req.ravel().tolist()
+            self.constraints = (self.master.add_constraints([expr == 1 for expr in self.convexity]),
+                                self.master.add_constraints([expr == req for expr, req in zip(self.cover, cover_req)]),
+                                self.master.add_constraints([expr >= 0 for expr in self.penalty]))
+        self.master.set_time_limit(max(time_limit, 1))
+        return self.master.solve()
+
+    # duals of the LP relaxation: of the convexity rows per nurse, of the cover rows (day x shift) and of the
+    # penalty rows per nurse
+    def duals(self):
+        convexity, cover, penalty = self.constraints
+        return self.master.dual_values(convexity), np.array(self.master.dual_values(cover)).reshape(
+            self.instance.cover_req.shape), self.master.dual_values(penalty)
+
+    # schedule array of the rosters chosen in a solution of the binary master
+    def solution_array(self, sol):
+        solution = np.full(self.instance.domain.shape[:2], -1)
+        for (i, roster), value in zip(self.rosters, sol.get_values(self.variables)):
+            if value > 0.5:
+                solution[i] = roster
+        return solution
+
+
+# price-and-branch: column generation on the LP relaxation of the master problem, then the binary master over all
+# rosters generated; the pricing problems of the nurses are solved in parallel on workers processes
+# the bound is the Lagrangian bound of the best round, the LP value once no roster has a negative reduced cost
+# start is a schedule array whose rosters are added to the master, e.g. the solution of an earlier solve
+def column_generation(instance, weight_under=100, weight_over=10, include_satisf=True, time_limit=5 * 60,
+                      workers=None, columns=5, start=None, threads=None, vis_schedule=True):
+    started = time.perf_counter()
+    instance.presolve()
+    nurses = sorted(instance.N, key=lambda nurse: nurse.numerical_ID)
+    specs = [nurse_spec(instance, nurse) for nurse in nurses]
+    under = instance.cover_weight_under if weight_under is None else np.full(instance.cover_req.shape, weight_under)
+    over = instance.cover_weight_over if weight_over is None else np.full(instance.cover_req.shape, weight_over)
+
+    def remaining():
+        return time_limit - (time.perf_counter() - started)
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=init_worker, initargs=(specs,)) \
+        if (workers or os.cpu_count() or 1) > 1 else None
+
+    def price(duals, sigmas, nr_columns):
+        tasks = [(i, duals, sigmas[i], nr_columns) for i in range(len(nurses))]
+        if pool is None:
+            return [price_rosters(specs[i], duals, sigma, nr_columns) for i, duals, sigma, nr_columns in tasks]
+        return list(pool.map(price_worker, tasks))
+
+    lp = MasterProblem(instance, specs, under, over, include_satisf, threads=threads)
+    iterations, bound, converged = 0, 0, False
+    try:
+        # first columns: the roster with the lowest penalty of every nurse and the rosters of start
+        for i, found in enumerate(price(np.zeros(instance.cover_req.shape), [1.0] * len(nurses), 1)):
+            if not found:
+                raise ValueError(f'Nurse {nurses[i].nurse_ID} of {instance} has no feasible roster')
+            lp.add_column(i, found[0][1])
+        if start is not None:
+            for i in range(len(nurses)):
+                lp.add_column(i, np.asarray(start[i]))
+
+        while remaining() > 0:
+            sol = lp.solve(remaining())
+            if sol is None:
+                raise ValueError(f'No LP solution of the master problem of {instance}: '
+                                 f'{lp.master.solve_details.status}')
+            iterations += 1
+            pis, duals, sigmas = lp.duals()
+            priced = price(duals, sigmas if include_satisf else [0.0] * len(nurses), columns)
+            reduced = [min([cost for cost, _ in found], default=0) - pi for found, pi in zip(priced, pis)]
+            bound = max(bound, sol.objective_value + sum(min(cost, 0) for cost in reduced))
+            added = sum(lp.add_column(i, roster) for i, found in enumerate(priced)
+                        for cost, roster in found if cost - pis[i] < -1e-6)
+            print(f'Column generation {instance}: iteration {iterations}, LP {sol.objective_value:.2f}, '
+                  f'bound {bound:.2f}, {added} rosters added ({len(lp.rosters)} in total)')
+            if not added:
+                converged = True
+                bound = sol.objective_value
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # binary master over the rosters generated
+    master = MasterProblem(instance, specs, under, over, include_satisf, binary=True, threads=threads)
+    for i, roster in lp.rosters:
+        master.add_column(i, roster)
+    sol = master.solve(remaining())
+    if sol is None:
+        raise ValueError(f'No roster per nurse found for {instance} within {time_limit} seconds')
+    solution = master.solution_array(sol)
+
+    seconds = time.perf_counter() - started
+    schedule = report_schedule(instance, solution, block_counts(solution), vis_schedule)
+    scores = evaluate(solution, instance, weight_under, weight_over)
+    objective = float(scores['coverage_penalty'] + (scores['worst_off'] if include_satisf else 0))
+    instance.solve_details = {'backend': 'colgen', 'status': master.master.solve_details.status,
+                              'objective': objective, 'bound': bound, 'gap': abs(objective - bound) / max(abs(objective), 1e-10),
+                              'seconds': seconds, 'coverage_penalty': float(scores['coverage_penalty']),
+                              'iterations': iterations, 'rosters': len(lp.rosters), 'converged': converged}
+    print(f'Column generation {instance}: objective {objective}, bound {bound:.2f} in {seconds:.1f} s '
+          f'({iterations} iterations, {len(lp.rosters)} rosters)')
+    if vis_schedule:
+        return schedule, instance.total_dissat, instance.worst_off_sat, float(scores['coverage_penalty'])
+    return solution, instance.solve_details
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Price-and-branch for a benchmark instance')
+    parser.add_argument('instance', type=int)
+    parser.add_argument('--time-limit', type=float, default=5 * 60, help='seconds, pricing and master included')
+    parser.add_argument('--workers', type=int, default=None, help='pricing processes, default all cores')
+    parser.add_argument('--columns', type=int, default=5, help='rosters per nurse and pricing round')
+    parser.add_argument('--coverage-only', action='store_true', help='objective without nurse satisfaction')
+    args = parser.parse_args()
+    column_generation(read_instance(args.instance), include_satisf=not args.coverage_only,
+                      time_limit=args.time_limit, workers=args.workers, columns=args.columns, vis_schedule=False)
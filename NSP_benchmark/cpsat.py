@@ -0,0 +1,444 @@
+import json
+import time
+import threading
+import numpy as np
+from ortools.sat.python import cp_model
+
+from model import BuildProfiler, assignment_bounds, penalized_lengths, report_progress, report_schedule, \
+    row_key_weights, solution_assignment, start_solution, symmetric_solution
+
+# CP-SAT only takes integer coefficients, the nurse penalties (pref_alpha weighted) are scaled by this factor,
+# so alphas are exact up to three decimals
+scale = 1000
+
+
+# BuildProfiler for a CP-SAT model, every constraint is counted as one kind
+class CPSATProfiler(BuildProfiler):
+    constraint_kinds = ['constraints']
+
+    def counts(self):
+        return {'constraints': len(self.model.proto.constraints)}
+
+    def number_of_variables(self):
+        return len(self.model.proto.variables)
+
+    def nonzeros(self):
+        nonzeros = 0
+        for ct in list(self.model.proto.constraints)[self.before['constraints']:]:
+            nonzeros += len(ct.enforcement_literal)
+            for kind in ['linear', 'bool_or', 'bool_and', 'at_most_one']:
+                if getattr(ct, f'has_{kind}')():
+                    part = getattr(ct, kind)
+                    nonzeros += len(part.vars if kind == 'linear' else part.literals)
+        return nonzeros
+
+
+# CP-SAT side of a ProgressLog, see IncumbentListener
+class IncumbentCallback(cp_model.CpSolverSolutionCallback):
+    def __init__(self, cpsat_model, progress):
+        super().__init__()
+        self.cpsat_model = cpsat_model
+        self.progress = progress
+
+    def on_solution_callback(self):
+        cpsat_model = self.cpsat_model
+        if self.progress.record(self.wall_time, self.objective_value / scale, self.best_objective_bound / scale,
+                                coverage_penalty=self.value(cpsat_model.obj_cover),
+                                worst_off=self.value(cpsat_model.obj_worst_off) / scale,
+                                total_dissat=self.value(cpsat_model.obj_total_dissatisfaction) / scale):
+            self.stop_search()
+
+
+def watch_stall(solver, progress, done, interval=0.1):
+    started = time.perf_counter()
+    while not done.wait(interval):
+        if progress.check(time.perf_counter() - started):
+            solver.stop_search()
+            return
+
+
+# the NSP model of NSPModel for OR-Tools CP-SAT, with the same arguments, methods and results, see NSPModel,
+# blocks of consecutive days are boolean AND/OR constraints on a worked literal per nurse and day
+# threads is the number of CP-SAT workers (None uses all cores), the objective is solved to optimality
+class CPSATModel:
+    def __init__(self, instance, cons_formulation='indicator', profile=False, time_limit=5 * 60, threads=None,
+                 weight_under=100, weight_over=10, include_satisf=True, symmetry=False):
+        S = instance.S
+        N = instance.N
+        W = instance.W
+        time_horizon = instance.horizon
+        D = instance.D
+
+        NSP = cp_model.CpModel()
+        NSP.name = 'NSP'
+        self.time_limit = time_limit
+        self.threads = threads
+        self.profiler = CPSATProfiler(NSP, memory=profile == 'memory') if profile else None
+        checkpoint = self.checkpoint
+
+        # decision variables, x only exists for the assignments that survive presolve
+        domain = instance.presolve()
+        x = {(i, d + 1, s): NSP.new_bool_var(f'x_{i}_{d + 1}_{s}') for i, d, s in np.argwhere(domain).tolist()}
+        k = {(nurse.numerical_ID, w): NSP.new_bool_var(f'w_{nurse.numerical_ID}_{w}') for nurse in N for w in W}
+        max_cover = int(instance.cover_req.max(initial=0))
+        y = {(day, s): NSP.new_int_var(0, max_cover, f'y_{day}_{s}') for day in D for s in range(len(S))}
+        z = {(day, s): NSP.new_int_var(0, len(N), f'z_{day}_{s}') for day in D for s in range(len(S))}
+
+        # worked literal per nurse and day, only for days with assignment variables
+        day_vars = {(i, day): [] for i in range(len(N)) for day in D}
+        nurse_keys = {i: [] for i in range(len(N))}
+        for (i, day, s), var in x.items():
+            day_vars[i, day].append(var)
+            nurse_keys[i].append((i, day, s))
+        works = {}
+        for (i, day), shifts in day_vars.items():
+            if shifts:
+                works[i, day] = NSP.new_bool_var(f'works_{i}_{day}')
+                NSP.add(sum(shifts) == works[i, day])  # constraint 1, max one shift per day per nurse
+        checkpoint('variables')
+
+        def worked(i, day):
+            return works.get((i, day), 0)
+
+        # consecutiveness: c[n, d, r] = 1 if nurse n works a block of exactly r days (any shift) starting on day d
+        def workable(i, d, r):
+            return all((i, day) in works for day in range(d, d + r))
+
+        if cons_formulation == 'indicator':
+            block_lengths = {nurse.numerical_ID: list(range(1, 11)) for nurse in N}
+        else:
+            block_lengths = {nurse.numerical_ID: penalized_lengths(nurse, time_horizon) for nurse in N}
+        c = {(i, d, r): NSP.new_bool_var(f'c_{i}_{d}_{r}') for i, lengths in block_lengths.items() for r in lengths
+             for d in range(1, time_horizon + 2 - r) if workable(i, d, r)}
+        for (i, d, r), block in c.items():
+            inside = [works[i, day] for day in range(d, d + r)]
+            outside = [works[i, day] for day in [d - 1, d + r] if (i, day) in works]
+            NSP.add_bool_and(inside + [var.negated() for var in outside]).only_enforce_if(block)
+            NSP.add_bool_or([block] + [var.negated() for var in inside] + outside)
+        checkpoint('consecutiveness')
+
+        # request penalty per nurse, violated off request: nurse works the shift, violated on request: nurse does not
+        obj_requests = {}
+        for nurse in N:
+            off_weights = instance.req_off_weights[nurse.numerical_ID]
+            on_weights = instance.req_on_weights[nurse.numerical_ID]
+            keys = nurse_keys[nurse.numerical_ID]
+            # a pruned assignment is never worked, so its on request is a constant penalty
+            obj_requests[nurse.numerical_ID] = int(on_weights.sum()) + cp_model.LinearExpr.weighted_sum(
+                [x[key] for key in keys], [int(off_weights[d - 1, s] - on_weights[d - 1, s]) for i, d, s in keys])
+        checkpoint('objective')
+
+        # constraint 2, shift rotation: none of the shifts that cannot follow shift is worked the next day
+        for nurse in N:
+            i = nurse.numerical_ID
+            for day in range(1, time_horizon):
+                for shift in S:
+                    following = [x[i, day + 1, u] for u in shift.shifts_cannot_follow_this if (i, day + 1, u) in x]
+                    if following and (i, day, shift.numerical_ID) in x:
+                        NSP.add_at_most_one([x[i, day, shift.numerical_ID]] + following)
+        checkpoint('constraint 2')
+
+        # constraint 3: personal shift limitations (shifts with a max of 0 are pruned)
+        for shift in S:
+            for nurse in N:
+                shift_vars = [x[nurse.numerical_ID, day, shift.numerical_ID] for day in D
+                              if (nurse.numerical_ID, day, shift.numerical_ID) in x]
+                if shift_vars:
+                    NSP.add(sum(shift_vars) <= nurse.max_shifts.get(shift.shift_ID))
+        checkpoint('constraint 3')
+
+        # constraint 4: FTE
+        shift_lengths = [shift.length_in_min for shift in sorted(S, key=lambda shift: shift.numerical_ID)]
+        for nurse in N:
+            keys = nurse_keys[nurse.numerical_ID]
+            minutes = cp_model.LinearExpr.weighted_sum([x[key] for key in keys],
+                                                       [shift_lengths[key[2]] for key in keys])
+            NSP.add_linear_constraint(minutes, nurse.min_total_minutes, nurse.max_total_minutes)
+        checkpoint('constraint 4')
+
+        # constraint 5: max consecutive shifts
+        for nurse in N:
+            for day in range(1, time_horizon - nurse.max_consecutive_shifts + 1):
+                window = [worked(nurse.numerical_ID, d) for d in range(day, day + nurse.max_consecutive_shifts + 1)]
+                NSP.add(sum(window) <= nurse.max_consecutive_shifts)
+        checkpoint('constraint 5')
+
+        # constraint 6: min consecutiveness, no block of s < min days worked between two days off
+        # constraint 7: min consecutiveness days off, no s < min days off between two days worked
+        def min_consecutive_block(i, day, s, sign):
+            inside = sum(worked(i, d) for d in range(day + 1, day + s + 1))
+            return sign * (worked(i, day) + worked(i, day + s + 1) - inside)
+
+        for nurse in N:
+            i = nurse.numerical_ID
+            for s in range(1, nurse.min_consecutive_shifts):
+                for day in range(1, time_horizon - (s + 1)):
+                    NSP.add(min_consecutive_block(i, day, s, 1) + s >= 1)
+            for s in range(1, nurse.min_consecutive_days_off):
+                for day in range(1, time_horizon - (s + 1)):
+                    NSP.add(min_consecutive_block(i, day, s, -1) + 2 >= 1)
+        checkpoint('constraint 6-7')
+
+        # constraint 8: max weekends
+        for nurse in N:
+            i = nurse.numerical_ID
+            for w in W:
+                weekend = worked(i, 7 * w - 1) + worked(i, 7 * w)
+                NSP.add(k[i, w] <= weekend)
+                NSP.add(weekend <= 2 * k[i, w])
+            NSP.add(sum(k[i, w] for w in W) <= nurse.max_weekends)
+        checkpoint('constraint 8')
+
+        # constraint 9: days off, enforced by presolve (no x variables on days off)
+
+        # constraint 10: cover requirements
+        cover_cells = [(day, s) for day in range(1, time_horizon + 1) for s in range(len(S))]
+        cover_req = instance.cover_req.tolist()
+        for day, s in cover_cells:
+            NSP.add(sum(x[nurse.numerical_ID, day, s] for nurse in N if (nurse.numerical_ID, day, s) in x) -
+                    z[day, s] + y[day, s] == cover_req[day - 1][s])
+        checkpoint('constraint 10')
+
+        # worst-off penalty (scaled), bounded by the largest penalty a nurse can get
+        most = max([int(instance.req_off_weights[i].sum() + instance.req_on_weights[i].sum()) + time_horizon
+                    for i in range(len(N))], default=0)
+        self.obj_worst_off = NSP.new_int_var(0, scale * most, 'worst-off penalty')
+
+        self.instance = instance
+        self.NSP = NSP
+        self.x, self.c, self.k, self.y, self.z = x, c, k, y, z
+        # proto indices of the variables in key order, for one bulk value fetch per family after the solve
+        self.x_index, self.x_vars = np.array(list(x), dtype=int).reshape(-1, 3), list(x.values())
+        self.c_index = np.array(list(c), dtype=int).reshape(-1, 3)
+        self.x_proto = np.array([var.index for var in x.values()], dtype=int)
+        self.c_proto = np.array([var.index for var in c.values()], dtype=int)
+        self.x_lb, self.x_ub = np.zeros(len(x), dtype=bool), np.ones(len(x), dtype=bool)
+        self.obj_requests = obj_requests
+        self.block_lengths = block_lengths
+        self.cover_cells = cover_cells
+        self.penalty_cts = []
+        self.epsilon_cts = []
+        self.min_minutes_cts = []
+        self.symmetry_cts = []
+        self.free_rows = []
+        self.symmetry = symmetry
+        self.classes = []
+        self.fixed = False
+        self.row_key = row_key_weights(instance, 2 ** 60)  # row keys stay within 64-bit integers
+        self.set_coverage_weights(weight_under, weight_over)
+        self.set_preferences()
+        self.set_objective_mode(include_satisf)
+        checkpoint('objective')
+
+    def checkpoint(self, family):
+        if self.profiler:
+            self.profiler.checkpoint(family)
+
+    # replaces the rows of a family (proto indices, all linear) by the rows add(model) adds to a scratch model: they
+    # are copied into the cleared rows of any family before the model grows (the proto can not drop rows), so
+    # repeated updates keep the model size, returns the proto indices of the new rows
+    def replace_rows(self, rows, add):
+        constraints = self.NSP.proto.constraints
+        for row in rows:
+            constraints[row].clear_linear()
+        self.free_rows += rows
+        scratch = cp_model.CpModel()
+        add(scratch)
+        new_rows = []
+        for ct in scratch.proto.constraints:
+            if self.free_rows:
+                new_rows.append(self.free_rows.pop())
+                constraints[new_rows[-1]].copy_from(ct)
+            else:
+                new_rows.append(len(constraints))
+                constraints.add().copy_from(ct)
+        return new_rows
+
+    def set_coverage_weights(self, weight_under=None, weight_over=None):
+        instance = self.instance
+        under = instance.cover_weight_under if weight_under is None else np.full(instance.cover_req.shape, weight_under)
+        over = instance.cover_weight_over if weight_over is None else np.full(instance.cover_req.shape, weight_over)
+        self.under, self.over = under, over
+        self.obj_cover = cp_model.LinearExpr.weighted_sum(
+            [self.y[cell] for cell in self.cover_cells] + [self.z[cell] for cell in self.cover_cells],
+            under.ravel().tolist() + over.ravel().tolist())
+        if hasattr(self, 'include_satisf'):
+            self.set_objective_mode(self.include_satisf)
+
+    # see NSPModel.set_preferences, the worst-off rows are replaced in place (replace_rows)
+    def set_preferences(self, alphas=None):
+        c = self.c
+        time_horizon = self.instance.horizon
+        for nurse in self.instance.N:
+            if alphas and nurse.nurse_ID in alphas:
+                nurse.pref_alpha = alphas[nurse.nurse_ID]
+            missing = set(penalized_lengths(nurse, time_horizon)) - set(self.block_lengths[nurse.numerical_ID])
+            if missing:
+                raise ValueError(f'Nurse {nurse.nurse_ID} penalizes blocks of length {sorted(missing)} that this '
+                                 f'model has no block variables for, build a new CPSATModel')
+
+        penalties = []
+        for nurse in self.instance.N:
+            obj_consecutiveness = sum(c[nurse.numerical_ID, d, r] for r in penalized_lengths(nurse, time_horizon)
+                                      for d in range(1, time_horizon + 2 - r) if (nurse.numerical_ID, d, r) in c)
+            penalties.append(round(scale * nurse.pref_alpha) * obj_consecutiveness +
+                             round(scale * (1 - nurse.pref_alpha)) * self.obj_requests[nurse.numerical_ID])
+
+        self.penalty_cts = self.replace_rows(self.penalty_cts, lambda model: [
+            model.add(self.obj_worst_off >= penalty) for penalty in penalties])
+        self.obj_total_dissatisfaction = sum(penalties)
+        self.set_symmetry()
+
+    # see NSPModel.set_symmetry, the order rows are replaced in place (replace_rows)
+    def set_symmetry(self, symmetry=None):
+        if symmetry is not None:
+            self.symmetry = symmetry
+        self.classes = self.instance.symmetry_classes() if self.symmetry else []
+
+        def row_key(i):
+            keys = [(i, day, s) for day in self.row_key for s in range(len(self.instance.S)) if (i, day, s) in self.x]
+            return cp_model.LinearExpr.weighted_sum([self.x[key] for key in keys],
+                                                    [self.row_key[key[1]] * (key[2] + 1) for key in keys])
+
+        # no order rows while the assignments are fixed
+        pairs = [] if self.fixed else [pair for members in self.classes for pair in zip(members, members[1:])]
+        self.symmetry_cts = self.replace_rows(self.symmetry_cts, lambda model: [
+            model.add(row_key(first) >= row_key(second)) for first, second in pairs])
+
+    def set_objective_mode(self, include_satisf=True):
+        self.include_satisf = include_satisf
+        self.set_epsilon()
+        if include_satisf:
+            self.NSP.minimize(scale * self.obj_cover + self.obj_worst_off)
+        else:
+            self.NSP.minimize(scale * self.obj_cover)
+
+    # see NSPModel.set_pareto, the lexicographic objective is one integer objective: first times the upper bound
+    # of second plus one, plus second (the penalties scaled as everywhere in this model)
+    def set_pareto(self, first='coverage', second='total_dissat', total_dissat=None, worst_off=None,
+                   coverage=None):
+        instance = self.instance
+        worst_off_bound = self.NSP.proto.variables[self.obj_worst_off.index].domain[1]
+        objectives = {'coverage': (scale * self.obj_cover, scale * int(
+                          (self.under * instance.cover_req + self.over * len(instance.N)).sum())),
+                      'total_dissat': (self.obj_total_dissatisfaction, len(instance.N) * worst_off_bound),
+                      'worst_off': (self.obj_worst_off, worst_off_bound)}
+        self.set_epsilon(total_dissat, worst_off, coverage)
+        self.NSP.minimize(objectives[first][0] * (objectives[second][1] + 1) + objectives[second][0])
+
+    def set_epsilon(self, total_dissat=None, worst_off=None, coverage=None):
+        bounds = [(self.obj_total_dissatisfaction, total_dissat, scale), (self.obj_worst_off, worst_off, scale),
+                  (self.obj_cover, coverage, 1)]  # the coverage penalty is not scaled
+        self.epsilon_cts = self.replace_rows(self.epsilon_cts, lambda model: [
+            model.add(expr <= int(np.floor(factor * epsilon + 1e-6))) for expr, epsilon, factor in bounds
+            if epsilon is not None])
+
+    # see NSPModel.set_min_minutes, the rows are replaced in place (replace_rows)
+    def set_min_minutes(self, minimum=None):
+        lengths = {shift.numerical_ID: shift.length_in_min for shift in self.instance.S}
+        keys = {}
+        for key in self.x:
+            keys.setdefault(key[:2], []).append(key)
+        rows = []
+        for i, days, minutes, worked_days, off_days, weekends in minimum or []:
+            if minutes <= 0:
+                continue
+            terms = [(self.x[key], lengths[key[2]]) for day in range(1, days + 1) for key in keys.get((i, day), [])]
+            terms += [(self.x[key], -minutes) for day in worked_days for key in keys.get((i, day), [])]
+            terms += [(self.x[key], minutes) for day in off_days for key in keys.get((i, day), [])]
+            terms += [(self.k[i, w], -minutes) for w in weekends]
+            rows.append((cp_model.LinearExpr.weighted_sum([var for var, _ in terms], [int(coef) for _, coef in terms]),
+                         int(minutes) * (1 - len(worked_days) - len(weekends))))
+        self.min_minutes_cts = self.replace_rows(self.min_minutes_cts, lambda model: [
+            model.add_linear_constraint(expr, bound, cp_model.INT_MAX) for expr, bound in rows])
+
+    # hints for every assignment variable, see NSPModel.set_mip_start
+    def set_mip_start(self, mip_start=None):
+        self.NSP.clear_hints()
+        mip_start = start_solution(mip_start, self.instance)
+        if mip_start is not None:
+            if self.symmetry_cts:
+                mip_start = symmetric_solution(mip_start, self.classes, self.row_key)
+            worked = solution_assignment(mip_start)
+            for key, var in self.x.items():
+                self.NSP.add_hint(var, key in worked)
+
+    # see NSPModel.fix_assignments, the domains of the variables in the model are changed
+    def fix_assignments(self, solution=None, free=None):
+        lb, ub = assignment_bounds(self.x_index, solution, free)
+        for j in np.flatnonzero((lb != self.x_lb) | (ub != self.x_ub)):
+            domain = self.NSP.proto.variables[self.x_proto[j]].domain
+            domain[0], domain[1] = int(lb[j]), int(ub[j])
+        self.x_lb, self.x_ub = lb, ub
+        if self.symmetry and self.fixed != (solution is not None):
+            self.fixed = solution is not None
+            self.set_symmetry()
+
+    # see NSPModel.solve, the stall rule of progress is checked by a watcher thread as CP-SAT only calls back on
+    # new solutions
+    def solve(self, vis_schedule=True, mip_start=None, progress=None):
+        instance = self.instance
+        if self.profiler:
+            for family in ['solve', 'post-processing']:  # the report covers the build and the last solve
+                self.profiler.families.pop(family, None)
+            self.profiler.start()
+
+        self.set_mip_start(mip_start)
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = self.time_limit
+        if self.threads is not None:
+            solver.parameters.num_workers = self.threads
+        if progress:
+            progress.start()
+            done = threading.Event()
+            watcher = threading.Thread(target=watch_stall, args=(solver, progress, done), daemon=True)
+            watcher.start()
+            status = solver.solve(self.NSP, IncumbentCallback(self, progress))
+            done.set()
+            watcher.join()
+        else:
+            status = solver.solve(self.NSP)
+        self.checkpoint('solve')
+        if status not in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
+            raise ValueError(f'CP-SAT found no schedule for {instance}: {solver.status_name(status)}')
+        result = self.report(solver, status, vis_schedule)
+        report_progress(instance, progress)
+        self.checkpoint('post-processing')
+
+        if self.profiler:
+            instance.build_profile = self.profiler.report()
+            print(json.dumps(instance.build_profile, indent=2))
+        return result
+
+    # schedule array (nurse x day, shift or -1) of a solution with one bulk fetch of x
+    def solution_array(self, solver):
+        values = np.array(solver.response_proto.solution)
+        worked = np.zeros(self.instance.domain.shape, dtype=bool)
+        i, day, s = self.x_index.T
+        worked[i, day - 1, s] = values[self.x_proto] > 0
+        return np.where(worked.any(axis=2), worked.argmax(axis=2), -1)
+
+    def report(self, solver, status, vis_schedule=True):
+        instance = self.instance
+        objective = solver.objective_value / scale
+        worst_off = solver.value(self.obj_worst_off) / scale
+        total_dissat = solver.value(self.obj_total_dissatisfaction) / scale
+        cover_penalty = solver.value(self.obj_cover)
+        print(f"Optimal objective value z = {objective} (status = {solver.status_name(status)}, "
+              f"time = {solver.wall_time} s)")
+        print(f"Worst off: {worst_off}")
+        print(f"Total dissat: {total_dissat}")
+        bound = solver.best_objective_bound / scale
+        instance.solve_details = {'backend': 'cpsat', 'status': solver.status_name(status), 'objective': objective,
+                                  'bound': bound, 'gap': abs(objective - bound) / max(abs(objective), 1e-10),
+                                  'seconds': solver.wall_time, 'coverage_penalty': cover_penalty}
+        if self.symmetry:
+            instance.solve_details['symmetry'] = {**instance.symmetry, 'constraints': len(self.symmetry_cts)}
+
+        blocks = np.zeros((len(instance.N), instance.horizon + 1))
+        values = np.array(solver.response_proto.solution)
+        np.add.at(blocks, (self.c_index[:, 0], self.c_index[:, 2]), values[self.c_proto])
+        schedule = report_schedule(instance, self.solution_array(solver), blocks, vis_schedule)
+        if vis_schedule:
+            return schedule, total_dissat, worst_off, cover_penalty
+        return self.NSP, solver
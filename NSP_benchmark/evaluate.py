@@ -0,0 +1,73 @@
+import numpy as np
+
+from model import penalized_lengths
+
+# schedule arrays are nurse x day with the shift worked or -1 (instance.solution), a batch stacks them along leading
+# axes, e.g. runs x nurse x day; every score keeps the leading axes
+
+
+# per nurse constants of an instance: request weights with a zero weight column for the day off (shift -1) and the
+# block lengths that violate the consecutiveness preference
+def nurse_arrays(instance):
+    nurses = sorted(instance.N, key=lambda nurse: nurse.numerical_ID)
+    no_shift = np.zeros(instance.req_off_weights.shape[:2] + (1,), dtype=instance.req_off_weights.dtype)
+    off_weights = np.concatenate([instance.req_off_weights, no_shift], axis=2)
+    on_weights = np.concatenate([instance.req_on_weights, no_shift], axis=2)
+    penalized = np.zeros((len(nurses), instance.horizon + 1), dtype=bool)
+    for nurse in nurses:
+        penalized[nurse.numerical_ID, penalized_lengths(nurse, instance.horizon)] = True
+    alphas = np.array([nurse.pref_alpha for nurse in nurses])
+    return off_weights, on_weights, penalized, alphas
+
+
+# violated off request: nurse works the shift, violated on request: nurse does not work the shift
+# (one gather of the off minus on weight of the shift worked, shift -1 picks the zero column)
+def request_penalties(solutions, off_weights, on_weights):
+    nurses, days, shifts = off_weights.shape
+    cells = (np.arange(nurses)[:, None] * days + np.arange(days)) * shifts + solutions % shifts
+    return (off_weights - on_weights).ravel().take(cells).sum(axis=-1) + on_weights.sum(axis=(1, 2))
+
+
+# nr. of nurses per day and shift, counted with one bincount over the (schedule, day, shift) cells of the batch
+def cover_counts(solutions, nr_shifts):
+    schedules = solutions.reshape((int(np.prod(solutions.shape[:-2])),) + solutions.shape[-2:])
+    batch, days = schedules.shape[0], schedules.shape[-1]
+    cells = (np.arange(batch)[:, None, None] * days + np.arange(days)) * (nr_shifts + 1) + schedules % (nr_shifts + 1)
+    counts = np.bincount(cells.ravel(), minlength=batch * days * (nr_shifts + 1))
+    return counts.reshape(solutions.shape[:-2] + (days, nr_shifts + 1))[..., :nr_shifts]
+
+
+# nr. of blocks of consecutive days worked (any shift) per nurse and length, the horizon ends count as days off
+def block_counts(solutions):
+    worked = (solutions >= 0).reshape(-1, solutions.shape[-1])
+    edges = np.diff(np.pad(worked, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)  # row major, so the n-th end closes the n-th start
+    lengths = solutions.shape[-1] + 1
+    counts = np.bincount(rows * lengths + ends - starts, minlength=worked.shape[0] * lengths)
+    return counts.reshape(solutions.shape[:-1] + (lengths,))
+
+
+# penalties, satisfaction and coverage of one schedule array or a batch, as find_schedule reports them for its solution
+# (weight_under and weight_over are the coverage weights as in find_schedule, None uses those of the instance)
+def evaluate(solutions, instance, weight_under=100, weight_over=10):
+    solutions = np.asarray(solutions)
+    off_weights, on_weights, penalized, alphas = nurse_arrays(instance)
+    requests = request_penalties(solutions, off_weights, on_weights)
+    consecutiveness = (block_counts(solutions) * penalized).sum(axis=-1)
+    satisfaction = (1 - alphas) * requests + alphas * consecutiveness
+
+    cover = cover_counts(solutions, len(instance.S))  # day x shift
+    under = np.maximum(instance.cover_req - cover, 0)
+    over = np.maximum(cover - instance.cover_req, 0)
+    weights_under = instance.cover_weight_under if weight_under is None else weight_under
+    weights_over = instance.cover_weight_over if weight_over is None else weight_over
+    return {'request_penalty': requests,
+            'consecutiveness_penalty': consecutiveness,
+            'satisfaction': satisfaction,
+            'worst_off': np.maximum(satisfaction.max(axis=-1), 0),
+            'total_dissat': satisfaction.sum(axis=-1),
+            'sum_viol_req': requests.sum(axis=-1),
+            'undercover': under.sum(axis=(-2, -1)),
+            'overcover': over.sum(axis=(-2, -1)),
+            'coverage_penalty': (under * weights_under + over * weights_over).sum(axis=(-2, -1))}
@@ -0,0 +1,157 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from model import NSPModel, read_instance, schedule_solution
+from evaluate import nurse_arrays, request_penalties, block_counts, cover_counts
+
+neighbourhood_kinds = ['days', 'nurses', 'shift']
+
+
+# free (nurse x day x shift) cells of a random neighbourhood: a window of consecutive days for all nurses, a subset of
+# nurses over the whole horizon or one shift type for all nurses and days
+def neighbourhood(kind, shape, size, rng):
+    nr_nurses, horizon, nr_shifts = shape
+    free = np.zeros(shape, dtype=bool)
+    if kind == 'days':
+        days = min(size['days'], horizon)
+        first = rng.integers(0, horizon - days + 1)
+        free[:, first:first + days] = True
+    elif kind == 'nurses':
+        free[rng.choice(nr_nurses, min(size['nurses'], nr_nurses), replace=False)] = True
+    else:
+        free[:, :, rng.integers(nr_shifts)] = True
+    return free
+
+
+# objective of find_schedule (coverage penalty + worst-off penalty if include_satisf) of a schedule array, kept per
+# nurse and per day so a candidate is scored on the nurses and days it changes only
+class DeltaEvaluator:
+    def __init__(self, instance, solution, weight_under=100, weight_over=10, include_satisf=True):
+        self.off_weights, self.on_weights, self.penalized, self.alphas = nurse_arrays(instance)
+        self.cover_req = instance.cover_req
+        self.weight_under = instance.cover_weight_under if weight_under is None else \
+            np.full(instance.cover_req.shape, weight_under)
+        self.weight_over = instance.cover_weight_over if weight_over is None else \
+            np.full(instance.cover_req.shape, weight_over)
+        self.nr_shifts = len(instance.S)
+        self.include_satisf = include_satisf
+        self.solution = solution
+        self.nurse_penalty = self.nurse_penalties(solution, np.arange(solution.shape[0]))
+        self.day_penalty = self.day_penalties(solution, np.arange(solution.shape[1]))
+
+    def nurse_penalties(self, solution, nurses):
+        requests = request_penalties(solution[nurses], self.off_weights[nurses], self.on_weights[nurses])
+        consecutiveness = (block_counts(solution[nurses]) * self.penalized[nurses]).sum(axis=-1)
+        return (1 - self.alphas[nurses]) * requests + self.alphas[nurses] * consecutiveness
+
+    def day_penalties(self, solution, days):
+        cover = cover_counts(solution[:, days], self.nr_shifts)
+        return (np.maximum(self.cover_req[days] - cover, 0) * self.weight_under[days] +
+                np.maximum(cover - self.cover_req[days], 0) * self.weight_over[days]).sum(axis=-1)
+
+    def objective(self, nurse_penalty=None, day_penalty=None):
+        nurse_penalty = self.nurse_penalty if nurse_penalty is None else nurse_penalty
+        day_penalty = self.day_penalty if day_penalty is None else day_penalty
+        worst_off = max(nurse_penalty.max(initial=0), 0) if self.include_satisf else 0
+        return day_penalty.sum() + worst_off
+
+    # objective of a candidate and the penalties to accept it with
+    def score(self, candidate):
+        changed = candidate != self.solution
+        nurse_penalty, day_penalty = self.nurse_penalty.copy(), self.day_penalty.copy()
+        nurses, days = np.flatnonzero(changed.any(axis=1)), np.flatnonzero(changed.any(axis=0))
+        nurse_penalty[nurses] = self.nurse_penalties(candidate, nurses)
+        day_penalty[days] = self.day_penalties(candidate, days)
+        return self.objective(nurse_penalty, day_penalty), (candidate, nurse_penalty, day_penalty)
+
+    def accept(self, scored):
+        self.solution, self.nurse_penalty, self.day_penalty = scored
+
+
+# large neighbourhood search: frees a neighbourhood of the incumbent, fixes the other assignments and re-optimizes the
+# neighbourhood with the MIP of find_schedule, until the wall-clock budget (seconds, build included) is used up
+# start is a schedule array or DataFrame, without it the first feasible solution of the full MIP is the start,
+# sizes adapt: a neighbourhood grows after a sub-MIP solved to optimality without improvement and shrinks after a
+# sub-MIP that ran into its time limit
+def lns(instance, budget=10 * 60, start=None, weight_under=100, weight_over=10, include_satisf=True,
+        cons_formulation='linear', sub_time_limit=30, days=14, nurses=10, kinds=neighbourhood_kinds, seed=0,
+        threads=None, vis_schedule=True):
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    nsp_model = NSPModel(instance, cons_formulation=cons_formulation, threads=threads, weight_under=weight_under,
+                         weight_over=weight_over, include_satisf=include_satisf)
+    NSP = nsp_model.NSP
+
+    def remaining():
+        return budget - (time.perf_counter() - started)
+
+    if start is None:
+        NSP.context.cplex_parameters.mip.limits.solutions = 1
+        NSP.set_time_limit(max(remaining(), 1))
+        sol = NSP.solve()
+        NSP.context.cplex_parameters.mip.limits.solutions.reset()
+        if sol is None:
+            raise ValueError(f'No feasible start for {instance} within {budget} seconds, pass a start schedule')
+        start = nsp_model.solution_array(sol)
+    elif isinstance(start, pd.DataFrame):
+        start = schedule_solution(start, instance)
+
+    evaluator = DeltaEvaluator(instance, np.array(start), weight_under, weight_over, include_satisf)
+    best = float(evaluator.objective())
+    history = [(round(time.perf_counter() - started, 2), best, 'start')]
+    print(f'LNS {instance}: start objective {best} after {history[0][0]} s')
+
+    size = {'days': days, 'nurses': nurses}
+    max_size = {'days': instance.horizon, 'nurses': len(instance.N)}
+    iterations = 0
+    while remaining() > 1:
+        kind = kinds[iterations % len(kinds)]
+        iterations += 1
+        free = neighbourhood(kind, instance.domain.shape, size, rng)
+        nsp_model.fix_assignments(evaluator.solution, free)
+        nsp_model.set_mip_start(evaluator.solution)
+        NSP.set_time_limit(max(min(sub_time_limit, remaining()), 1))
+        sol = NSP.solve()
+        if sol is None:
+            continue
+        optimal = NSP.solve_details.status_code in [101, 102]  # optimal (within tolerance)
+        objective, scored = evaluator.score(nsp_model.solution_array(sol))
+        if objective <= evaluator.objective() + 1e-6:  # equal objectives are accepted to move across plateaus
+            evaluator.accept(scored)
+        if objective < best - 1e-6:
+            best = float(objective)
+            history.append((round(time.perf_counter() - started, 2), best, kind))
+            print(f'LNS {instance}: objective {best} after {history[-1][0]} s ({kind} neighbourhood, '
+                  f'iteration {iterations})')
+        if optimal and free.all():  # the neighbourhood was the whole problem
+            break
+        if kind in size and optimal and objective >= best - 1e-6:
+            size[kind] = min(size[kind] + max(1, size[kind] // 5), max_size[kind])
+        elif kind in size and NSP.solve_details.has_hit_limit():
+            size[kind] = max(1, size[kind] - max(1, size[kind] // 5))
+
+    print(f'LNS {instance}: objective {best} after {iterations} iterations')
+    instance.incumbents = history
+
+    # solve with every assignment fixed to the incumbent for the reported solution
+    nsp_model.fix_assignments(evaluator.solution)
+    nsp_model.set_mip_start(evaluator.solution)
+    NSP.set_time_limit(max(sub_time_limit, 1))
+    sol = NSP.solve()
+    nsp_model.fix_assignments()
+    return nsp_model.report(sol, vis_schedule)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Large neighbourhood search for a benchmark instance')
+    parser.add_argument('instance', type=int)
+    parser.add_argument('--budget', type=float, default=10 * 60, help='wall-clock seconds, model build included')
+    parser.add_argument('--sub-time-limit', type=float, default=30, help='seconds per neighbourhood')
+    parser.add_argument('--formulation', default='linear', choices=['indicator', 'linear'])
+    parser.add_argument('--coverage-only', action='store_true', help='objective without nurse satisfaction')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    lns(read_instance(args.instance), args.budget, include_satisf=not args.coverage_only,
+        cons_formulation=args.formulation, sub_time_limit=args.sub_time_limit, seed=args.seed, vis_schedule=False)
@@ -1,42 +1,34 @@
-from model import find_schedule, read_instance
+from simulation import simulate
 import numpy as np
 import matplotlib.pyplot as plt
 
 runs = 10
-total_dissat_runs = []
-worst_off_runs = []
-cover_runs = []
-total_dissat_BMs = []
-worst_off_BMs = []
-coverage_BMs = []
+workers = None  # None: one worker per CPLEX thread available
+threads = 1  # CPLEX threads per worker
+seed = 0
 
-for run in range(runs):
-    instance = read_instance(1)
-    for nurse in instance.N:
-        nurse.pref_alpha = round(np.random.uniform(0, 10, 1)[0])/10  # st.sidebar.slider('alpha*', 0.0, 1.0, 0.5, step=0.1)
-
-    schedule, tot_dis, worst_off, coverage = find_schedule(instance, weight_over=10, weight_under=100, include_satisf = True)  # returns NSP and sol
-    schedule, tot_dis_BM, worst_off_BM, coverage_BM = find_schedule(instance, weight_over=10,
-                                                           weight_under=100, include_satisf = False)  # returns NSP and sol
-
-    total_dissat_runs.append(tot_dis)
-    worst_off_runs.append(worst_off)
-    cover_runs.append(coverage/100)
-    total_dissat_BMs.append(tot_dis_BM)
-    worst_off_BMs.append(worst_off_BM)
-    coverage_BMs.append(coverage_BM/100)
+if __name__ == '__main__':
+    # random pref_alpha per nurse on instance 1, each run solved with and without satisfaction in the objective
+    results = simulate(runs, seed=seed, workers=workers, threads=threads, weight_over=10, weight_under=100)
+    runs = len(results)
+    total_dissat_runs = [result['total_dissat'] for result in results]
+    worst_off_runs = [result['worst_off'] for result in results]
+    cover_runs = [result['coverage'] / 100 for result in results]
+    total_dissat_BMs = [result['total_dissat_BM'] for result in results]
+    worst_off_BMs = [result['worst_off_BM'] for result in results]
+    coverage_BMs = [result['coverage_BM'] / 100 for result in results]
     # TODO: show also schedules with same coverage but lower satisfaction scores (obj = coverage only)
 
-plt.plot(np.arange(runs), total_dissat_BMs, color='red', label='BM dissatisfaction penalty (sum)')
-plt.plot(np.arange(runs), worst_off_BMs, color='red', label = 'BM worst off (dissatisfaction)')
-plt.plot(np.arange(runs), coverage_BMs, color='orange', label='BM (under)coverage penalty')
+    plt.plot(np.arange(runs), total_dissat_BMs, color='red', label='BM dissatisfaction penalty (sum)')
+    plt.plot(np.arange(runs), worst_off_BMs, color='red', label = 'BM worst off (dissatisfaction)')
+    plt.plot(np.arange(runs), coverage_BMs, color='orange', label='BM (under)coverage penalty')
 
-plt.plot(np.arange(runs), total_dissat_runs, color='green', label='dissatisfaction penalty (sum)')
-plt.plot(np.arange(runs), worst_off_runs, color='green', label = 'worst off (dissatisfaction)')
-plt.plot(np.arange(runs), cover_runs, color='orange', label='(under)coverage penalty')
-plt.title(f'Result for {runs} simulation runs')
-plt.xlabel('run')
-plt.ylabel('objective')
-#plt.legend(loc='upper right')
-plt.savefig(f'simulation results/Simulation results for {runs} runs.png')
-plt.show()
+    plt.plot(np.arange(runs), total_dissat_runs, color='green', label='dissatisfaction penalty (sum)')
+    plt.plot(np.arange(runs), worst_off_runs, color='green', label = 'worst off (dissatisfaction)')
+    plt.plot(np.arange(runs), cover_runs, color='orange', label='(under)coverage penalty')
+    plt.title(f'Result for {runs} simulation runs')
+    plt.xlabel('run')
+    plt.ylabel('objective')
+    #plt.legend(loc='upper right')
+    plt.savefig(f'simulation results/Simulation results for {runs} runs.png')
+    plt.show()
@@ -1,8 +1,22 @@
+import os
+import hashlib
+import json
+import time
+import tempfile
+import tracemalloc
+from collections import OrderedDict
+from itertools import islice
 import pandas as pd
 from dataclasses import dataclass, field
 from docplex.mp.model import Model
+from docplex.mp.progress import ProgressClock, ProgressListener, SolutionListener
 import numpy as np
 
+instances_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instances1_24')
+cache_path = os.path.join(instances_path, '.cache')
+cache_version = 1  # bump when the cached layout changes, old cache files are then ignored
+cache_stats = {'hits': 0, 'misses': 0}
+
 
 # instance has ID, nurses, shifts, days and time horizon
 @dataclass
@@ -18,6 +32,18 @@ class Instance:
     best_sum_viol_req: int = 1000
     worst_off_sat: int = 1000
     total_dissat: int = 1000
+    req_on_weights: np.ndarray = None  # nurse x day x shift, day index starts at zero
+    req_off_weights: np.ndarray = None  # nurse x day x shift, day index starts at zero
+    cover_req: np.ndarray = None  # day x shift
+    cover_weight_under: np.ndarray = None  # day x shift
+    cover_weight_over: np.ndarray = None  # day x shift
+    domain: np.ndarray = None  # nurse x day x shift, True if the assignment survives presolve
+    symmetry: dict = None  # classes and nurses in them per level of symmetry_classes (contract, days off, identical)
+    build_profile: dict = None  # BuildProfiler report of the last find_schedule(..., profile=...)
+    assignment: set = None  # (nurse, day, shift) worked in the last find_schedule solution, day starts at 1
+    solution: np.ndarray = None  # nurse x day, shift worked in the last find_schedule solution or -1, day starts at 0
+    incumbents: list = None  # (seconds, objective, neighbourhood) of every improvement of the last lns run
+    solve_details: dict = None  # backend, status, objective, bound, gap, seconds and coverage penalty of the last solve
     D: set = field(init=False)
     W: list = field(init=False)
 
@@ -28,6 +54,60 @@ class Instance:
         self.D = set(range(1, self.horizon + 1))  # days
         self.W = list(range(1, int(self.horizon / 7 + 1)))  # weekends
 
+    # presolve: drop (nurse, day, shift) assignments that the hard constraints exclude on their own, i.e. shifts with
+    # a max of 0, days off, shifts longer than the nurse's max minutes and weekend days of nurses with max 0 weekends
+    def presolve(self):
+        shifts = sorted(self.S, key=lambda shift: shift.numerical_ID)
+        lengths = np.array([shift.length_in_min for shift in shifts])
+        weekend_days = [day - 1 for w in self.W for day in (7 * w - 1, 7 * w)]
+        domain = np.ones((len(self.N), self.horizon, len(self.S)), dtype=bool)
+        for nurse in self.N:
+            i = nurse.numerical_ID
+            domain[i, :, [nurse.max_shifts.get(shift.shift_ID) == 0 for shift in shifts]] = False
+            domain[i, :, lengths > nurse.max_total_minutes] = False
+            domain[i, [day for day in nurse.days_off if day < self.horizon]] = False
+            if nurse.max_weekends == 0:
+                domain[i, weekend_days] = False
+        self.domain = domain
+        print(f'Presolve {self}: {domain.sum()} of {domain.size} assignments remain '
+              f'({1 - domain.sum() / domain.size:.1%} pruned)')
+        return domain
+
+    # classes of interchangeable nurses: same contract (shift limits, minutes, consecutiveness and weekend limits),
+    # days off, requests and preferences, so swapping their rows in a schedule gives a schedule of the same objective
+    # returns the classes of two or more nurses (numerical_IDs, ascending), the nr. of classes and of nurses in them
+    # are stored in symmetry, also for the coarser grouping by contract only and by contract and days off
+    def symmetry_classes(self):
+        shifts = sorted(self.S, key=lambda shift: shift.numerical_ID)
+
+        def contract(nurse):
+            return (tuple(nurse.max_shifts.get(shift.shift_ID) for shift in shifts), nurse.max_total_minutes,
+                    nurse.min_total_minutes, nurse.max_consecutive_shifts, nurse.min_consecutive_shifts,
+                    nurse.min_consecutive_days_off, nurse.max_weekends)
+
+        def days_off(nurse):
+            return contract(nurse) + (tuple(sorted(day for day in nurse.days_off if day < self.horizon)),)
+
+        def identical(nurse):
+            i = nurse.numerical_ID
+            return days_off(nurse) + (self.req_on_weights[i].tobytes(), self.req_off_weights[i].tobytes(),
+                                      nurse.pref_alpha, nurse.pref_min_cons, nurse.pref_max_cons)
+
+        self.symmetry = {}
+        classes_by_level = {}
+        for level, key in [('contract', contract), ('days_off', days_off), ('identical', identical)]:
+            groups = {}
+            for nurse in sorted(self.N, key=lambda nurse: nurse.numerical_ID):
+                groups.setdefault(key(nurse), []).append(nurse.numerical_ID)
+            classes = classes_by_level[level] = [members for members in groups.values() if len(members) > 1]
+            self.symmetry[level] = {'classes': len(classes), 'nurses': sum(map(len, classes)),
+                                    'largest': max(map(len, classes), default=1)}
+        print(f"Symmetry {self}: {self.symmetry['identical']['nurses']} of {len(self.N)} nurses in "
+              f"{self.symmetry['identical']['classes']} classes of interchangeable nurses (same contract: "
+              f"{self.symmetry['contract']['nurses']} in {self.symmetry['contract']['classes']}, same contract and "
+              f"days off: {self.symmetry['days_off']['nurses']} in {self.symmetry['days_off']['classes']})")
+        return classes_by_level['identical']
+
     def __hash__(self):
         return hash(self.instance_ID)
 
@@ -97,7 +177,7 @@ class Shift:
     numerical_ID: int
     shift_ID: str
     length_in_min: int
-    cover_req: dict
+    cover_req: np.ndarray  # requirement per day (column of Instance.cover_req)
     shifts_cannot_follow_this: list  # u must be the numerical shift ID of the shift that cannot follow shift t
 
     def __str__(self):
@@ -111,6 +191,12 @@ class Shift:
         return self.shift_ID == other.shift_ID
 
 
+# block lengths that violate the nurse's consecutiveness preference (a block can not span the whole horizon)
+def penalized_lengths(nurse, time_horizon):
+    return [r for r in list(range(1, nurse.pref_min_cons)) +
+            list(range(nurse.pref_max_cons + 1, nurse.max_consecutive_shifts + 1)) if r < time_horizon]
+
+
 def calc_cons_penalty(consecutiveness, pref_min, pref_max):
     if pref_min <= consecutiveness <= pref_max:
         return 0
@@ -120,300 +206,713 @@ def calc_cons_penalty(consecutiveness, pref_min, pref_max):
         return pow(2, 2 * (consecutiveness - pref_max))
 
 
-def find_schedule(instance, weight_under=100, weight_over=10, vis_schedule=True, include_satisf = True):
-    S = instance.S
-    N = instance.N
-    W = instance.W
-    time_horizon = instance.horizon
-    D = instance.D
-
-    # define MIP
-    NSP = Model('NSP')
-    NSP.float_precision = 10
-    NSP.context.cplex_parameters.mip.tolerances.mipgap = 0  # check if gap is always 0 ensured
-    NSP.set_time_limit(5 * 60)  # seconds
-
-    # decision variables
-    x = NSP.binary_var_dict((i, d, s) for i in range(len(N)) for d in range(1, time_horizon + 1) for s in range(len(S)))
-    k = NSP.binary_var_matrix(len(N), range(1, len(W) + 1), name="w")
-    y = NSP.integer_var_matrix(range(1, time_horizon + 1), len(S), name="y")
-    z = NSP.integer_var_matrix(range(1, time_horizon + 1), len(S), name="z")
-    c = NSP.binary_var_dict((i, d, r) for i in range(len(N)) for d in range(1, time_horizon + 1) for r in range(1, 11))
-    obj_worst_off = NSP.continuous_var(lb=0, name="worst-off penalty")
-    obj_total_dissatisfaction = NSP.continuous_var(lb=0, name="Total sum of dissatisfaction (penalties) of all nurses")
-    obj_cover = NSP.continuous_var(lb=0, name='Coverage penalty')
-
-    # objective function (coverage)
-    NSP.add_constraint(
-    obj_cover == NSP.sum([y[day, shift.numerical_ID] * weight_under + z[
-        day, shift.numerical_ID] * weight_over for shift in S for day in D]))
-
-    if include_satisf:
-        NSP.set_objective('min',  obj_cover + obj_total_dissatisfaction + obj_worst_off)
-    else:
-        NSP.set_objective('min', obj_cover)
-    for nurse in N:
-        # for r in range(nurse.pref_max_cons + 1, 11):
-        #     for d in range(1, time_horizon + 2 - r):
-        #         # TODO nog voor alle shift types na instanc 1 test TODO
-        #         NSP.add(NSP.if_then(NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) == r, c[nurse.numerical_ID, d, r] >= 0.5))
-        #         NSP.add(NSP.if_then(NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) != r, c[nurse.numerical_ID, d, r] <= 0.5))
-
-    # consecutiveness measurement for violations min. pref (copied)        # if assume pref_max > pref_min, c_min can be c
-        for r in range(1, 11):
-            # count min cons violations
-            d = 1
-            NSP.add(NSP.if_then((1 - x[nurse.numerical_ID, d + r, 0]) +
-                                  NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) == r + 1, c[nurse.numerical_ID, d, r] >= 0.5))
-            NSP.add(NSP.if_then((1 - x[nurse.numerical_ID, d + r, 0]) +
-                                NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) != r + 1,
-                                c[nurse.numerical_ID, d, r] <= 0.5))
-
-            # TODO nog voor alle shift types na instance 1 test TODO
-
-            for d in range(2, time_horizon + 1 - r): # check d's
-                NSP.add(NSP.if_then((1 - x[nurse.numerical_ID, d - 1, 0]) + (1 - x[nurse.numerical_ID, d + r, 0]) +
-                                      NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) == r + 2,
-                                      c[nurse.numerical_ID, d, r] >= 0.5)) # TODO nog voor alle shift types na instanc 1 test TODO
-                NSP.add(NSP.if_then((1 - x[nurse.numerical_ID, d - 1, 0]) + (1 - x[nurse.numerical_ID, d + r, 0]) +
-                                    NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) != r + 2,
-                                    c[nurse.numerical_ID, d, r]<=0.5))
-                                    # c[n, d, r] when c[n, d, -1] is NaN and should use 0
-            d = time_horizon + 1 - r
-            NSP.add(NSP.if_then((1 - x[nurse.numerical_ID, d - 1, 0]) +
-                                  NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) == r + 1,
-                                  c[nurse.numerical_ID, d, r] >= 0.5))  # TODO nog voor alle shift types na instance 1 test
-
-            NSP.add(NSP.if_then((1 - x[nurse.numerical_ID, d - 1, 0]) +
-                                  NSP.sum([x[nurse.numerical_ID, day, 0] for day in range(d, d + r)]) != r + 1,
-                                  c[nurse.numerical_ID, d, r] <= 0.5))  # TODO nog voor alle shift types na instance 1 test
-
-    # auxiliary constraint (maximin criterion), # objective function (satisfaction)
-    df_on = instance.req_on
-    df_off = instance.req_off
-
-    for nurse in N:
-        obj_consecutiveness = 0
-        obj_requests = 0
-        for r in range(nurse.pref_max_cons + 1, nurse.max_consecutive_shifts + 1):
-            obj_consecutiveness = obj_consecutiveness + NSP.sum(
-                     [c[nurse.numerical_ID, d, r] for d in range(1, time_horizon + 2 - r)])
-
-        for r in range(1, nurse.pref_min_cons):
-            obj_consecutiveness = obj_consecutiveness + NSP.sum(
-                     [c[nurse.numerical_ID, d, r] for d in range(1, time_horizon + 2 - r)])
-
-        for shift in S:
-            for day in D:
-                # check if nurse has request for this shift, day
-                if df_off.loc[(df_off['EmployeeID'] == nurse.nurse_ID) & (df_off['ShiftID'] == shift.shift_ID) & (
-                        df_off['Day'] == day - 1)].Weight.any():
-                    # if yes, add to obj_requests if violated
-                    obj_requests = obj_requests + (
-                            x[nurse.numerical_ID, day, shift.numerical_ID] * df_off.loc[
-                        (df_off['EmployeeID'] == nurse.nurse_ID) & (df_off['ShiftID'] == shift.shift_ID) & (
-                                df_off['Day'] == day - 1)].Weight.item())
-
-                    # check if nurse has request for this shift, day
-                if df_on.loc[(df_on['EmployeeID'] == nurse.nurse_ID) & (df_on['ShiftID'] == shift.shift_ID) & (
-                        df_on['Day'] == day - 1)].Weight.any():
-                    # if yes, add to obj_requests if violated
-                    obj_requests = obj_requests + (
-                            (1 - x[nurse.numerical_ID, day, shift.numerical_ID]) * df_on.loc[
-                        (df_on['EmployeeID'] == nurse.nurse_ID) & (df_on['ShiftID'] == shift.shift_ID) & (
-                                df_on['Day'] == day - 1)].Weight.item())
-
-        total_penalty_per_nurse = nurse.pref_alpha * obj_consecutiveness + (
-                    1 - nurse.pref_alpha) * obj_requests
-        NSP.add_constraint(obj_worst_off >= total_penalty_per_nurse)
-        obj_total_dissatisfaction = obj_total_dissatisfaction + total_penalty_per_nurse
-
-    # constraint 1, max one shift per day per nurse
-    for day in D:
-        for nurse in N:
-            NSP.add_constraint(sum([x[nurse.numerical_ID, day, shift.numerical_ID] for shift in S]) <= 1,
-                               'max. one shift per day')
-
-    # constraint 2, shift rotation (not in instance 1 so still needs to be tested)
-    for nurse in N:
-        for day in range(1, time_horizon):
-            for shift in S:
-                for u in shift.shifts_cannot_follow_this:  # u must be the numerical shift ID of the shift that cannot follow shift t
-                    x[nurse.numerical_ID, day, shift.numerical_ID] + x[nurse.numerical_ID, day + 1, u] <= 1
+# opt-in build profile of find_schedule: wall time, constraints, variables and nonzeros per model family,
+# memory=True also traces the Python allocations per family (tracemalloc makes the build itself slower)
+class BuildProfiler:
+    constraint_kinds = ['linear', 'indicator', 'equivalence']
+
+    def __init__(self, model, memory=False):
+        self.model = model
+        self.memory = memory
+        self.families = {}
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.start()
+
+    def counts(self):
+        return {kind: getattr(self.model, f'number_of_{kind}_constraints') for kind in self.constraint_kinds}
+
+    def number_of_variables(self):
+        return self.model.number_of_variables
+
+    def start(self):
+        self.before = self.counts()
+        self.variables = self.number_of_variables()
+        if self.memory:
+            tracemalloc.reset_peak()
+            self.allocated = tracemalloc.get_traced_memory()[0]
+        self.time = time.perf_counter()
+
+    def nonzeros(self):
+        # linear rows count their terms, indicator and equivalence constraints their row plus the binary
+        nonzeros = sum(ct.size for ct in islice(self.model.iter_linear_constraints(), self.before['linear'], None))
+        for kind in self.constraint_kinds[1:]:
+            cts = islice(getattr(self.model, f'iter_{kind}_constraints')(), self.before[kind], None)
+            nonzeros += sum(ct.linear_constraint.size + 1 for ct in cts)
+        return nonzeros
+
+    # close the family that ran since the previous checkpoint, a family that comes back is added up
+    def checkpoint(self, name):
+        seconds = time.perf_counter() - self.time
+        family = {'seconds': round(seconds, 4),
+                  'constraints': sum(self.counts().values()) - sum(self.before.values()),
+                  'variables': self.number_of_variables() - self.variables,
+                  'nonzeros': self.nonzeros()}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            family['allocated_kb'] = round((current - self.allocated) / 1024)
+            family['peak_kb'] = round((peak - self.allocated) / 1024)
+        for key, value in self.families.get(name, {}).items():
+            family[key] = round(family[key] + value, 4)
+        self.families[name] = family
+        self.start()
+
+    def report(self):
+        total = {key: sum(family[key] for family in self.families.values())
+                 for key in ['seconds', 'constraints', 'variables', 'nonzeros']}
+        total['seconds'] = round(total['seconds'], 4)
+        return {'model': self.model.name, 'families': self.families, 'total': total}
+
+
+def relative_gap(objective, bound):
+    return None if bound is None else abs(objective - bound) / max(abs(objective), 1e-10)
+
+
+# anytime progress of a solve (progress= of find_schedule and solve): every better incumbent as seconds since the
+# start of the solve, objective, best bound, gap and objective components is kept in incumbents, passed to callback and
+# appended to log_file as a JSON line; the solve stops early once the objective is at most target, the gap at most gap
+# or no better incumbent came for stall seconds, stopped tells which rule ended it (None: the solver did)
+class ProgressLog:
+    def __init__(self, callback=None, log_file=None, target=None, gap=None, stall=None):
+        self.callback = callback
+        self.log_file = log_file
+        self.target = target
+        self.gap = gap
+        self.stall = stall
+        self.start()
+
+    def start(self):
+        self.incumbents = []
+        self.stopped = None
+
+    # a new incumbent, True if a stop rule holds
+    def record(self, seconds, objective, bound, **components):
+        if self.incumbents and objective >= self.incumbents[-1]['objective']:
+            return self.check(seconds, bound)
+        incumbent = {'seconds': round(float(seconds), 4), 'objective': float(objective),
+                     'bound': None if bound is None else float(bound), 'gap': relative_gap(objective, bound),
+                     **{key: float(value) for key, value in components.items()}}
+        self.incumbents.append(incumbent)
+        if self.callback:
+            self.callback(incumbent)
+        if self.log_file:
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(incumbent) + '\n')
+        return self.check(seconds, bound)
+
+    # True if a stop rule holds at seconds with best bound bound (None: the bound of the last incumbent)
+    def check(self, seconds, bound=None):
+        if self.stopped or not self.incumbents:
+            return bool(self.stopped)
+        best = self.incumbents[-1]
+        gap = relative_gap(best['objective'], best['bound'] if bound is None else bound)
+        if self.target is not None and best['objective'] <= self.target + 1e-9:
+            self.stopped = f'target {self.target} reached'
+        elif self.gap is not None and gap is not None and gap <= self.gap:
+            self.stopped = f'gap {gap:.4f} at most {self.gap}'
+        elif self.stall is not None and seconds - best['seconds'] >= self.stall:
+            self.stopped = f'no better incumbent for {self.stall} s'
+        return self.stopped is not None
+
+    # seconds to the first incumbent with an objective at most objective (None: not reached)
+    def time_to(self, objective):
+        return next((incumbent['seconds'] for incumbent in self.incumbents
+                     if incumbent['objective'] <= objective + 1e-9), None)
+
+
+# CPLEX side of a ProgressLog: IncumbentListener records every better incumbent with its objective components,
+# StopListener checks the stop rules on every call from CPLEX
+class IncumbentListener(SolutionListener):
+    def __init__(self, nsp_model, progress):
+        super().__init__(ProgressClock.Objective, absdiff=1e-6, reldiff=1e-9)
+        self.nsp_model = nsp_model
+        self.progress = progress
+
+    def notify_solution(self, sol):
+        data, nsp_model = self.current_progress_data, self.nsp_model
+        self.progress.record(data.time, data.current_objective, data.best_bound,
+                             coverage_penalty=sol.get_value(nsp_model.obj_cover),
+                             worst_off=sol.get_value(nsp_model.obj_worst_off),
+                             total_dissat=sol.get_value(nsp_model.obj_total_dissatisfaction))
+
+
+class StopListener(ProgressListener):
+    def __init__(self, progress):
+        super().__init__(ProgressClock.All)
+        self.progress = progress
+
+    def notify_progress(self, data):
+        if self.progress.check(data.time, data.best_bound):
+            self.abort()
+
+
+# NSP model of an instance, built once: nurse preferences, coverage weights and the objective mode can be changed in
+# place between solves, only the worst-off rows, the coverage row and the objective are replaced.
+# cons_formulation 'indicator' counts consecutive blocks with if_then constraints for every length 1-10,
+# 'linear' only creates block variables for the lengths that are penalized and links them with linear constraints
+# (so a change of pref_min_cons/pref_max_cons that penalizes a length without block variables needs a new model)
+# weight_under/weight_over are the coverage weights of the objective (100 per nurse short, 10 per nurse over), None
+# uses the per day and shift weights of the instance instead
+# profile=True stores a BuildProfiler report in instance.build_profile, profile='memory' adds allocations per family
+# threads limits the CPLEX threads (None uses CPLEX's default of all cores), e.g. when solves run in parallel
+class NSPModel:
+    def __init__(self, instance, cons_formulation='indicator', profile=False, time_limit=5 * 60, threads=None,
+                 weight_under=100, weight_over=10, include_satisf=True, symmetry=False):
+        S = instance.S
+        N = instance.N
+        W = instance.W
+        time_horizon = instance.horizon
+        D = instance.D
+
+        # define MIP
+        NSP = Model('NSP')
+        NSP.float_precision = 10
+        NSP.context.cplex_parameters.mip.tolerances.mipgap = 0  # check if gap is always 0 ensured
+        NSP.set_time_limit(time_limit)  # seconds
+        if threads is not None:
+            NSP.context.cplex_parameters.threads = threads
+
+        self.profiler = BuildProfiler(NSP, memory=profile == 'memory') if profile else None
+        checkpoint = self.checkpoint
+
+        # decision variables, x only exists for the assignments that survive presolve
+        domain = instance.presolve()
+        x = NSP.binary_var_dict((i, d + 1, s) for i, d, s in np.argwhere(domain).tolist())
+        k = NSP.binary_var_matrix(len(N), range(1, len(W) + 1), name="w")
+        y = NSP.integer_var_matrix(range(1, time_horizon + 1), len(S), name="y")
+        z = NSP.integer_var_matrix(range(1, time_horizon + 1), len(S), name="z")
+        obj_worst_off = NSP.continuous_var(lb=0, name="worst-off penalty")
+        obj_cover = NSP.continuous_var(lb=0, name='Coverage penalty')
+        checkpoint('variables')
+
+        # assignment variables per nurse and day, shared by the consecutiveness and constraint families below
+        day_vars = {(i, day): [] for i in range(len(N)) for day in D}
+        nurse_keys = {i: [] for i in range(len(N))}
+        for (i, day, s), var in x.items():
+            day_vars[i, day].append(var)
+            nurse_keys[i].append((i, day, s))
+
+        def window_vars(i, first, last):
+            return [var for day in range(first, last + 1) for var in day_vars[i, day]]
+
+        # consecutiveness: c[n, d, r] = 1 if nurse n works a block of exactly r days (any shift) starting on day d
+        # no block variable for blocks that contain a day on which the nurse can not work at all
+        def workable(i, d, r):
+            return all(day_vars[i, day] for day in range(d, d + r))
+
+        if cons_formulation == 'indicator':
+            block_lengths = {nurse.numerical_ID: list(range(1, 11)) for nurse in N}
+            c = NSP.binary_var_dict((nurse.numerical_ID, d, r) for nurse in N for r in range(1, 11)
+                                    for d in range(1, time_horizon + 2 - r) if workable(nurse.numerical_ID, d, r))
+
+            def block_pattern(i, d, r):
+                # days worked in the block plus neighbours off, equals r + nr. of neighbours for a block of exactly r
+                neighbours = [day for day in [d - 1, d + r] if day in D]
+                return NSP.sum(1 - NSP.sum_vars(day_vars[i, day]) for day in neighbours) + \
+                    NSP.sum_vars(window_vars(i, d, d + r - 1)), r + len(neighbours)
 
-    # constraint 3: personal shift limitations
-    for shift in S:
+            # count min cons violations
+            for i, d, r in c:
+                pattern, target = block_pattern(i, d, r)
+                NSP.add(NSP.if_then(pattern == target, c[i, d, r] >= 0.5))
+                pattern, target = block_pattern(i, d, r)
+                NSP.add(NSP.if_then(pattern != target, c[i, d, r] <= 0.5))
+        else:
+            block_lengths = {nurse.numerical_ID: penalized_lengths(nurse, time_horizon) for nurse in N}
+            c = NSP.binary_var_dict((nurse.numerical_ID, d, r) for nurse in N
+                                    for r in penalized_lengths(nurse, time_horizon)
+                                    for d in range(1, time_horizon + 2 - r) if workable(nurse.numerical_ID, d, r))
+
+            def block_constraints(i, d, r):
+                block = window_vars(i, d, d + r - 1)
+                neighbours = [day for day in [d - 1, d + r] if day in D]
+                neighbour_vars = [var for day in neighbours for var in day_vars[i, day]]
+                # all r days worked and both neighbours off -> block
+                yield NSP.scal_prod(block + neighbour_vars + [c[i, d, r]],
+                                    [1] * len(block) + [-1] * len(neighbour_vars) + [-1]) <= r - 1
+                # block -> all r days worked, neighbours off
+                yield r * c[i, d, r] <= NSP.sum_vars(block)
+                for day in neighbours:
+                    yield c[i, d, r] + NSP.sum_vars(day_vars[i, day]) <= 1
+
+            NSP.add_constraints(ct for i, d, r in c for ct in block_constraints(i, d, r))
+        checkpoint('consecutiveness')
+
+        # request penalty per nurse (objective function satisfaction), does not depend on the preferences
+        # violated off request: nurse works the shift, violated on request: nurse does not work the shift
+        # (a pruned assignment is never worked, so its on request is a constant penalty)
+        obj_requests = {}
         for nurse in N:
-            NSP.add_constraint(
-                sum([x[nurse.numerical_ID, day, shift.numerical_ID] for day in D]) <= nurse.max_shifts.get(
-                    shift.shift_ID))
-
-    # constraint 4: FTE
-    for nurse in N:
-        NSP.add_constraint(nurse.min_total_minutes <= sum(
-            [sum([x[nurse.numerical_ID, day, shift.numerical_ID] * shift.length_in_min for shift in S]) for day in D]))
-        NSP.add_constraint(
-            sum([sum([x[nurse.numerical_ID, day, shift.numerical_ID] * shift.length_in_min for shift in S]) for day in
-                 D]) <= nurse.max_total_minutes)
-
-    # constraint 5: max consecutive shifts
-    for nurse in N:
-        for day in range(1, time_horizon - nurse.max_consecutive_shifts + 1):
-            NSP.add_constraint(sum([x[nurse.numerical_ID, j, shift.numerical_ID] for shift in S for j in range(day,
-                                                                                                               day + nurse.max_consecutive_shifts + 1)]) <= nurse.max_consecutive_shifts)
-    # constraint 6: min consecutiveness
-    for nurse in N:
-        for s in range(1, nurse.min_consecutive_shifts):
-            for day in range(1, time_horizon - (s + 1)):
-                NSP.add_constraint(sum([x[nurse.numerical_ID, day, shift.numerical_ID] for shift in S]) + (s - sum(
-                    [x[nurse.numerical_ID, j, shift.numerical_ID] for shift in S for j in
-                     range(day + 1, day + s + 1)])) + sum(
-                    [x[nurse.numerical_ID, day + s + 1, shift.numerical_ID] for shift in S]) >= 0.01)
-
-    # constraint 7: min consecutiveness days off
-    for nurse in N:
-        for s in range(1, nurse.min_consecutive_days_off):
-            for day in range(1, time_horizon - (s + 1)):
-                NSP.add_constraint(1 - sum([x[nurse.numerical_ID, day, shift.numerical_ID] for shift in S]) + (sum(
-                    [x[nurse.numerical_ID, j, shift.numerical_ID] for shift in S for j in
-                     range(day + 1, day + s + 1)])) + 1 - sum(
-                    [x[nurse.numerical_ID, day + s + 1, shift.numerical_ID] for shift in S]) >= 0.01)
-
-    # # constraint 8: max weekends
-    for nurse in N:
-        for w in W:
-            NSP.add_constraint(k[nurse.numerical_ID, w] <= sum(
-                [x[nurse.numerical_ID, (7 * w - 1), shift.numerical_ID] for shift in S]) + sum(
-                [x[nurse.numerical_ID, 7 * w, shift.numerical_ID] for shift in S]))
-            NSP.add_constraint(sum([x[nurse.numerical_ID, (7 * w - 1), shift.numerical_ID] for shift in S]) + sum(
-                [x[nurse.numerical_ID, 7 * w, shift.numerical_ID] for shift in S]) <= 2 * k[nurse.numerical_ID, w])
-
-    for nurse in N:
-        NSP.add_constraint(sum([k[nurse.numerical_ID, w] for w in W]) <= nurse.max_weekends)
-
-    # constraint 9: days off
+            off_weights = instance.req_off_weights[nurse.numerical_ID]
+            on_weights = instance.req_on_weights[nurse.numerical_ID]
+            obj_requests[nurse.numerical_ID] = NSP.sum(
+                [off_weights[d, s] * x.get((nurse.numerical_ID, d + 1, s), 0) for d, s in
+                 np.argwhere(off_weights).tolist()]) + NSP.sum(
+                [on_weights[d, s] * (1 - x.get((nurse.numerical_ID, d + 1, s), 0)) for d, s in
+                 np.argwhere(on_weights).tolist()])
+        checkpoint('objective')
+
+        def nontrivial(cts):
+            # a row whose variables are all pruned is a constant that docplex evaluates to True,
+            # an infeasible False is kept
+            return (ct for ct in cts if ct is not True)
+
+        # constraint 1, max one shift per day per nurse
+        NSP.add_constraints(nontrivial(NSP.sum_vars(day_vars[nurse.numerical_ID, day]) <= 1
+                                       for day in D for nurse in N), 'max. one shift per day')
+        checkpoint('constraint 1')
+
+        # constraint 2, shift rotation: none of the shifts that cannot follow shift is worked the next day
+        def rotation_vars(i, day, t, forbidden):
+            following = [x[i, day + 1, u] for u in forbidden if (i, day + 1, u) in x]
+            return [x[i, day, t]] + following if following and (i, day, t) in x else []
+
+        rotations = (rotation_vars(nurse.numerical_ID, day, shift.numerical_ID, shift.shifts_cannot_follow_this)
+                     for nurse in N for day in range(1, time_horizon) for shift in S if shift.shifts_cannot_follow_this)
+        NSP.add_constraints(NSP.sum_vars(rotation) <= 1 for rotation in rotations if rotation)
+        checkpoint('constraint 2')
+
+        # constraint 3: personal shift limitations (shifts with a max of 0 are pruned)
+        NSP.add_constraints(
+            NSP.sum_vars(x[nurse.numerical_ID, day, shift.numerical_ID] for day in D
+                         if (nurse.numerical_ID, day, shift.numerical_ID) in x) <= nurse.max_shifts.get(shift.shift_ID)
+            for shift in S for nurse in N if domain[nurse.numerical_ID, :, shift.numerical_ID].any())
+        checkpoint('constraint 3')
+
+        # constraint 4: FTE
+        shift_lengths = [shift.length_in_min for shift in sorted(S, key=lambda shift: shift.numerical_ID)]
+        minutes = {nurse: NSP.scal_prod([x[key] for key in nurse_keys[nurse.numerical_ID]],
+                                        [shift_lengths[key[2]] for key in nurse_keys[nurse.numerical_ID]])
+                   for nurse in N}
+        NSP.add_constraints(nontrivial(nurse.min_total_minutes <= minutes[nurse] for nurse in N))
+        NSP.add_constraints(nontrivial(minutes[nurse] <= nurse.max_total_minutes for nurse in N))
+        checkpoint('constraint 4')
+
+        # constraint 5: max consecutive shifts
+        NSP.add_constraints(nontrivial(
+            NSP.sum_vars(window_vars(nurse.numerical_ID, day, day + nurse.max_consecutive_shifts)) <=
+            nurse.max_consecutive_shifts
+            for nurse in N for day in range(1, time_horizon - nurse.max_consecutive_shifts + 1)))
+        checkpoint('constraint 5')
+
+        # constraint 6: min consecutiveness
+        def min_consecutive_block(i, day, s, sign):
+            # worked on day and day + s + 1 with sign, days in between with -sign
+            inside = window_vars(i, day + 1, day + s)
+            outside = day_vars[i, day] + day_vars[i, day + s + 1]
+            return NSP.scal_prod(outside + inside, [sign] * len(outside) + [-sign] * len(inside))
+
+        NSP.add_constraints(nontrivial(
+            min_consecutive_block(nurse.numerical_ID, day, s, 1) + s >= 0.01
+            for nurse in N for s in range(1, nurse.min_consecutive_shifts) for day in range(1, time_horizon - (s + 1))))
+        checkpoint('constraint 6')
+
+        # constraint 7: min consecutiveness days off
+        NSP.add_constraints(nontrivial(
+            min_consecutive_block(nurse.numerical_ID, day, s, -1) + 2 >= 0.01
+            for nurse in N for s in range(1, nurse.min_consecutive_days_off)
+            for day in range(1, time_horizon - (s + 1))))
+        checkpoint('constraint 7')
+
+        # # constraint 8: max weekends
+        weekend = {(nurse, w): NSP.sum_vars(window_vars(nurse.numerical_ID, 7 * w - 1, 7 * w))
+                   for nurse in N for w in W}
+        NSP.add_constraints(nontrivial(k[nurse.numerical_ID, w] <= weekend[nurse, w] for nurse in N for w in W))
+        NSP.add_constraints(nontrivial(weekend[nurse, w] <= 2 * k[nurse.numerical_ID, w] for nurse in N for w in W))
+        NSP.add_constraints(NSP.sum_vars(k[nurse.numerical_ID, w] for w in W) <= nurse.max_weekends for nurse in N)
+        checkpoint('constraint 8')
+
+        # constraint 9: days off, enforced by presolve (no x variables on days off)
+
+        # constraint 10: cover requirements
+        cover_cells = [(day, s) for day in range(1, time_horizon + 1) for s in range(len(S))]
+        cover_req = instance.cover_req.tolist()
+        NSP.add_constraints(
+            NSP.sum_vars(x[nurse.numerical_ID, day, s] for nurse in N if (nurse.numerical_ID, day, s) in x) -
+            z[day, s] + y[day, s] == cover_req[day - 1][s]
+            for day, s in cover_cells)
+        checkpoint('constraint 10')
+
+        self.instance = instance
+        self.NSP = NSP
+        self.x, self.c, self.k, self.y, self.z = x, c, k, y, z
+        # variables in key order with their keys as arrays, for one bulk value fetch per family after the solve
+        self.x_index, self.x_vars = np.array(list(x), dtype=int).reshape(-1, 3), list(x.values())
+        self.c_index, self.c_vars = np.array(list(c), dtype=int).reshape(-1, 3), list(c.values())
+        self.x_lb, self.x_ub = np.zeros(len(x), dtype=bool), np.ones(len(x), dtype=bool)
+        self.obj_worst_off = obj_worst_off
+        self.obj_cover = obj_cover
+        self.obj_requests = obj_requests
+        self.block_lengths = block_lengths
+        self.cover_cells = cover_cells
+        self.cover_ct = None
+        self.penalty_cts = []
+        self.epsilon_cts = []
+        self.min_minutes_cts = []
+        self.symmetry_cts = []
+        self.symmetry = symmetry
+        self.classes = []
+        self.fixed = False
+        self.row_key = row_key_weights(instance, 10 ** 6)  # larger coefficients hurt CPLEX numerics
+        self.set_coverage_weights(weight_under, weight_over)
+        self.set_preferences()
+        self.set_objective_mode(include_satisf)
+        checkpoint('objective')
+
+    def checkpoint(self, family):
+        if self.profiler:
+            self.profiler.checkpoint(family)
+
+    def set_coverage_weights(self, weight_under=None, weight_over=None):
+        instance, NSP = self.instance, self.NSP
+        under = instance.cover_weight_under if weight_under is None else np.full(instance.cover_req.shape, weight_under)
+        over = instance.cover_weight_over if weight_over is None else np.full(instance.cover_req.shape, weight_over)
+        if self.cover_ct is not None:
+            NSP.remove_constraint(self.cover_ct)
+        self.cover_ct = NSP.add_constraint(
+            self.obj_cover == NSP.scal_prod([self.y[cell] for cell in self.cover_cells], under.ravel().tolist()) +
+            NSP.scal_prod([self.z[cell] for cell in self.cover_cells], over.ravel().tolist()))
+
+    # rebuilds the penalty per nurse from pref_alpha, pref_min_cons and pref_max_cons of the nurses of the instance,
+    # alphas ({nurse_ID: alpha}) sets pref_alpha first
+    def set_preferences(self, alphas=None):
+        NSP, c = self.NSP, self.c
+        time_horizon = self.instance.horizon
+        for nurse in self.instance.N:
+            if alphas and nurse.nurse_ID in alphas:
+                nurse.pref_alpha = alphas[nurse.nurse_ID]
+            missing = set(penalized_lengths(nurse, time_horizon)) - set(self.block_lengths[nurse.numerical_ID])
+            if missing:
+                raise ValueError(f'Nurse {nurse.nurse_ID} penalizes blocks of length {sorted(missing)} that this '
+                                 f'model has no block variables for, build a new NSPModel')
+
+        # auxiliary constraint (maximin criterion), # objective function (satisfaction)
+        penalties = []
+        for nurse in self.instance.N:
+            obj_consecutiveness = NSP.sum_vars(c[nurse.numerical_ID, d, r]
+                                               for r in penalized_lengths(nurse, time_horizon)
+                                               for d in range(1, time_horizon + 2 - r)
+                                               if (nurse.numerical_ID, d, r) in c)
+            penalties.append(nurse.pref_alpha * obj_consecutiveness +
+                             (1 - nurse.pref_alpha) * self.obj_requests[nurse.numerical_ID])
+
+        if self.penalty_cts:
+            NSP.remove_constraints(self.penalty_cts)
+        self.penalty_cts = NSP.add_constraints(self.obj_worst_off >= total_penalty_per_nurse
+                                               for total_penalty_per_nurse in penalties)
+        self.obj_total_dissatisfaction = NSP.sum(penalties)
+        self.set_symmetry()
+
+    # symmetry breaking (symmetry True): the rows of every class of interchangeable nurses (Instance.symmetry_classes)
+    # in descending row key order (row_key_weights), the classes depend on the preferences, so set_preferences sets
+    # the order again, and a fixed schedule need not be in order, so fix_assignments lifts it until all are freed
+    def set_symmetry(self, symmetry=None):
+        NSP = self.NSP
+        if symmetry is not None:
+            self.symmetry = symmetry
+        if self.symmetry_cts:
+            NSP.remove_constraints(self.symmetry_cts)
+        self.symmetry_cts = []
+        self.classes = self.instance.symmetry_classes() if self.symmetry else []
+        if self.fixed:
+            return
+
+        def row_key(i):
+            keys = [(i, day, s) for day in self.row_key for s in range(len(self.instance.S)) if (i, day, s) in self.x]
+            return NSP.scal_prod([self.x[key] for key in keys], [self.row_key[key[1]] * (key[2] + 1) for key in keys])
+
+        self.symmetry_cts = NSP.add_constraints(row_key(first) >= row_key(second) for members in self.classes
+                                                for first, second in zip(members, members[1:]))
+
+    # include_satisf adds the worst-off penalty to the coverage penalty, the total dissatisfaction is reported but
+    # not minimized (find_schedule set the objective before the penalties were added to its variable)
+    def set_objective_mode(self, include_satisf=True):
+        self.include_satisf = include_satisf
+        self.set_epsilon()
+        self.NSP.clear_multi_objective()
+        if include_satisf:
+            self.NSP.set_objective('min', self.obj_cover + self.obj_worst_off)
+        else:
+            self.NSP.set_objective('min', self.obj_cover)
+
+    # Pareto mode of an epsilon-constraint front: minimizes first, then second (lexicographic), each of them
+    # 'coverage', 'total_dissat' or 'worst_off', with the total dissatisfaction, the worst-off penalty and the coverage
+    # penalty at most total_dissat, worst_off and coverage (None: no bound); set_objective_mode leaves Pareto mode
+    def set_pareto(self, first='coverage', second='total_dissat', total_dissat=None, worst_off=None,
+                   coverage=None):
+        objectives = {'coverage': self.obj_cover, 'total_dissat': self.obj_total_dissatisfaction,
+                      'worst_off': self.obj_worst_off}
+        self.set_epsilon(total_dissat, worst_off, coverage)
+        self.NSP.set_multi_objective('min', [objectives[first], objectives[second]], priorities=[2, 1])
+
+    def set_epsilon(self, total_dissat=None, worst_off=None, coverage=None):
+        if self.epsilon_cts:
+            self.NSP.remove_constraints(self.epsilon_cts)
+        bounds = [(self.obj_total_dissatisfaction, total_dissat), (self.obj_worst_off, worst_off),
+                  (self.obj_cover, coverage)]
+        self.epsilon_cts = self.NSP.add_constraints([expr <= epsilon for expr, epsilon in bounds if epsilon is not None])
+
+    # min minutes of nurses on the first days of the horizon, e.g. up to the end of the commit of a rolling-horizon
+    # window: rows (numerical_ID, days, minutes, worked, off, weekends), the nurse works at least minutes on days 1 to
+    # days if they work on all days of worked, on none of off and on all weekends of weekends (day and weekend numbers
+    # of the model), set_min_minutes() removes them
+    def set_min_minutes(self, minimum=None):
+        NSP = self.NSP
+        if self.min_minutes_cts:
+            NSP.remove_constraints(self.min_minutes_cts)
+        self.min_minutes_cts = []
+        if minimum is None:
+            return
+        lengths = {shift.numerical_ID: shift.length_in_min for shift in self.instance.S}
+        keys = {}
+        for key in self.x:
+            keys.setdefault(key[:2], []).append(key)
+
+        def worked(i, day_numbers):  # shifts of nurse i on the days
+            return NSP.sum(self.x[key] for day in day_numbers for key in keys.get((i, day), []))
+
+        # every day or weekend the nurse does not keep to takes minutes off the row, so it only binds on the pattern
+        self.min_minutes_cts = NSP.add_constraints(
+            NSP.sum(self.x[key] * lengths[key[2]] for day in range(1, days + 1) for key in keys.get((i, day), [])) +
+            minutes * (len(worked_days) - worked(i, worked_days) + worked(i, off_days) +
+                       len(weekends) - NSP.sum(self.k[i, w] for w in weekends)) >= minutes
+            for i, days, minutes, worked_days, off_days, weekends in minimum if minutes > 0)
+
+    # warm start from a prior solution: instance.assignment or instance.solution of an earlier solve or a schedule
+    # DataFrame, every assignment variable gets a value so CPLEX only has to complete the auxiliary variables
+    def set_mip_start(self, mip_start=None):
+        self.NSP.clear_mip_starts()
+        mip_start = start_solution(mip_start, self.instance)
+        if mip_start is not None:
+            if self.symmetry_cts:  # rows of interchangeable nurses in the order of the symmetry breaking
+                mip_start = symmetric_solution(mip_start, self.classes, self.row_key)
+            worked = solution_assignment(mip_start)
+            self.NSP.add_mip_start(self.NSP.new_solution({var: int(key in worked) for key, var in self.x.items()}))
+
+    # fixes the assignment variables to the schedule array solution (nurse x day, shift or -1) with their bounds,
+    # except the (nurse, day, shift) cells where free (nurse x day x shift) is True, fix_assignments() frees them all
+    def fix_assignments(self, solution=None, free=None):
+        lb, ub = assignment_bounds(self.x_index, solution, free)
+        # lower bounds that go down first and lower bounds that go up last, so no variable ever has lb > ub
+        changes = [(self.NSP.change_var_lower_bounds, lb, lb < self.x_lb),
+                   (self.NSP.change_var_upper_bounds, ub, ub != self.x_ub),
+                   (self.NSP.change_var_lower_bounds, lb, lb > self.x_lb)]
+        for change, bounds, changed in changes:
+            if changed.any():
+                change([self.x_vars[j] for j in np.flatnonzero(changed)], bounds[changed].astype(int).tolist())
+        self.x_lb, self.x_ub = lb, ub
+        if self.symmetry and self.fixed != (solution is not None):
+            self.fixed = solution is not None
+            self.set_symmetry()
+
+    # mip_start is a prior solution to start from, see set_mip_start, progress a ProgressLog of the incumbents
+    def solve(self, vis_schedule=True, mip_start=None, progress=None):
+        instance, NSP = self.instance, self.NSP
+        if self.profiler:
+            for family in ['solve', 'post-processing']:  # the report covers the build and the last solve
+                self.profiler.families.pop(family, None)
+            self.profiler.start()
+
+        self.set_mip_start(mip_start)
+        if progress:
+            progress.start()
+            NSP.add_progress_listener(IncumbentListener(self, progress))
+            NSP.add_progress_listener(StopListener(progress))
+        sol = NSP.solve()
+        NSP.clear_progress_listeners()
+        self.checkpoint('solve')
+        if sol is None:
+            raise ValueError(f'CPLEX found no schedule for {instance}: {NSP.solve_details.status}')
+        result = self.report(sol, vis_schedule)
+        report_progress(instance, progress)
+        self.checkpoint('post-processing')
+
+        if self.profiler:
+            instance.build_profile = self.profiler.report()
+            print(json.dumps(instance.build_profile, indent=2))
+        return result
+
+    # schedule array (nurse x day, shift or -1) of a solution with one bulk fetch of x (pruned assignments are off)
+    def solution_array(self, sol):
+        worked = np.zeros(self.instance.domain.shape, dtype=bool)
+        i, day, s = self.x_index.T
+        worked[i, day - 1, s] = np.array(sol.get_values(self.x_vars)) > 0.5
+        return np.where(worked.any(axis=2), worked.argmax(axis=2), -1)
+
+    # satisfaction scores, coverage and the schedule of a solution, stored on the instance and the nurses
+    def report(self, sol, vis_schedule=True):
+        instance, NSP = self.instance, self.NSP
+        print(f"Optimal objective value z = {NSP.objective_value} ({NSP.get_solve_details()}")
+        print(f"Worst off: {sol.get_value(self.obj_worst_off)}")
+        print(f"Total dissat: {sol.get_value(self.obj_total_dissatisfaction)}")
+        details = NSP.solve_details
+        instance.solve_details = {'backend': 'cplex', 'status': details.status, 'objective': NSP.objective_value,
+                                  'bound': details.best_bound, 'gap': details.mip_relative_gap,
+                                  'seconds': details.time, 'coverage_penalty': sol.get_value(self.obj_cover)}
+        if self.symmetry:
+            instance.solve_details['symmetry'] = {**instance.symmetry, 'constraints': len(self.symmetry_cts)}
+
+        # one bulk fetch per variable family, c as the number of blocks per nurse and length
+        blocks = np.zeros((len(instance.N), instance.horizon + 1))
+        np.add.at(blocks, (self.c_index[:, 0], self.c_index[:, 2]), np.round(sol.get_values(self.c_vars)))
+        schedule = report_schedule(instance, self.solution_array(sol), blocks, vis_schedule)
+        if vis_schedule:
+            return schedule, sol.get_value(self.obj_total_dissatisfaction), sol.get_value(self.obj_worst_off), \
+                sol.get_value(self.obj_cover)
+        return NSP, sol
+
+
+# satisfaction scores, coverage and the schedule of a solution of any backend, stored on the instance and the nurses,
+# solution is the schedule array (nurse x day, shift or -1) and blocks the nr. of blocks per nurse and length
+def report_schedule(instance, solution, blocks, vis_schedule=True):
+    N = instance.N
+    worked = solution[:, :, None] == np.arange(len(instance.S))
+    penalized = np.zeros(blocks.shape, dtype=bool)
     for nurse in N:
-        for day in nurse.days_off:
-            for shift in S:
-                NSP.add_constraint(x[nurse.numerical_ID, day + 1, shift.numerical_ID] == 0)
-
-    # constraint 10: cover requirements
-    for day in D:
-        for shift in S:
-            df = shift.cover_req
-            shift_day_required = df.loc[(df['Day'] == day - 1) & (df['ShiftID'] == shift.shift_ID)].Requirement.item()
+        penalized[nurse.numerical_ID, penalized_lengths(nurse, instance.horizon)] = True
+    cons_penalties = (blocks * penalized).sum(axis=1)
 
-            NSP.add_constraint(
-                sum([x[nurse.numerical_ID, day, shift.numerical_ID] for nurse in N]) - z[day, shift.numerical_ID] + y[
-                    day, shift.numerical_ID] == shift_day_required)
-
-    sol = NSP.solve()
-    print(f"Optimal objective value z = {NSP.objective_value} ({NSP.get_solve_details()}")
-    print(f"Worst off: {sol.get_value(obj_worst_off)}")
-    print(f"Total dissat: {sol.get_value(obj_total_dissatisfaction)}")
-
-    max_cons_penalty_of_all_nurses = 1
-    obj_req = 0
+    # violated off request: nurse works the shift, violated on request: nurse does not work the shift
+    req_penalties = (instance.req_off_weights * worked).sum(axis=(1, 2)) + \
+        (instance.req_on_weights * ~worked).sum(axis=(1, 2))
 
     for nurse in N:
-        obj_consecutiveness = 0
-        for r in range(nurse.pref_max_cons + 1, nurse.max_consecutive_shifts + 1):
-            obj_consecutiveness = obj_consecutiveness + sum(
-                [sol.get_value(c[nurse.numerical_ID, d, r]) for d in range(1, time_horizon + 2 - r)])
-            value = sum(
-                [sol.get_value(c[nurse.numerical_ID, d, r]) for d in range(1, time_horizon + 2 - r)])
-            if value>0:
-                print(f'nurse {nurse.nurse_ID} has {value} blocks of length {r}')
-
-        for r in range(1, nurse.pref_min_cons):
-            obj_consecutiveness = obj_consecutiveness + sum(
-                [sol.get_value(c[nurse.numerical_ID, d, r]) for d in range(1, time_horizon + 2 - r)])
-            value = sum(
-                [sol.get_value(c[nurse.numerical_ID, d, r]) for d in range(1, time_horizon + 2 - r)])
-            if value>0:
-                print(f'nurse {nurse.nurse_ID} has {value} blocks of length {r}')
-
-        nurse.consecutivenessPenalty = obj_consecutiveness
-        if max_cons_penalty_of_all_nurses <= obj_consecutiveness:
-            max_cons_penalty_of_all_nurses = obj_consecutiveness
-
-        nurse_requests_violations_penalty = 0
-        nurse_sum_req_penalties = sum(df_off.loc[(df_off['EmployeeID'] == nurse.nurse_ID)].Weight) + sum(
-            df_on.loc[(df_on['EmployeeID'] == nurse.nurse_ID)].Weight)
-
-        for shift in S:
-            for day in D:
-                # check if nurse has request for this shift, day
-                if df_off.loc[(df_off['EmployeeID'] == nurse.nurse_ID) & (df_off['ShiftID'] == shift.shift_ID) & (
-                        df_off['Day'] == day - 1)].Weight.any():
-                    # if yes, add to obj_requests if violated
-                    nurse_requests_violations_penalty = nurse_requests_violations_penalty + (
-                            sol.get_value(x[nurse.numerical_ID, day, shift.numerical_ID]) * df_off.loc[
-                        (df_off['EmployeeID'] == nurse.nurse_ID) & (df_off['ShiftID'] == shift.shift_ID) & (
-                                df_off['Day'] == day - 1)].Weight.item())
-
-                # check if nurse has request for this shift, day
-                if df_on.loc[(df_on['EmployeeID'] == nurse.nurse_ID) & (df_on['ShiftID'] == shift.shift_ID) & (
-                        df_on['Day'] == day - 1)].Weight.any():
-                    # if yes, add to obj_requests if violated
-                    nurse_requests_violations_penalty = nurse_requests_violations_penalty + (
-                            (1 - sol.get_value(x[nurse.numerical_ID, day, shift.numerical_ID])) * df_on.loc[
-                        (df_on['EmployeeID'] == nurse.nurse_ID) & (df_on['ShiftID'] == shift.shift_ID) & (
-                                df_on['Day'] == day - 1)].Weight.item())
-
-        obj_req = obj_req + nurse_requests_violations_penalty
-        # scale request penalty on [0, 1]
-        if nurse_sum_req_penalties == 0:
-            nurse.requestPenalty = 0
-        else:
-            nurse.requestPenalty = round(nurse_requests_violations_penalty) # / nurse_sum_req_penalties, 2)
-
-        # rescale consecutiveness penalty on [0, 1]
-        nurse.consecutivenessPenalty = nurse.consecutivenessPenalty #/ max_cons_penalty_of_all_nurses
+        i = nurse.numerical_ID
+        for r in np.flatnonzero(blocks[i] * penalized[i]):
+            print(f'nurse {nurse.nurse_ID} has {blocks[i, r]} blocks of length {r}')
+        nurse.consecutivenessPenalty = cons_penalties[i].item()
+        nurse.requestPenalty = round(req_penalties[i].item())
 
         # combine requests and consecutiveness in Pi satisfaction score per nurse
         nurse.satisfaction = (1 - nurse.pref_alpha) * nurse.requestPenalty + nurse.pref_alpha * nurse.consecutivenessPenalty
         print(f'Dissatisfaction {nurse.satisfaction} for nurse {nurse.nurse_ID}, where cons {nurse.consecutivenessPenalty} and req {nurse.requestPenalty}')
 
+    # instances 8-24 only ship the benchmark file, their folder is created for the scores
+    os.makedirs(f'{instances_path}/instance{instance.instance_ID}', exist_ok=True)
     with open(
-            f'C:/Users/EvavR/OneDrive/Documenten/GitHub/thesis_MSc/NSP_benchmark/instances1_24/instance{instance.instance_ID}/satisfaction_scores{instance.instance_ID}.csv',
+            f'{instances_path}/instance{instance.instance_ID}/satisfaction_scores{instance.instance_ID}.csv',
             'w') as f:
         f.write('NurseID, requestsPen, consecutivenessPen, satisfaction (Pi) \n')
-        worst_off = 0
-        total_dissat = 0
         for nurse in N:
             f.write(
                 f'{nurse.nurse_ID}, {round(nurse.requestPenalty, 2)}, {round(nurse.consecutivenessPenalty, 2)}, {round(nurse.satisfaction, 2)} \n')
-            if worst_off < nurse.satisfaction:
-                worst_off = nurse.satisfaction
-            total_dissat = total_dissat + nurse.satisfaction
-        instance.worst_off_sat = worst_off
-        instance.total_dissat = total_dissat
+    instance.worst_off_sat = max([0] + [nurse.satisfaction for nurse in N])
+    instance.total_dissat = sum(nurse.satisfaction for nurse in N)
 
-    instance.best_undercover = round(sum([sol.get_value(y[day, shift.numerical_ID]) for day in D for shift in S]))
-    instance.best_overcover = round(sum([sol.get_value(z[day, shift.numerical_ID]) for day in D for shift in S]))
-    instance.best_sum_viol_req = obj_req
+    # under- and overcover per day and shift of the schedule
+    cover = worked.sum(axis=0)
+    instance.best_undercover = int(np.maximum(instance.cover_req - cover, 0).sum())
+    instance.best_overcover = int(np.maximum(cover - instance.cover_req, 0).sum())
+    instance.best_sum_viol_req = req_penalties.sum().item()
+    instance.solution = solution
+    instance.assignment = solution_assignment(solution)
 
     # visualize schedule, who works when, coverage and satisfaction indicator values
     if vis_schedule:
-        schedule = pd.read_csv(
-            f'C:/Users/EvavR/OneDrive/Documenten/GitHub/thesis_MSc/NSP_benchmark/instances1_24/instance{instance.instance_ID}/schedule_to_fill.csv',
-            delimiter=',')
-        schedule.set_index('nurse', inplace=True)
-
-        for day in D:
-            for nurse in N:
-                if sum([sol.get_value(x[nurse.numerical_ID, day, shift.numerical_ID]) for shift in S]) == 0.0:
-                    schedule.iloc[nurse.numerical_ID, day - 1] = '_'  # nurse is not working any shift this day
-                for shift in S:
-                    if round(sol.get_value(x[nurse.numerical_ID, day, shift.numerical_ID])) == 1:
-                        schedule.iloc[nurse.numerical_ID, day - 1] = shift.shift_ID
-
+        schedule = schedule_frame(solution, instance)
         schedule.to_csv(f'Schedule{instance.instance_ID}.csv')
         print(schedule)
-        return schedule, sol.get_value(obj_total_dissatisfaction), sol.get_value(obj_worst_off), sol.get_value(obj_cover)
-
-    return NSP, sol
+        return schedule
+
+
+# incumbents and stop rule of a ProgressLog in the solve details
+def report_progress(instance, progress=None):
+    if progress:
+        instance.solve_details.update(incumbents=progress.incumbents, stopped=progress.stopped)
+        if progress.stopped:
+            print(f'Stopped early: {progress.stopped}')
+
+
+# lower and upper bounds of the assignment variables with keys x_index (nurse, day, shift), fixed to the schedule
+# array solution except the free (nurse x day x shift) cells, all free without a solution
+def assignment_bounds(x_index, solution=None, free=None):
+    if solution is None:
+        return np.zeros(len(x_index), dtype=bool), np.ones(len(x_index), dtype=bool)
+    i, day, s = x_index.T
+    value = solution[i, day - 1] == s
+    fixed = np.ones(len(value), dtype=bool) if free is None else ~free[i, day - 1, s]
+    return value & fixed, value | ~fixed
+
+
+# weight per day (1-based) of the row key of the symmetry-breaking order: the shift worked + 1 (0 off) on every day
+# is a digit in base nr. of shifts + 1, on as many first days as keep the key below limit, so rows in key order are in
+# lexicographic order on those days
+def row_key_weights(instance, limit):
+    base = len(instance.S) + 1
+    days = min(instance.horizon, max(1, int(np.log(limit) / np.log(base))))
+    return {day: base ** (days - day) for day in range(1, days + 1)}
+
+
+# schedule array solution with the rows of every class of interchangeable nurses in descending row key order, the
+# order of the symmetry-breaking constraints (a schedule of the same objective)
+def symmetric_solution(solution, classes, weights):
+    solution = solution.copy()
+    days = np.array(list(weights)) - 1
+    for members in classes:
+        keys = (solution[members][:, days] + 1) @ np.array(list(weights.values()), dtype=np.int64)
+        solution[members] = solution[np.array(members)[np.argsort(-keys, kind='stable')]]
+    return solution
+
+
+# schedule array of a prior solution: a schedule array, a schedule DataFrame or an assignment set (instance.assignment)
+def start_solution(mip_start, instance):
+    if mip_start is None or isinstance(mip_start, np.ndarray):
+        return mip_start
+    if isinstance(mip_start, pd.DataFrame):
+        return schedule_solution(mip_start, instance)
+    solution = np.full((len(instance.N), instance.horizon), -1)
+    for i, day, s in mip_start:
+        solution[i, day - 1] = s
+    return solution
+
+
+# model class of a solver backend: 'cplex' (docplex, NSPModel) or 'cpsat' (OR-Tools CP-SAT, CPSATModel), both take
+# the same arguments and give the same results
+def backend_model(backend='cplex'):
+    if backend == 'cplex':
+        return NSPModel
+    if backend == 'cpsat':
+        from cpsat import CPSATModel  # OR-Tools is only needed for this backend
+        return CPSATModel
+    raise ValueError(f"Unknown backend {backend}, use 'cplex' or 'cpsat'")
+
+
+# one-off build and solve, see NSPModel for the arguments
+# mip_start is a prior solution to start from: instance.assignment of an earlier solve or a schedule DataFrame
+def find_schedule(instance, weight_under=100, weight_over=10, vis_schedule=True, include_satisf = True,
+                  cons_formulation='indicator', profile=False, time_limit=5 * 60, threads=None, mip_start=None,
+                  backend='cplex', progress=None, symmetry=False):
+    nsp_model = backend_model(backend)(instance, cons_formulation=cons_formulation, profile=profile,
+                                       time_limit=time_limit, threads=threads, weight_under=weight_under,
+                                       weight_over=weight_over, include_satisf=include_satisf, symmetry=symmetry)
+    return nsp_model.solve(vis_schedule=vis_schedule, mip_start=mip_start, progress=progress)
+
+
+# schedule array of a schedule DataFrame as filled by find_schedule (nurse rows in numerical_ID order, a column per
+# day with the shift ID or '_')
+def schedule_solution(schedule, instance):
+    shift_index = {shift.shift_ID: shift.numerical_ID for shift in instance.S}
+    return np.vectorize(lambda value: shift_index.get(str(value).strip(), -1), otypes=[int])(schedule.to_numpy())
+
+
+# (nurse, day, shift) keys worked in a schedule DataFrame as filled by find_schedule
+def schedule_assignment(schedule, instance):
+    return solution_assignment(schedule_solution(schedule, instance))
+
+
+# (nurse, day, shift) keys worked in a schedule array (nurse x day, shift or -1, day index starts at zero)
+def solution_assignment(solution):
+    nurses, days = np.nonzero(solution >= 0)
+    return set(zip(nurses.tolist(), (days + 1).tolist(), solution[nurses, days].tolist()))
+
+
+# schedule DataFrame of a schedule array as in schedule_to_fill.csv: a row per nurse, a column per day with the shift
+# ID or '_' on days off
+def schedule_frame(solution, instance):
+    shift_IDs = np.array([shift.shift_ID for shift in sorted(instance.S, key=lambda shift: shift.numerical_ID)] + ['_'])
+    nurse_IDs = [nurse.nurse_ID for nurse in sorted(instance.N, key=lambda nurse: nurse.numerical_ID)]
+    return pd.DataFrame(shift_IDs[solution], index=pd.Index(nurse_IDs, name='nurse'),
+                        columns=[f' {day}' for day in range(1, instance.horizon + 1)])
 
 
 def string_to_numerical_shift(shiftID, S):
@@ -422,27 +921,286 @@ def string_to_numerical_shift(shiftID, S):
         if shift.shift_ID == shiftID:
             return shift.numerical_ID
 
-def read_instance(inst_id):
-    cover = pd.read_csv(
-        r'C:\Users\EvavR\OneDrive\Documenten\GitHub\thesis_MSc\NSP_benchmark\instances1_24\instance{}\shift_cover_req.csv'.format(
-            inst_id))
-    req_on = pd.read_csv(
-        r'C:\Users\EvavR\OneDrive\Documenten\GitHub\thesis_MSc\NSP_benchmark\instances1_24\instance{}\requests_on.csv'.format(
-            inst_id))
-    req_off = pd.read_csv(
-        r'C:\Users\EvavR\OneDrive\Documenten\GitHub\thesis_MSc\NSP_benchmark\instances1_24\instance{}\requests_off.csv'.format(
-            inst_id))
-    staff = pd.read_csv(
-        r'C:\Users\EvavR\OneDrive\Documenten\GitHub\thesis_MSc\NSP_benchmark\instances1_24\instance{}\staff.csv'.format(
-            inst_id))
-    shifts = pd.read_csv(
-        r'C:\Users\EvavR\OneDrive\Documenten\GitHub\thesis_MSc\NSP_benchmark\instances1_24\instance{}\shifts.csv'.format(
-            inst_id))
-    daysOff = pd.read_csv(
-        r'C:\Users\EvavR\OneDrive\Documenten\GitHub\thesis_MSc\NSP_benchmark\instances1_24\instance{}\daysOff.csv'.format(
-            inst_id))
-
-    time_horizons = [14, 14, 14, 28, 28, 28, 28, 28, 28, 28]
+
+# request weights as nurse x day x shift array, built once so the model never has to scan the request table
+def request_weights(requests, N, S, horizon):
+    nurse_index = {nurse.nurse_ID: nurse.numerical_ID for nurse in N}
+    shift_index = {shift.shift_ID: shift.numerical_ID for shift in S}
+    weights = np.zeros((len(N), horizon, len(S)), dtype=int)
+    np.add.at(weights, (requests['EmployeeID'].map(nurse_index).to_numpy(), requests['Day'].to_numpy(),
+                        requests['ShiftID'].map(shift_index).to_numpy()), requests['Weight'].to_numpy())
+    return weights
+
+
+# cover requirement and under/over weights as day x shift arrays
+def cover_requirements(cover, S, horizon):
+    shift_index = {shift.shift_ID: shift.numerical_ID for shift in S}
+    cells = (cover['Day'].to_numpy(), cover['ShiftID'].map(shift_index).to_numpy())
+    arrays = []
+    for column in ['Requirement', 'weight_under', 'weight_over']:
+        values = np.zeros((horizon, len(S)), dtype=int)
+        values[cells] = cover[column].to_numpy()
+        arrays.append(values)
+    return arrays
+
+
+# benchmark file of an instance, instances 1-7 keep theirs next to the hand-made CSVs
+def instance_file(inst_id):
+    file = f'{instances_path}/Instance{inst_id}.txt'
+    if not os.path.isfile(file):
+        file = f'{instances_path}/instance{inst_id}/Instance{inst_id}.txt'
+    return file
+
+
+# import_instance: parse a benchmark file (SECTION_HORIZON ... SECTION_COVER) in a single pass into an Instance
+def import_instance(file, inst_ID):
+    horizon = 0
+    S = []
+    N = []
+    cannot_follow = []
+    days_off = {}
+    requests = {'SECTION_SHIFT_ON_REQUESTS': [], 'SECTION_SHIFT_OFF_REQUESTS': []}
+    cover = []
+
+    section = None
+    with open(file) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('SECTION_'):
+                section = line
+                continue
+
+            fields = line.split(',')
+            if section == 'SECTION_HORIZON':
+                horizon = int(fields[0])
+            elif section == 'SECTION_SHIFTS':
+                S.append(Shift(len(S), fields[0], int(fields[1]), None, []))
+                cannot_follow.append([shift_ID for shift_ID in fields[2].split('|') if shift_ID])
+            elif section == 'SECTION_STAFF':
+                max_shifts_dict = {}
+                for max_shift in fields[1].split('|'):
+                    shift_ID, max_shifts = max_shift.split('=')
+                    max_shifts_dict[shift_ID] = int(max_shifts)
+                N.append(Nurse(len(N), fields[0], [], max_shifts_dict, int(fields[2]), int(fields[3]),
+                               int(fields[4]), int(fields[5]), int(fields[6]), int(fields[7])))
+            elif section == 'SECTION_DAYS_OFF':
+                days_off[fields[0]] = [int(day) for day in fields[1:]]
+            elif section in requests:
+                requests[section].append((fields[0], int(fields[1]), fields[2], int(fields[3])))
+            elif section == 'SECTION_COVER':
+                cover.append((int(fields[0]), fields[1], int(fields[2]), int(fields[3]), int(fields[4])))
+
+    assert len(S) != 0, "Empty set of shifts"
+    assert len(N) != 0, "Empty set of nurses"
+
+    shift_index = {shift.shift_ID: shift.numerical_ID for shift in S}
+    nurse_index = {nurse.nurse_ID: nurse.numerical_ID for nurse in N}
+    for shift, shift_IDs in zip(S, cannot_follow):
+        shift.shifts_cannot_follow_this = [shift_index[shift_ID] for shift_ID in shift_IDs]
+    for nurse in N:
+        nurse.days_off = days_off.get(nurse.nurse_ID, [])
+
+    weights = {}
+    for section, rows in requests.items():
+        weights[section] = np.zeros((len(N), horizon, len(S)), dtype=int)
+        for nurse_ID, day, shift_ID, weight in rows:
+            weights[section][nurse_index[nurse_ID], day, shift_index[shift_ID]] += weight
+
+    cover_req = np.zeros((horizon, len(S)), dtype=int)
+    cover_weight_under = np.zeros((horizon, len(S)), dtype=int)
+    cover_weight_over = np.zeros((horizon, len(S)), dtype=int)
+    for day, shift_ID, requirement, weight_under, weight_over in cover:
+        cell = day, shift_index[shift_ID]
+        cover_req[cell] = requirement
+        cover_weight_under[cell] = weight_under
+        cover_weight_over[cell] = weight_over
+    for shift in S:
+        shift.cover_req = cover_req[:, shift.numerical_ID]
+
+    columns = ['EmployeeID', 'Day', 'ShiftID', 'Weight']
+    return Instance(inst_ID, horizon, set(S), set(N),
+                    pd.DataFrame(requests['SECTION_SHIFT_ON_REQUESTS'], columns=columns),
+                    pd.DataFrame(requests['SECTION_SHIFT_OFF_REQUESTS'], columns=columns),
+                    req_on_weights=weights['SECTION_SHIFT_ON_REQUESTS'],
+                    req_off_weights=weights['SECTION_SHIFT_OFF_REQUESTS'],
+                    cover_req=cover_req, cover_weight_under=cover_weight_under,
+                    cover_weight_over=cover_weight_over)
+
+
+# canonical hash of the preferences of all nurses (pref_min_cons, pref_max_cons, pref_alpha in nurse ID order), with the
+# instance ID the key of a solve of an instance with those preferences
+def preference_hash(instance):
+    preferences = sorted([nurse.nurse_ID, int(nurse.pref_min_cons), int(nurse.pref_max_cons), float(nurse.pref_alpha)]
+                         for nurse in instance.N)
+    return hashlib.sha1(json.dumps(preferences).encode()).hexdigest()[:16]
+
+
+# solve results per instance ID and preference_hash, at most max_entries, the least recently used result is evicted
+class SolveCache:
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def key(self, instance):
+        return instance.instance_ID, preference_hash(instance)
+
+    def get(self, key):
+        if key not in self.entries:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# source files of an instance: the hand-made CSV folder (instance{N}/*.csv) if there is one, otherwise the benchmark file
+def source_files(inst_id):
+    folder = f'{instances_path}/instance{inst_id}'
+    if not os.path.isfile(f'{folder}/staff.csv'):
+        return [instance_file(inst_id)]
+    return [f'{folder}/{name}.csv' for name in
+            ['shift_cover_req', 'requests_on', 'requests_off', 'staff', 'shifts', 'daysOff']]
+
+
+def source_hash(files):
+    sha = hashlib.sha1(str(cache_version).encode())
+    for file in files:
+        sha.update(os.path.basename(file).encode())
+        with open(file, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()[:16]
+
+
+# save_instance_cache: parsed instance as arrays in one .npz, nurse and shift IDs in a small json header
+def save_instance_cache(instance, file):
+    nurses = sorted(instance.N, key=lambda nurse: nurse.numerical_ID)
+    shifts = sorted(instance.S, key=lambda shift: shift.numerical_ID)
+    header = {'version': cache_version, 'instance_ID': instance.instance_ID, 'horizon': instance.horizon,
+              'nurse_IDs': [nurse.nurse_ID for nurse in nurses], 'shift_IDs': [shift.shift_ID for shift in shifts]}
+
+    # -1 marks a shift without a MaxShifts entry for the nurse
+    max_shifts = np.array([[nurse.max_shifts.get(shift.shift_ID, -1) for shift in shifts] for nurse in nurses])
+    cannot_follow = np.zeros((len(shifts), len(shifts)), dtype=bool)
+    for shift in shifts:
+        cannot_follow[shift.numerical_ID, shift.shifts_cannot_follow_this] = True
+
+    arrays = {
+        'header': np.array(json.dumps(header)),
+        'nurse_limits': np.array([[nurse.max_total_minutes, nurse.min_total_minutes, nurse.max_consecutive_shifts,
+                                   nurse.min_consecutive_shifts, nurse.min_consecutive_days_off, nurse.max_weekends]
+                                  for nurse in nurses]),
+        'max_shifts': max_shifts,
+        'days_off': np.array([day for nurse in nurses for day in nurse.days_off], dtype=int),
+        'days_off_count': np.array([len(nurse.days_off) for nurse in nurses]),
+        'shift_length': np.array([shift.length_in_min for shift in shifts]),
+        'cannot_follow': cannot_follow,
+        'cover_req': instance.cover_req,
+        'cover_weight_under': instance.cover_weight_under,
+        'cover_weight_over': instance.cover_weight_over,
+    }
+    # requests are sparse, store only the non-zero cells
+    for name in ['req_on_weights', 'req_off_weights']:
+        weights = getattr(instance, name)
+        arrays[f'{name}_cells'] = np.argwhere(weights).astype(np.int32)
+        arrays[f'{name}_values'] = weights[weights != 0]
+
+    # every writer has its own temp file, so processes loading the same instance cold do not replace each other's
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    handle, temp_file = tempfile.mkstemp(dir=os.path.dirname(file), prefix=os.path.basename(file), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_file, file)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def load_instance_cache(file):
+    with np.load(file) as cached:
+        arrays = {name: cached[name] for name in cached.files}
+    header = json.loads(arrays['header'].item())
+    horizon = header['horizon']
+    shift_IDs = header['shift_IDs']
+    nurse_IDs = header['nurse_IDs']
+
+    S = []
+    for ID, shift_ID in enumerate(shift_IDs):
+        S.append(Shift(ID, shift_ID, int(arrays['shift_length'][ID]), arrays['cover_req'][:, ID],
+                       np.flatnonzero(arrays['cannot_follow'][ID]).tolist()))
+
+    N = []
+    days_off = np.split(arrays['days_off'], np.cumsum(arrays['days_off_count'])[:-1])
+    for ID, nurse_ID in enumerate(nurse_IDs):
+        max_shifts_dict = {shift_ID: max_shifts for shift_ID, max_shifts in
+                           zip(shift_IDs, arrays['max_shifts'][ID].tolist()) if max_shifts >= 0}
+        N.append(Nurse(ID, nurse_ID, days_off[ID].tolist(), max_shifts_dict, *arrays['nurse_limits'][ID].tolist()))
+
+    weights = {}
+    requests = {}
+    for name in ['req_on_weights', 'req_off_weights']:
+        cells = arrays[f'{name}_cells']
+        values = arrays[f'{name}_values']
+        weights[name] = np.zeros((len(N), horizon, len(S)), dtype=int)
+        weights[name][tuple(cells.T)] = values
+        requests[name] = pd.DataFrame({'EmployeeID': [nurse_IDs[i] for i in cells[:, 0]], 'Day': cells[:, 1],
+                                       'ShiftID': [shift_IDs[i] for i in cells[:, 2]], 'Weight': values})
+
+    return Instance(header['instance_ID'], horizon, set(S), set(N), requests['req_on_weights'],
+                    requests['req_off_weights'], req_on_weights=weights['req_on_weights'],
+                    req_off_weights=weights['req_off_weights'], cover_req=arrays['cover_req'],
+                    cover_weight_under=arrays['cover_weight_under'], cover_weight_over=arrays['cover_weight_over'])
+
+
+# read_instance: parsed instance from the cache if its source files did not change, otherwise parse and cache it
+def read_instance(inst_id, use_cache=True):
+    files = source_files(inst_id)
+    cache_file = f'{cache_path}/instance{inst_id}-{source_hash(files)}.npz'
+    if use_cache and os.path.isfile(cache_file):
+        cache_stats['hits'] += 1
+        print(f'Instance {inst_id}: cache hit ({os.path.basename(cache_file)})')
+        return load_instance_cache(cache_file)
+
+    cache_stats['misses'] += 1
+    print(f'Instance {inst_id}: cache miss, parsing {len(files)} source file(s)')
+    if files[0].endswith('.txt'):
+        instance = import_instance(files[0], inst_id)
+    else:
+        instance = read_instance_csv(inst_id)
+
+    if use_cache:
+        # entries for older versions of the source files are stale now, the current one (and its temp files) may be
+        # written by another process loading the instance at the same time
+        if os.path.isdir(cache_path):
+            for old_file in os.listdir(cache_path):
+                if old_file.startswith(f'instance{inst_id}-') and \
+                        not old_file.startswith(os.path.basename(cache_file)):
+                    try:
+                        os.remove(f'{cache_path}/{old_file}')
+                    except FileNotFoundError:  # removed by another process
+                        pass
+        save_instance_cache(instance, cache_file)
+    return instance
+
+
+# read_instance_csv: instance from its hand-made CSV folder (instance{N}/*.csv)
+def read_instance_csv(inst_id):
+    folder = f'{instances_path}/instance{inst_id}'
+    cover = pd.read_csv(f'{folder}/shift_cover_req.csv')
+    req_on = pd.read_csv(f'{folder}/requests_on.csv')
+    req_off = pd.read_csv(f'{folder}/requests_off.csv')
+    staff = pd.read_csv(f'{folder}/staff.csv')
+    shifts = pd.read_csv(f'{folder}/shifts.csv')
+    daysOff = pd.read_csv(f'{folder}/daysOff.csv')
 
     N = set()
     ID = 0
@@ -460,16 +1218,15 @@ def read_instance(inst_id):
                     row['MinConsecutiveDaysOff'], row['MaxWeekends']))
         ID = ID + 1
 
+    # one or more day index columns (DayIndexes (start at zero) or DayIndexes1, DayIndexes2)
+    days_off = daysOff.set_index('EmployeeID')
     for nurse in N:
-        nurseID = nurse.nurse_ID
-        daysOffNurse1 = daysOff.loc[daysOff['EmployeeID'] == nurseID]['DayIndexes (start at zero)'].item()
-        # daysOffNurse2 = daysOff.loc[daysOff['EmployeeID'] == nurseID]['DayIndexes2 (start at zero)'].item()
-        nurse.days_off = [daysOffNurse1]
+        nurse.days_off = [int(day) for day in days_off.loc[nurse.nurse_ID].dropna()]
 
     S = set()
     ID = 0
     for index, row in shifts.iterrows():
-        S.add(Shift(ID, row['ShiftID'], row['Length in mins'], cover, []))
+        S.add(Shift(ID, row['ShiftID'], row['Length in mins'], None, []))
         ID = ID + 1
 
     for index, row in shifts.iterrows():
@@ -488,7 +1245,16 @@ def read_instance(inst_id):
         assert len(S) != 0, "Empty set of shifts"
         assert len(N) != 0, "Empty set of nurses"
 
-    return Instance(inst_id, time_horizons[inst_id - 1], S, N, req_on, req_off)
+    horizon = int(cover['Day'].max()) + 1
+    cover_req, cover_weight_under, cover_weight_over = cover_requirements(cover, S, horizon)
+    for shift in S:
+        shift.cover_req = cover_req[:, shift.numerical_ID]
+
+    return Instance(inst_id, horizon, S, N, req_on, req_off,
+                    req_on_weights=request_weights(req_on, N, S, horizon),
+                    req_off_weights=request_weights(req_off, N, S, horizon),
+                    cover_req=cover_req, cover_weight_under=cover_weight_under,
+                    cover_weight_over=cover_weight_over)
 
 
 if False:
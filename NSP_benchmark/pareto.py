@@ -0,0 +1,125 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+from model import backend_model, read_instance, schedule_frame
+
+pareto_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pareto results')
+measures = ['total_dissat', 'worst_off']
+
+
+# one point of the front in a worker: least coverage penalty, then least measure, with measure at most epsilon
+# (None: no bound), first=measure swaps the two (the anchor of least dissatisfaction); start is the schedule array
+# of a neighbouring point, a feasible start when its measure is within epsilon
+def pareto_point(instance, measure, epsilon=None, first='coverage', start=None, weight_under=100, weight_over=10,
+                 cons_formulation='indicator', time_limit=5 * 60, threads=1, backend='cplex'):
+    nsp_model = backend_model(backend)(instance, cons_formulation=cons_formulation, time_limit=time_limit,
+                                       threads=threads, weight_under=weight_under, weight_over=weight_over)
+    nsp_model.set_pareto(first, measure if first == 'coverage' else 'coverage',
+                         **({measure: epsilon} if epsilon is not None else {}))
+    try:
+        nsp_model.solve(vis_schedule=False, mip_start=start)
+    except Exception as e:  # returned as text, docplex exceptions do not survive the trip back from the worker
+        return {'epsilon': epsilon, 'error': str(e).splitlines()[0]}
+    return {'epsilon': epsilon, 'coverage': float(instance.solve_details['coverage_penalty']),
+            'total_dissat': float(instance.total_dissat), 'worst_off': float(instance.worst_off_sat),
+            'status': str(instance.solve_details['status']), 'seconds': instance.solve_details['seconds'],
+            'solution': instance.solution}
+
+
+# True for the points no other point is as good as on coverage and measure and better on one, of equal points the first
+def non_dominated(coverage, measure):
+    keep = np.ones(len(coverage), dtype=bool)
+    for k in range(len(coverage)):
+        as_good = (coverage <= coverage[k]) & (measure <= measure[k])
+        better = as_good & ((coverage < coverage[k]) | (measure < measure[k]))
+        keep[k] = not better.any() and not as_good[:k].any()
+    return keep
+
+
+# epsilon-constraint front of the coverage penalty against measure (total dissatisfaction or worst-off penalty):
+# the anchors (least coverage penalty and least measure) bound points levels of measure, every level minimizes the
+# coverage penalty with measure at most the level (then measure, so the points are not dominated by a schedule of the
+# same coverage), the levels are solved in waves of bisection over a process pool and every level starts from the
+# schedule of the nearest solved level below it
+# the front table (a row per level, anchors first and last) and the schedule of every non-dominated point are written
+# to output, the table and the schedules (point -> DataFrame) are returned
+def pareto_front(instance, points=10, measure='total_dissat', weight_under=100, weight_over=10,
+                 cons_formulation='indicator', time_limit=5 * 60, threads=1, workers=None, backend='cplex',
+                 output=pareto_path):
+    if measure not in measures or points < 2:
+        raise ValueError(f'Measure {measure} must be one of {measures} and points {points} at least 2')
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    settings = {'weight_under': weight_under, 'weight_over': weight_over, 'cons_formulation': cons_formulation,
+                'time_limit': time_limit, 'threads': threads, 'backend': backend}
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(pareto_point, instance, measure, None, first, **settings)
+                   for first in [measure, 'coverage']]
+        solved = {0: futures[0].result(), points - 1: futures[1].result()}
+        errors = [result['error'] for result in solved.values() if 'error' in result]
+        if errors:
+            raise ValueError(f'No anchor of the front of {instance}: {errors[0]}')
+        levels = np.linspace(solved[0][measure], solved[points - 1][measure], points)
+        print(f'Pareto front {instance}: {measure} from {levels[0]} to {levels[-1]} over {points} points')
+
+        intervals = [(0, points - 1)]
+        while intervals:
+            wave = [((low + high) // 2, low, high) for low, high in intervals if high - low > 1]
+            futures = {}
+            for k, low, high in wave:
+                start = solved[max(j for j in solved if j < k and 'error' not in solved[j])]['solution']
+                futures[pool.submit(pareto_point, instance, measure, float(levels[k]), 'coverage', start,
+                                    **settings)] = k
+            for future in as_completed(futures):
+                k = futures[future]
+                try:
+                    solved[k] = future.result()
+                except Exception as e:  # worker died
+                    solved[k] = {'epsilon': float(levels[k]), 'error': str(e).splitlines()[0]}
+                print(f"Pareto front {instance}: point {k} ({measure} <= {levels[k]}) " +
+                      (f"failed: {solved[k]['error']}" if 'error' in solved[k] else
+                       f"coverage {solved[k]['coverage']}, {measure} {solved[k][measure]}"))
+            intervals = [interval for k, low, high in wave for interval in [(low, k), (k, high)]]
+
+    front = pd.DataFrame([{key: value for key, value in solved[k].items() if key != 'solution'}
+                          for k in range(points)], index=pd.Index(range(points), name='point'))
+    front = front.reindex(columns=['epsilon', 'coverage', 'total_dissat', 'worst_off', 'status', 'seconds'] +
+                          (['error'] if 'error' in front else []))
+    solutions = front['coverage'].notna().to_numpy()
+    front['non_dominated'] = False
+    front.loc[solutions, 'non_dominated'] = non_dominated(front['coverage'].to_numpy()[solutions],
+                                                          front[measure].to_numpy()[solutions])
+
+    os.makedirs(output, exist_ok=True)
+    name = f'instance{instance.instance_ID}_{measure}'
+    front.to_csv(os.path.join(output, f'pareto_{name}.csv'))
+    schedules = {}
+    for k in front.index[front['non_dominated']]:
+        schedules[k] = schedule_frame(solved[k]['solution'], instance)
+        schedules[k].to_csv(os.path.join(output, f'schedule_{name}_point{k}.csv'))
+    print(f'Pareto front {instance}: {len(schedules)} non-dominated of {points} points in '
+          f'{time.perf_counter() - started:.1f} s, written to {output}')
+    return front, schedules
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Epsilon-constraint front of coverage against nurse dissatisfaction')
+    parser.add_argument('instance', type=int)
+    parser.add_argument('--points', type=int, default=10, help='levels of the front, the two anchors included')
+    parser.add_argument('--measure', default='total_dissat', choices=measures)
+    parser.add_argument('--time-limit', type=float, default=5 * 60, help='seconds per point')
+    parser.add_argument('--threads', type=int, default=1, help='solver threads per worker')
+    parser.add_argument('--workers', type=int, default=None, help='default: cores / threads')
+    parser.add_argument('--formulation', default='indicator', choices=['indicator', 'linear'])
+    parser.add_argument('--backend', default='cplex', choices=['cplex', 'cpsat'])
+    parser.add_argument('--output', default=pareto_path)
+    args = parser.parse_args()
+    pareto_front(read_instance(args.instance), args.points, args.measure, cons_formulation=args.formulation,
+                 time_limit=args.time_limit, threads=args.threads, workers=args.workers, backend=args.backend,
+                 output=args.output)
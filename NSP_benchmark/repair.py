@@ -0,0 +1,109 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from model import backend_model, penalized_lengths, read_instance, schedule_solution
+from evaluate import evaluate
+
+
+# days of the blocks of consecutive days the nurse works in the schedule array solution with a length their
+# preferences penalize, widened by margin days on both sides
+def penalized_days(solution, nurse, horizon, margin):
+    edges = np.diff(np.pad(solution[nurse.numerical_ID] >= 0, 1).astype(np.int8))
+    days = np.zeros(horizon, dtype=bool)
+    for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        if end - start in penalized_lengths(nurse, horizon):
+            days[max(0, start - margin):end + margin] = True
+    return days
+
+
+# free (nurse x day x shift) cells of the repair of nurse: their days around the penalized blocks and the same days of
+# the max_nurses nurses that work the most of their shifts on those days (same day and shift)
+def repair_neighbourhood(instance, solution, nurse, margin=1, max_nurses=4):
+    days = penalized_days(solution, nurse, instance.horizon, margin)
+    i = nurse.numerical_ID
+    shared = ((solution[:, days] == solution[i, days]) & (solution[i, days] >= 0)).sum(axis=1)
+    shared[i] = 0
+    nurses = [j for j in np.argsort(-shared, kind='stable')[:max_nurses] if shared[j] > 0]
+    free = np.zeros((len(instance.N), instance.horizon, len(instance.S)), dtype=bool)
+    free[np.ix_([i] + nurses, days)] = True
+    return free
+
+
+# repairs the schedule array (or DataFrame) solution after nurse_ID changed preferences (already set on the
+# instance): only the repair neighbourhood is re-optimized, the rest of the schedule is fixed, the coverage penalty
+# and the worst-off penalty (if include_satisf) of the schedule under the new preferences are upper bounds and
+# within them the coverage penalty and then the total dissatisfaction are minimized (Pareto mode of the model)
+# nsp_model is a model of the instance to reuse, e.g. the one that made solution, its preferences are updated (the
+# indicator formulation has block variables for every length, so any preference fits)
+def repair_schedule(instance, solution, nurse_ID, weight_under=100, weight_over=10, include_satisf=True,
+                    cons_formulation='indicator', time_limit=30, threads=None, backend='cplex', margin=1,
+                    max_nurses=4, nsp_model=None, vis_schedule=True):
+    started = time.perf_counter()
+    if isinstance(solution, pd.DataFrame):
+        solution = schedule_solution(solution, instance)
+    nurse = next((nurse for nurse in instance.N if nurse.nurse_ID == nurse_ID), None)
+    if nurse is None:
+        raise ValueError(f'{instance} has no nurse {nurse_ID}')
+
+    before = evaluate(solution, instance, weight_under, weight_over)
+    free = repair_neighbourhood(instance, solution, nurse, margin, max_nurses)
+    if nsp_model is None:
+        nsp_model = backend_model(backend)(instance, cons_formulation=cons_formulation, time_limit=time_limit,
+                                           threads=threads, weight_under=weight_under, weight_over=weight_over,
+                                           include_satisf=include_satisf)
+    else:
+        nsp_model.set_preferences()
+    nsp_model.fix_assignments(solution, free)
+    nsp_model.set_pareto('coverage', 'total_dissat', worst_off=float(before['worst_off']) if include_satisf else None,
+                         coverage=float(before['coverage_penalty']))
+    try:
+        result = nsp_model.solve(vis_schedule=vis_schedule, mip_start=solution)
+    finally:
+        nsp_model.fix_assignments()
+        nsp_model.set_objective_mode(include_satisf)
+
+    seconds = time.perf_counter() - started
+    instance.solve_details['repair'] = {
+        'nurse': nurse_ID, 'days': np.flatnonzero(free.any(axis=(0, 2))).tolist(),
+        'nurses': int(free.any(axis=(1, 2)).sum()), 'seconds': seconds,
+        'before': {key: float(before[key]) for key in ['coverage_penalty', 'worst_off', 'total_dissat']},
+        'after': {'coverage_penalty': float(instance.solve_details['coverage_penalty']),
+                  'worst_off': float(instance.worst_off_sat), 'total_dissat': float(instance.total_dissat)}}
+    repair = instance.solve_details['repair']
+    print(f"Repair {instance} for nurse {nurse_ID}: {repair['nurses']} nurses on {len(repair['days'])} days free, "
+          f"total dissatisfaction {repair['before']['total_dissat']} -> {repair['after']['total_dissat']}, "
+          f"coverage {repair['before']['coverage_penalty']} -> {repair['after']['coverage_penalty']} "
+          f"in {seconds:.2f} s")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve a benchmark instance, change the preferences of one nurse and '
+                                                 'repair the schedule')
+    parser.add_argument('instance', type=int)
+    parser.add_argument('nurse', help='nurse ID')
+    parser.add_argument('--min-cons', type=int, default=None, help='new pref_min_cons')
+    parser.add_argument('--max-cons', type=int, default=None, help='new pref_max_cons')
+    parser.add_argument('--alpha', type=float, default=None, help='new pref_alpha')
+    parser.add_argument('--time-limit', type=float, default=30, help='seconds for the first solve and the repair')
+    parser.add_argument('--backend', default='cplex', choices=['cplex', 'cpsat'])
+    parser.add_argument('--compare', action='store_true', help='also re-solve the whole schedule')
+    args = parser.parse_args()
+
+    instance = read_instance(args.instance)
+    nsp_model = backend_model(args.backend)(instance, time_limit=args.time_limit)
+    nsp_model.solve(vis_schedule=False)
+    solution = instance.solution
+    for nurse in instance.N:
+        if nurse.nurse_ID == args.nurse:
+            for key, value in [('pref_min_cons', args.min_cons), ('pref_max_cons', args.max_cons),
+                               ('pref_alpha', args.alpha)]:
+                if value is not None:
+                    setattr(nurse, key, value)
+    repair_schedule(instance, solution, args.nurse, nsp_model=nsp_model, vis_schedule=False)
+    if args.compare:
+        nsp_model.solve(vis_schedule=False, mip_start=instance.solution)
+        print(f"Full re-solve {instance}: total dissatisfaction {instance.total_dissat}, coverage "
+              f"{instance.solve_details['coverage_penalty']} in {instance.solve_details['seconds']:.2f} s")
@@ -0,0 +1,303 @@
+import io
+import time
+import itertools
+import contextlib
+import argparse
+from dataclasses import replace
+import numpy as np
+
+from model import backend_model, find_schedule, read_instance, report_schedule
+from evaluate import block_counts, evaluate
+
+
+# objective of find_schedule (coverage penalty + worst-off penalty if include_satisf) of a schedule array
+def schedule_objective(solution, instance, weight_under=100, weight_over=10, include_satisf=True):
+    scores = evaluate(solution, instance, weight_under, weight_over)
+    return float(scores['coverage_penalty'] + (scores['worst_off'] if include_satisf else 0))
+
+
+# most days every nurse can work from day d (index starts at zero) to the end of the horizon in state s with k weekends
+# left, nurse x (horizon + 1) x states x (weekends + 1), within their days off, max and min consecutive shifts and min
+# consecutive days off; the state is the days worked or off in a row before day d (capacity_state), 0 is rested
+# (backward dynamic program over these states and whether the Saturday before was worked, vectorized over the
+# weekends left)
+def work_capacity(instance):
+    weekend = np.zeros(instance.horizon, dtype=int)  # 1 on Saturdays, 2 on Sundays
+    for w in instance.W:
+        weekend[[7 * w - 2, 7 * w - 1]] = [1, 2]
+    size = max(nurse.max_consecutive_shifts + max(nurse.min_consecutive_days_off, 1) for nurse in instance.N)
+    capacity = np.zeros((len(instance.N), instance.horizon + 1, size, len(instance.W) + 1), dtype=np.int16)
+    for nurse in instance.N:
+        workable = np.ones(instance.horizon, dtype=bool)
+        workable[[day for day in nurse.days_off if day < instance.horizon]] = False
+        rested = max(nurse.min_consecutive_days_off, 1)
+        states = [(worked, 0, saturday) for worked in range(1, nurse.max_consecutive_shifts + 1) for saturday in
+                  [0, 1]] + [(0, off, 0) for off in range(1, rested + 1)]
+        value = {state: np.zeros(len(instance.W) + 1) for state in states}
+        for day in range(instance.horizon - 1, -1, -1):
+            before = value
+            value = {}
+            for worked, off, saturday in states:
+                best = np.full(len(instance.W) + 1, -np.inf)  # no way on from this state
+                if worked == 0 or worked >= nurse.min_consecutive_shifts:
+                    best = np.maximum(best, before[0, min(off + 1, rested), 0])
+                if workable[day] and worked < nurse.max_consecutive_shifts and \
+                        (worked > 0 or off >= nurse.min_consecutive_days_off):
+                    after = before[worked + 1, 0, int(weekend[day] == 1)] + 1
+                    if weekend[day] == 1 or weekend[day] == 2 and not saturday:  # a weekend more
+                        after = np.concatenate([[-np.inf], after[:-1]])
+                    best = np.maximum(best, after)
+                value[worked, off, saturday] = best
+            saturday = int(day > 0 and weekend[day - 1] == 1)  # a nurse working in a row before day worked on it
+            for worked, off, flag in states:
+                if flag == (saturday if worked else 0):
+                    capacity[nurse.numerical_ID, day, capacity_state(nurse, worked, off)] = np.maximum(
+                        value[worked, off, flag], 0)
+    return capacity
+
+
+# index in work_capacity's array of the state after worked days worked or off days off in a row
+def capacity_state(nurse, worked, off):
+    if worked:
+        return worked
+    return 0 if off >= max(nurse.min_consecutive_days_off, 1) else nurse.max_consecutive_shifts + off
+
+
+# most minutes nurse can work on the days from last on (index starts at zero) after the shifts worked in before
+# (nurse's row of the committed schedule array) with max_weekends left, in state (capacity_state): the days of capacity
+# (work_capacity) filled with the longest shifts left within the max shifts per type and the max total minutes
+def remaining_minutes(instance, nurse, capacity, before, last, max_weekends, state=0):
+    days = int(capacity[nurse.numerical_ID, last, state, min(max(max_weekends, 0), len(instance.W))])
+    minutes = 0
+    for shift in sorted(instance.S, key=lambda shift: -shift.length_in_min):
+        worked = max(0, min(days, nurse.max_shifts.get(shift.shift_ID, 0) - int((before == shift.numerical_ID).sum())))
+        minutes += worked * shift.length_in_min
+        days -= worked
+    shifts = sorted(instance.S, key=lambda shift: shift.numerical_ID)
+    lengths = np.array([shift.length_in_min for shift in shifts] + [0])
+    return min(minutes, nurse.max_total_minutes - int(lengths[before].sum()))
+
+
+# instance of the days [first, last) of instance (day index starts at zero), the limits of every nurse are what is left
+# after the committed schedule array solution on the days before first: shifts per type, minutes and weekends
+# the min minutes are at least what the nurse can not work after last any more with all their weekends left
+# (remaining_minutes, with the same limits as the model, committed_minimum bounds the committed days in the state and
+# with the weekends they end in) and the pro rata share of the nurse's days (not off) up to last, less one shift, the
+# max weekends the pro rata share (rounded up) of the weekends up to last, so the early windows neither leave more of
+# the min minutes to the later ones than they can work nor use up the weekends
+# capacity is work_capacity(instance), computed when not given
+def window_instance(instance, solution, first, last, capacity=None):
+    if capacity is None:
+        capacity = work_capacity(instance)
+    shifts = sorted(instance.S, key=lambda shift: shift.numerical_ID)
+    lengths = np.array([shift.length_in_min for shift in shifts] + [0])  # shift -1 is the day off
+    before = solution[:, :first]
+    weekends = [(7 * w - 2, 7 * w - 1) for w in instance.W if 7 * w <= first]
+    nurses = set()
+    for nurse in instance.N:
+        i = nurse.numerical_ID
+        minutes = int(lengths[before[i]].sum())
+        days_off = [day for day in nurse.days_off if day < instance.horizon]
+        workable = np.ones(instance.horizon, dtype=bool)
+        workable[days_off] = False
+        worked = sum(1 for days in weekends if (before[i, list(days)] >= 0).any())
+        after = remaining_minutes(instance, nurse, capacity, before[i], last, nurse.max_weekends - worked)
+        share = nurse.min_total_minutes * int(workable[:last].sum()) // max(int(workable.sum()), 1)
+        nurses.add(replace(
+            nurse, days_off=[day - first for day in days_off if first <= day < last],
+            max_shifts={shift.shift_ID: nurse.max_shifts[shift.shift_ID] - int((before[i] == shift.numerical_ID).sum())
+                        for shift in shifts if shift.shift_ID in nurse.max_shifts},
+            max_total_minutes=nurse.max_total_minutes - minutes,
+            min_total_minutes=max(0, nurse.min_total_minutes - minutes - after,
+                                  share - int(lengths.max()) - minutes),
+            max_weekends=-(-nurse.max_weekends * (last // 7) // len(instance.W)) - worked))
+    return replace(instance, horizon=last - first, N=nurses,
+                   req_on_weights=instance.req_on_weights[:, first:last],
+                   req_off_weights=instance.req_off_weights[:, first:last],
+                   cover_req=instance.cover_req[first:last],
+                   cover_weight_under=instance.cover_weight_under[first:last],
+                   cover_weight_over=instance.cover_weight_over[first:last],
+                   domain=None, build_profile=None, assignment=None, solution=None, incumbents=None,
+                   solve_details=None)
+
+
+# min minutes every nurse works on the days [first, end) of a window (the lookback and the days committed), what they
+# can not work after end any more (see remaining_minutes) in the state and with the weekends the window leaves them at
+# end, so a window can not put off work to its days after end that the later windows have no room for; the schedule
+# array solution is committed before replan
+# rows (numerical_ID, days, minutes, worked, off, weekends) for set_min_minutes, one per state and set of weekends
+# worked from replan to end (where the minimum grows with it), worked and off are the days of the window (day and
+# weekend numbers start at one) that make the state
+def committed_minimum(instance, solution, first, replan, end, capacity):
+    shifts = sorted(instance.S, key=lambda shift: shift.numerical_ID)
+    lengths = np.array([shift.length_in_min for shift in shifts] + [0])
+    weekends = [(w, (7 * w - 2, 7 * w - 1)) for w in instance.W if 7 * w <= end]
+    minimum = []
+    for nurse in instance.N:
+        i = nurse.numerical_ID
+        before = solution[i, :replan]
+        left = nurse.max_weekends - sum(1 for w, days in weekends
+                                        if 7 * w <= replan and (before[list(days)] >= 0).any())
+        open_weekends = [w - first // 7 for w, days in weekends if 7 * w > replan]
+        minutes = nurse.min_total_minutes - int(lengths[solution[i, :first]].sum())
+        rested = max(nurse.min_consecutive_days_off, 1)
+        states = [(days, 0, range(end - days, end), [end - days - 1] if days < nurse.max_consecutive_shifts else [])
+                  for days in range(1, nurse.max_consecutive_shifts + 1)]
+        states += [(0, days, [end - days - 1] if days < rested else [], range(end - days, end))
+                   for days in range(1, rested + 1)]
+        for worked_in_row, off_in_row, worked_days, off_days in states:
+            # days before replan are committed, the nurse keeps to the state on them or is never in it
+            if any(day < replan and (day < 0 or solution[i, day] < 0) for day in worked_days) or \
+                    any(0 <= day < replan and solution[i, day] >= 0 for day in off_days):
+                continue
+            needed = [minutes - remaining_minutes(instance, nurse, capacity, before, end, left - worked,
+                                                  capacity_state(nurse, worked_in_row, off_in_row))
+                      for worked in range(len(open_weekends) + 1)]
+            for worked in range(len(open_weekends) + 1):
+                if needed[worked] > max([0] + needed[:worked]):
+                    minimum += [(i, end - first, needed[worked],
+                                 [day - first + 1 for day in worked_days if day >= replan],
+                                 [day - first + 1 for day in off_days if day >= replan], list(weekends_worked))
+                                for weekends_worked in itertools.combinations(open_weekends, worked)]
+    return minimum
+
+
+# start schedule array of a window, every nurse solved alone (without cover) with their limits, the assignments fixed
+# and the committed minimum of the window (set_min_minutes rows), from plan; the cover is soft, so together they are a
+# schedule of the window, the window's solve only has to improve it, a nurse without a schedule is an error
+def nurse_start(window_inst, fixed, free, minimum, plan, backend='cplex', time_limit=5 * 60, threads=None,
+                include_satisf=True):
+    start = np.full((len(window_inst.N), window_inst.horizon), -1)
+    for nurse in window_inst.N:
+        i = nurse.numerical_ID
+        alone = replace(window_inst, N={replace(nurse, numerical_ID=0)},
+                        req_on_weights=window_inst.req_on_weights[i:i + 1],
+                        req_off_weights=window_inst.req_off_weights[i:i + 1],
+                        cover_weight_under=np.zeros_like(window_inst.cover_weight_under),
+                        cover_weight_over=np.zeros_like(window_inst.cover_weight_over),
+                        domain=None, build_profile=None, assignment=None, solution=None, incumbents=None,
+                        solve_details=None)
+        with contextlib.redirect_stdout(io.StringIO()):  # one solve per nurse and window, the window's solve reports
+            nsp_model = backend_model(backend)(alone, time_limit=time_limit, threads=threads,
+                                               include_satisf=include_satisf)
+            nsp_model.fix_assignments(fixed[i:i + 1], free[i:i + 1])
+            nsp_model.set_min_minutes([(0,) + row[1:] for row in minimum if row[0] == i])
+            try:
+                nsp_model.solve(vis_schedule=False, mip_start=plan[i:i + 1])
+            except ValueError as e:  # infeasible or no solution within the time limit
+                raise ValueError(f'No schedule for nurse {nurse.nurse_ID} alone: {str(e).splitlines()[0]}') from e
+        start[i] = alone.solution[0]
+    return start
+
+
+# rolling horizon: solves windows of window days with find_schedule's model and commits the first commit days of each,
+# the next window starts commit days later and looks back lookback days, fixed to the committed schedule, so the
+# consecutive days worked and off at its start are constrained as in the monolithic model; shifts, minutes and
+# weekends worked before the lookback are taken off the limits of the nurses (see window_instance), the days up to the
+# end of the commit must hold the minutes the nurses can not work after it (committed_minimum), a window without a
+# schedule after its lookback replans the lookback too, with the lookback days before it fixed, up to replans times,
+# a window that still has no schedule is an error (the windows never grow into the monolithic model)
+# all lengths in days and multiples of 7 so the windows keep the weekends, time_limit is per window
+# compare=True first solves the monolithic model (same time_limit) and stores its objective next to the rolling one
+def rolling_horizon(instance, window=28, commit=7, lookback=14, weight_under=100, weight_over=10,
+                    include_satisf=True, cons_formulation='indicator', time_limit=5 * 60, threads=None,
+                    backend='cplex', compare=False, replans=1, vis_schedule=True):
+    if any(days % 7 for days in [window, commit, lookback]) or not 0 < commit <= window:
+        raise ValueError(f'Window {window}, commit {commit} and lookback {lookback} must be multiples of 7 days '
+                         f'with 0 < commit <= window')
+    if lookback < max(nurse.max_consecutive_shifts for nurse in instance.N):
+        raise ValueError(f'Lookback {lookback} is shorter than the max consecutive shifts of the nurses')
+
+    monolithic = None
+    if compare:
+        try:
+            find_schedule(instance, weight_under, weight_over, vis_schedule=False, include_satisf=include_satisf,
+                          cons_formulation=cons_formulation, time_limit=time_limit, threads=threads, backend=backend)
+            monolithic = {'objective': schedule_objective(instance.solution, instance, weight_under, weight_over,
+                                                          include_satisf),
+                          'seconds': instance.solve_details['seconds'], 'status': instance.solve_details['status']}
+        except Exception as e:  # e.g. too big for the solver or no solution within the time limit
+            print(f'Monolithic solve of {instance} failed: {str(e).splitlines()[0]}')
+
+    started = time.perf_counter()
+    capacity = work_capacity(instance)
+    solution = np.full((len(instance.N), instance.horizon), -1)
+    plan = solution.copy()  # last window's schedule, the start for the days it shares with the next window
+    windows = []
+    for start in range(0, instance.horizon, commit):
+        replan = start  # first day the window may change
+        while True:
+            first, last = max(0, replan - lookback), min(start + window, instance.horizon)
+            window_inst = window_instance(instance, solution, first, last, capacity)
+            nsp_model = backend_model(backend)(window_inst, cons_formulation=cons_formulation, time_limit=time_limit,
+                                               threads=threads, weight_under=weight_under, weight_over=weight_over,
+                                               include_satisf=include_satisf)
+            free = np.zeros(window_inst.domain.shape, dtype=bool)
+            free[:, replan - first:] = True
+            nsp_model.fix_assignments(solution[:, first:last], free)
+            end = last if last == instance.horizon else start + commit
+            minimum = committed_minimum(instance, solution, first, replan, end, capacity)
+            nsp_model.set_min_minutes(minimum)
+            try:
+                mip_start = nurse_start(window_inst, solution[:, first:last], free, minimum, plan[:, first:last],
+                                        backend, time_limit, threads, include_satisf)
+                nsp_model.solve(vis_schedule=False, mip_start=mip_start)
+                break
+            except ValueError as e:  # no schedule of a nurse or the window, other errors are not replanned
+                # a replan grows the window by the lookback before it, never up to the whole horizon
+                if replan == 0 or start - replan >= replans * lookback or \
+                        first <= lookback and last == instance.horizon:
+                    raise ValueError(f'No schedule for days {replan + 1}-{last} of {instance}: '
+                                     f'{str(e).splitlines()[0]}') from e
+                print(f'Rolling horizon {instance}: no schedule for days {replan + 1}-{last} after the committed '
+                      f'days ({str(e).splitlines()[0]}), days {first + 1}-{replan} are replanned')
+                replan = first
+
+        plan[:, first:last] = window_inst.solution
+        solution[:, replan:end] = plan[:, replan:end]
+        windows.append({'days': (start + 1, last), 'replanned': start - replan,
+                        'status': window_inst.solve_details['status'], 'seconds': window_inst.solve_details['seconds']})
+        print(f'Rolling horizon {instance}: days {replan + 1}-{end} committed ({windows[-1]["status"]}, '
+              f'{windows[-1]["seconds"]:.1f} s)')
+        if end == instance.horizon:
+            break
+
+    seconds = time.perf_counter() - started
+    objective = schedule_objective(solution, instance, weight_under, weight_over, include_satisf)
+    schedule = report_schedule(instance, solution, block_counts(solution), vis_schedule)
+    scores = evaluate(solution, instance, weight_under, weight_over)
+    instance.solve_details = {'backend': backend, 'status': 'rolling horizon', 'objective': objective, 'bound': None,
+                              'gap': None, 'seconds': seconds, 'coverage_penalty': float(scores['coverage_penalty']),
+                              'windows': windows, 'monolithic': monolithic}
+    replanned = sum(1 for window in windows if window['replanned'])
+    print(f'Rolling horizon {instance}: objective {objective} in {seconds:.1f} s over {len(windows)} windows '
+          f'({replanned} replanned)' +
+          (f', monolithic {monolithic["objective"]} in {monolithic["seconds"]:.1f} s ({monolithic["status"]})'
+           if monolithic else ''))
+    if vis_schedule:
+        return schedule, instance.total_dissat, instance.worst_off_sat, float(scores['coverage_penalty'])
+    return solution, instance.solve_details
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rolling-horizon solve of a benchmark instance')
+    parser.add_argument('instance', type=int)
+    parser.add_argument('--window', type=int, default=28, help='days optimized per window')
+    parser.add_argument('--commit', type=int, default=7, help='days committed per window')
+    parser.add_argument('--lookback', type=int, default=14, help='committed days fixed at the start of a window')
+    parser.add_argument('--time-limit', type=float, default=5 * 60, help='seconds per window')
+    parser.add_argument('--formulation', default='indicator', choices=['indicator', 'linear'])
+    parser.add_argument('--backend', default='cplex', choices=['cplex', 'cpsat'])
+    parser.add_argument('--coverage-only', action='store_true', help='objective without nurse satisfaction')
+    parser.add_argument('--compare', action='store_true', help='also solve the monolithic model')
+    parser.add_argument('--replans', type=int, default=1, help='times a window without a schedule replans the '
+                                                               'lookback before it')
+    parser.add_argument('--check', action='store_true', help='fail if more than a quarter of the windows replanned')
+    args = parser.parse_args()
+    solution, details = rolling_horizon(read_instance(args.instance), args.window, args.commit, args.lookback,
+                                        include_satisf=not args.coverage_only, cons_formulation=args.formulation,
+                                        time_limit=args.time_limit, backend=args.backend, compare=args.compare,
+                                        replans=args.replans, vis_schedule=False)
+    replanned = sum(1 for window in details['windows'] if window['replanned'])
+    if args.check and replanned > len(details['windows']) // 4:
+        raise SystemExit(f"{replanned} of {len(details['windows'])} windows replanned")
@@ -0,0 +1,286 @@
+import io
+import os
+import copy
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urlrequest
+from urllib.parse import parse_qs, urlparse
+import pandas as pd
+
+from model import ProgressLog, SolveCache, find_schedule, read_instance, schedule_frame
+
+# the service only listens on this machine
+host = '127.0.0.1'
+default_port = 8765
+default_url = f'http://{host}:{default_port}'
+preference_keys = ['pref_min_cons', 'pref_max_cons', 'pref_alpha']
+solve_options = ['weight_under', 'weight_over', 'include_satisf', 'cons_formulation', 'time_limit', 'threads',
+                 'backend', 'symmetry']
+
+
+# preferences of all nurses as sent to the service, nurse ID -> pref_min_cons, pref_max_cons, pref_alpha
+def nurse_preferences(instance):
+    return {nurse.nurse_ID: {'pref_min_cons': int(nurse.pref_min_cons), 'pref_max_cons': int(nurse.pref_max_cons),
+                             'pref_alpha': float(nurse.pref_alpha)} for nurse in instance.N}
+
+
+def apply_preferences(instance, preferences=None):
+    for nurse in instance.N:
+        for key, value in (preferences or {}).get(nurse.nurse_ID, {}).items():
+            if key in preference_keys:
+                setattr(nurse, key, value)
+
+
+# satisfaction scores per nurse as in satisfaction_scores{ID}.csv, filled by find_schedule
+def satisfaction_frame(instance):
+    return pd.DataFrame([[nurse.nurse_ID, round(nurse.requestPenalty, 2), round(nurse.consecutivenessPenalty, 2),
+                          round(nurse.satisfaction, 2)] for nurse in instance.N],
+                        columns=['NurseID', 'requestsPen', 'consecutivenessPen', 'satisfaction (Pi)'])
+
+
+# worker process state: the parsed instances stay loaded between jobs, updates takes the job starts and incumbents
+# back to the service
+worker_instances = {}
+worker_updates = None
+
+
+def init_worker(updates, preload=()):
+    global worker_updates
+    worker_updates = updates
+    for inst_id in preload:
+        worker_instances[inst_id] = read_instance(inst_id)
+
+
+# one solve job in a worker: the instance with the preferences applied, every incumbent is sent back while it runs
+def solve_job(job_id, inst_id, preferences=None, options=None):
+    worker_updates.put((job_id, None))
+    if inst_id not in worker_instances:
+        worker_instances[inst_id] = read_instance(inst_id)
+    instance = copy.deepcopy(worker_instances[inst_id])
+    apply_preferences(instance, preferences)
+    progress = ProgressLog(callback=lambda incumbent: worker_updates.put((job_id, incumbent)))
+    find_schedule(instance, vis_schedule=False, progress=progress, **(options or {}))
+    details = {key: value for key, value in instance.solve_details.items() if key != 'incumbents'}
+    return {'schedule': schedule_frame(instance.solution, instance).to_json(orient='split'),
+            'scores': satisfaction_frame(instance).to_json(orient='split'),
+            'best_undercover': instance.best_undercover, 'best_overcover': instance.best_overcover,
+            'worst_off_sat': float(instance.worst_off_sat), 'total_dissat': float(instance.total_dissat),
+            'solve_details': json.loads(json.dumps(details, default=json_safe))}
+
+
+# numpy numbers as Python numbers, anything else JSON can not take as text
+def json_safe(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+# jobs over a pool of worker processes: a job is queued, running, done, failed or cancelled, keeps the incumbents
+# found so far and, when done, the result of solve_job; results are cached per instance, preferences and options,
+# so a configuration solved before is done at once
+class SolveService:
+    def __init__(self, workers=None, preload=(), max_entries=32):
+        context = multiprocessing.get_context('spawn')
+        self.updates = context.Queue()
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                        initargs=(self.updates, tuple(preload)))
+        self.instances = {}
+        self.cache = SolveCache(max_entries)
+        self.jobs = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self.collect_updates, daemon=True).start()
+
+    def key(self, inst_id, preferences, options):
+        if inst_id not in self.instances:
+            self.instances[inst_id] = read_instance(inst_id)
+        instance = copy.deepcopy(self.instances[inst_id])
+        apply_preferences(instance, preferences)
+        return (*self.cache.key(instance), json.dumps(options, sort_keys=True))
+
+    def submit(self, inst_id, preferences=None, options=None):
+        options = {key: value for key, value in (options or {}).items() if key in solve_options}
+        key = self.key(inst_id, preferences, options)
+        with self.lock:
+            job_id = str(len(self.jobs) + 1)
+            job = {'job': job_id, 'instance': inst_id, 'status': 'queued', 'submitted': time.time(),
+                   'incumbents': [], 'result': None, 'error': None, 'cached': False}
+            self.jobs[job_id] = job
+            result = self.cache.get(key)
+            if result is not None:
+                job.update(status='done', result=result, cached=True)
+                return job_id
+            future = self.pool.submit(solve_job, job_id, inst_id, preferences, options)
+            self.futures[job_id] = future
+        future.add_done_callback(lambda done: self.finish(job_id, key, done))
+        return job_id
+
+    def finish(self, job_id, key, future):
+        with self.lock:
+            job = self.jobs[job_id]
+            if future.cancelled():
+                job['status'] = 'cancelled'
+            elif future.exception() is not None:
+                job.update(status='failed', error=str(future.exception()).splitlines()[0])
+            else:
+                job.update(status='done', result=future.result())
+                self.cache.put(key, job['result'])
+            self.futures.pop(job_id, None)
+
+    def cancel(self, job_id):
+        future = self.futures.get(job_id)
+        return future is not None and future.cancel()  # only while no worker has taken the job
+
+    # job starts (incumbent None) and incumbents from the workers
+    def collect_updates(self):
+        while True:
+            job_id, incumbent = self.updates.get()
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] not in ['queued', 'running']:
+                    continue
+                job['status'] = 'running'
+                if incumbent is not None:
+                    job['incumbents'].append(incumbent)
+
+    # the job with the incumbents after the first since, so a poller only gets what is new
+    def status(self, job_id, since=0):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else {**job, 'incumbents': job['incumbents'][since:]}
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# JSON API of a SolveService: POST /jobs {instance, preferences, options} -> {job}, GET /jobs/<job>?since=<n> the
+# job with its incumbents from the n-th on, GET /jobs the status of all jobs, DELETE /jobs/<job> cancels a queued job
+# every request gets a JSON reply: 400 for a bad request, 404 for an unknown job or instance, 500 for anything else
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, body, code=200):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def job_id(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        return parts[1] if len(parts) == 2 and parts[0] == 'jobs' else None
+
+    # runs handler, an exception it raises is a 500 reply instead of a dropped connection
+    def respond(self, handler):
+        try:
+            handler()
+        except Exception as e:
+            self.send_json({'error': f'{type(e).__name__}: {str(e).splitlines()[0] if str(e) else ""}'}, 500)
+
+    def do_POST(self):
+        self.respond(self.post_job)
+
+    def do_GET(self):
+        self.respond(self.get_jobs)
+
+    def do_DELETE(self):
+        self.respond(self.delete_job)
+
+    def post_job(self):
+        if urlparse(self.path).path.strip('/') != 'jobs':
+            return self.send_json({'error': 'not found'}, 404)
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            job_id = self.service.submit(int(body['instance']), body.get('preferences'), body.get('options'))
+        except FileNotFoundError:
+            return self.send_json({'error': f"no such instance: {body['instance']}"}, 404)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            return self.send_json({'error': f'bad job: {e}'}, 400)
+        self.send_json({'job': job_id}, 202)
+
+    def get_jobs(self):
+        url = urlparse(self.path)
+        if url.path.strip('/') == 'jobs':
+            with self.service.lock:
+                return self.send_json({job_id: job['status'] for job_id, job in self.service.jobs.items()})
+        try:
+            since = int(parse_qs(url.query).get('since', ['0'])[0])
+        except ValueError:
+            return self.send_json({'error': 'since must be an integer'}, 400)
+        job = self.service.status(self.job_id(), since)
+        if job is None:
+            return self.send_json({'error': 'no such job'}, 404)
+        self.send_json(job)
+
+    def delete_job(self):
+        if self.service.status(self.job_id()) is None:
+            return self.send_json({'error': 'no such job'}, 404)
+        self.send_json({'cancelled': self.service.cancel(self.job_id())})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=default_port, workers=None, preload=()):
+    workers = workers or os.cpu_count() or 1
+    ServiceHandler.service = SolveService(workers, preload)
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    print(f'Solve service on http://{host}:{port} with {workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ServiceHandler.service.shutdown()
+
+
+# client side, used by the apps
+
+def call(url, method='GET', body=None, timeout=10):
+    data = None if body is None else json.dumps(body).encode()
+    req = urlrequest.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    with urlrequest.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def submit_job(inst_id, preferences=None, options=None, url=default_url):
+    return call(f'{url}/jobs', 'POST', {'instance': inst_id, 'preferences': preferences, 'options': options})['job']
+
+
+def job_status(job_id, since=0, url=default_url):
+    return call(f'{url}/jobs/{job_id}?since={since}')
+
+
+# polls the job until it is no longer queued or running, on_incumbent gets every new incumbent, returns the job
+def wait_for_job(job_id, url=default_url, poll=0.5, on_incumbent=None):
+    since = 0
+    while True:
+        job = job_status(job_id, since, url)
+        for incumbent in job['incumbents']:
+            if on_incumbent:
+                on_incumbent(incumbent)
+        since += len(job['incumbents'])
+        if job['status'] not in ['queued', 'running']:
+            return job
+        time.sleep(poll)
+
+
+# schedule and satisfaction scores DataFrames of the result of a done job
+def result_frames(result):
+    schedule = pd.read_json(io.StringIO(result['schedule']), orient='split', dtype=False, convert_axes=False)
+    schedule.index.name = 'nurse'
+    return schedule, pd.read_json(io.StringIO(result['scores']), orient='split', dtype=False, convert_axes=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local solve service for the apps (localhost only)')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--workers', type=int, default=None, help='solver processes, default: cores')
+    parser.add_argument('--preload', type=int, nargs='*', default=[], help='instances the workers load at start')
+    args = parser.parse_args()
+    serve(args.port, args.workers, args.preload)
@@ -0,0 +1,101 @@
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+from model import NSPModel, read_instance
+from storage import append_schedules
+
+simulation_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simulation results')
+metrics = ['total_dissat', 'worst_off', 'coverage', 'total_dissat_BM', 'worst_off_BM', 'coverage_BM']
+
+
+# one seed per run from the study seed, so run r gets the same preferences whatever the number of workers
+def run_seeds(seed, runs):
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(runs)]
+
+
+# one Monte Carlo run: random pref_alpha per nurse, solved with and without satisfaction (the benchmark, BM)
+def simulation_run(run, seed, inst_id=1, weight_over=10, weight_under=100, threads=1, time_limit=5 * 60):
+    rng = np.random.default_rng(seed)
+    instance = read_instance(inst_id)
+    nurses = sorted(instance.N, key=lambda nurse: nurse.numerical_ID)
+    for nurse in nurses:
+        nurse.pref_alpha = round(rng.uniform(0, 10)) / 10
+
+    result = {'run': run, 'seed': seed, 'pref_alpha': [nurse.pref_alpha for nurse in nurses]}
+    solutions = []
+    nsp_model = NSPModel(instance, time_limit=time_limit, threads=threads, weight_under=weight_under,
+                         weight_over=weight_over)
+    for suffix, include_satisf in [('', True), ('_BM', False)]:
+        # same model for both solves, the coverage-only solve starts from the schedule of the first solve
+        nsp_model.set_objective_mode(include_satisf)
+        mip_start = instance.assignment if suffix else None
+        try:
+            nsp_model.solve(vis_schedule=False, mip_start=mip_start)
+        except Exception as e:  # returned as text, docplex exceptions do not survive the trip back from the worker
+            return {'run': run, 'seed': seed, 'error': str(e).splitlines()[0]}
+        # dissatisfaction as recounted after the solve, the objective variables are free when include_satisf=False
+        result['total_dissat' + suffix] = instance.total_dissat
+        result['worst_off' + suffix] = instance.worst_off_sat
+        result['coverage' + suffix] = instance.solve_details['coverage_penalty']
+        solutions.append(instance.solution)
+    result['solutions'] = solutions  # taken off by simulate, the runs file only holds the metrics
+    return result
+
+
+def summarize(results):
+    summary = {'runs': len(results)}
+    for metric in metrics:
+        values = np.array([result[metric] for result in results], dtype=float)
+        summary[metric] = {'mean': values.mean(), 'std': values.std(), 'min': values.min(), 'max': values.max()}
+    return summary
+
+
+def read_runs(file):
+    if not os.path.exists(file):
+        return []
+    with open(file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# runs fan out over a process pool, every finished run is appended to runs_file and the summary is rewritten,
+# runs already in runs_file (same run number and seed) are not solved again, so a crashed study can be resumed
+# schedules_file keeps the two schedules of every run in a compact schedule file (see storage.py), a run then holds
+# their indices in it under 'schedules' (with and without satisfaction)
+def simulate(runs, seed=0, workers=None, threads=1, inst_id=1, weight_over=10, weight_under=100, time_limit=5 * 60,
+             runs_file=os.path.join(simulation_path, 'simulation_runs.jsonl'), schedules_file=None):
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    seeds = run_seeds(seed, runs)
+    summary_file = os.path.splitext(runs_file)[0] + '_summary.json'
+    os.makedirs(os.path.dirname(runs_file), exist_ok=True)
+
+    done = {result['run']: result for result in read_runs(runs_file)
+            if 'error' not in result and result['run'] < runs and result['seed'] == seeds[result['run']]}
+    todo = [run for run in range(runs) if run not in done]
+    print(f'Simulation: {len(done)} of {runs} runs done, {len(todo)} to go on {workers} workers x {threads} threads')
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(simulation_run, run, seeds[run], inst_id, weight_over, weight_under, threads,
+                               time_limit): run for run in todo}
+        for future in as_completed(futures):
+            run = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:  # worker died
+                result = {'run': run, 'seed': seeds[run], 'error': str(e).splitlines()[0]}
+            solutions = result.pop('solutions', None)
+            if schedules_file and solutions:
+                result['schedules'] = append_schedules(schedules_file, read_instance(inst_id), solutions)
+            if 'error' not in result:
+                done[run] = result
+            with open(runs_file, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+            if done:
+                with open(summary_file + '.tmp', 'w') as f:
+                    json.dump(summarize(list(done.values())), f, indent=2)
+                os.replace(summary_file + '.tmp', summary_file)
+            print(f"Run {run} {'failed: ' + result['error'] if 'error' in result else 'done'} ({len(done)}/{runs})")
+
+    return [done[run] for run in range(runs) if run in done]
@@ -0,0 +1,106 @@
+import os
+import json
+import struct
+import argparse
+import numpy as np
+import pandas as pd
+
+from model import read_instance, schedule_solution
+
+# schedule file: magic, header length (uint32) and a JSON header with the instance ID, horizon and the nurse and shift
+# IDs in numerical_ID order, then the schedule arrays appended one after the other as int8 nurse x day matrices
+# (shift index or -1 on days off), so the whole file reads back as one memory-mapped schedules x nurse x day array
+magic = b'NSPSCHED'
+storage_version = 1
+
+
+def schedule_header(instance):
+    return {'version': storage_version, 'instance_ID': instance.instance_ID, 'horizon': instance.horizon,
+            'nurse_IDs': [nurse.nurse_ID for nurse in sorted(instance.N, key=lambda nurse: nurse.numerical_ID)],
+            'shift_IDs': [shift.shift_ID for shift in sorted(instance.S, key=lambda shift: shift.numerical_ID)]}
+
+
+# header and the byte offset of the first schedule
+def read_header(file):
+    with open(file, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f'{file} is not a schedule file')
+        size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(size))
+    if header['version'] != storage_version:
+        raise ValueError(f'{file} has version {header["version"]}, this code reads version {storage_version}')
+    return header, len(magic) + 4 + size
+
+
+# appends schedule arrays (one nurse x day array or a stack of them) to file, which is created with the header of
+# instance if it does not exist; returns the indices of the appended schedules in the file
+def append_schedules(file, instance, solutions):
+    header = schedule_header(instance)
+    solutions = np.asarray(solutions).reshape((-1, len(header['nurse_IDs']), header['horizon']))
+    if len(header['shift_IDs']) > np.iinfo(np.int8).max:
+        raise ValueError(f'{instance} has more shifts than an int8 schedule file can hold')
+    if not os.path.exists(file):
+        data = json.dumps(header).encode()
+        os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+        with open(file, 'wb') as f:
+            f.write(magic + struct.pack('<I', len(data)) + data)
+    stored, offset = read_header(file)
+    if stored != header:
+        raise ValueError(f'{file} holds schedules of instance {stored["instance_ID"]} with other nurses, shifts or '
+                         f'horizon than {instance}')
+    with open(file, 'ab') as f:
+        first = (f.tell() - offset) // solutions[0].size
+        f.write(solutions.astype(np.int8).tobytes())  # one write, so a reader never sees half a batch
+    return list(range(first, first + len(solutions)))
+
+
+# header and the schedules x nurse x day array of file, memory-mapped (mode 'r'), only the schedules that are read
+# are loaded
+def read_schedules(file, mode='r'):
+    header, offset = read_header(file)
+    shape = (len(header['nurse_IDs']), header['horizon'])
+    count = (os.path.getsize(file) - offset) // (shape[0] * shape[1])
+    if count == 0:
+        return header, np.empty((0,) + shape, dtype=np.int8)
+    return header, np.memmap(file, dtype=np.int8, mode=mode, offset=offset, shape=(count,) + shape)
+
+
+# schedule DataFrame of a stored schedule as in schedule_to_fill.csv (see schedule_frame), written to csv_file if given
+def export_schedule(file, index, csv_file=None):
+    header, schedules = read_schedules(file)
+    shift_IDs = np.array(header['shift_IDs'] + ['_'])
+    schedule = pd.DataFrame(shift_IDs[np.asarray(schedules[index], dtype=int)],
+                            index=pd.Index(header['nurse_IDs'], name='nurse'),
+                            columns=[f' {day}' for day in range(1, header['horizon'] + 1)])
+    if csv_file:
+        schedule.to_csv(csv_file)
+    return schedule
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact schedule files: int8 nurse x day matrices with an ID header')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('import', help='append schedule CSVs (as written by find_schedule) to a schedule file')
+    add.add_argument('instance', type=int)
+    add.add_argument('file')
+    add.add_argument('csv_files', nargs='+')
+    export = commands.add_parser('export', help='write a stored schedule as CSV')
+    export.add_argument('file')
+    export.add_argument('index', type=int)
+    export.add_argument('csv_file')
+    info = commands.add_parser('info', help='header and number of schedules of a schedule file')
+    info.add_argument('file')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        instance = read_instance(args.instance)
+        for csv_file in args.csv_files:
+            schedule = pd.read_csv(csv_file, index_col=0, dtype=str, keep_default_na=False)
+            index, = append_schedules(args.file, instance, schedule_solution(schedule, instance))
+            print(f'{csv_file}: schedule {index}')
+    elif args.command == 'export':
+        export_schedule(args.file, args.index, args.csv_file)
+    else:
+        header, schedules = read_schedules(args.file)
+        print(f"Instance {header['instance_ID']}: {len(schedules)} schedules of {len(header['nurse_IDs'])} nurses x "
+              f"{header['horizon']} days, shifts {header['shift_IDs']}")
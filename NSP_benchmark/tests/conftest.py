@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of NSP_benchmark import each other by their flat names (from model import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,72 @@
+import os
+import shutil
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import model
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(model, 'cache_path', str(tmp_path / 'cache'))
+    monkeypatch.setattr(model, 'cache_stats', {'hits': 0, 'misses': 0})
+    return tmp_path / 'cache'
+
+
+def assert_same_instance(instance, other):
+    assert (instance.instance_ID, instance.horizon) == (other.instance_ID, other.horizon)
+    assert sorted(instance.N, key=lambda nurse: nurse.numerical_ID) == \
+           sorted(other.N, key=lambda nurse: nurse.numerical_ID)
+    for shift, other_shift in zip(sorted(instance.S, key=lambda shift: shift.numerical_ID),
+                                  sorted(other.S, key=lambda shift: shift.numerical_ID)):
+        assert (shift.shift_ID, shift.length_in_min, list(shift.shifts_cannot_follow_this)) == \
+               (other_shift.shift_ID, other_shift.length_in_min, list(other_shift.shifts_cannot_follow_this))
+    for name in ['req_on_weights', 'req_off_weights', 'cover_req', 'cover_weight_under', 'cover_weight_over']:
+        np.testing.assert_array_equal(getattr(instance, name), getattr(other, name))
+
+
+@pytest.mark.parametrize('inst_id', [1, 3])
+def test_round_trip(cache, inst_id):
+    parsed = model.read_instance(inst_id)
+    cached = model.read_instance(inst_id)
+    assert model.cache_stats == {'hits': 1, 'misses': 1}
+    assert_same_instance(cached, parsed)
+    assert_same_instance(cached, model.read_instance(inst_id, use_cache=False))
+
+
+def test_changed_source_invalidates(cache, tmp_path, monkeypatch):
+    instances = tmp_path / 'instances'
+    instances.mkdir()
+    shutil.copy(model.instance_file(3), instances)
+    monkeypatch.setattr(model, 'instances_path', str(instances))
+    model.read_instance(3)
+    (old_file,) = os.listdir(cache)
+
+    with open(instances / 'Instance3.txt', 'a') as f:
+        f.write('\n')
+    model.read_instance(3)
+    model.read_instance(3)
+    assert model.cache_stats == {'hits': 1, 'misses': 2}
+    assert os.listdir(cache) != [old_file] and len(os.listdir(cache)) == 1
+
+
+# instance inst_id read with the cache in folder (in a process of its own)
+def cold_load(folder, inst_id):
+    model.cache_path = folder
+    instance = model.read_instance(inst_id)
+    return len(instance.N), int(instance.cover_req.sum())
+
+
+def test_concurrent_cold_loads(tmp_path):
+    folders = [str(tmp_path / f'cache{round}') for round in range(5)]
+    expected = cold_load(str(tmp_path / 'expected'), 3)
+    # 8 processes load the instance at once into every empty cache folder
+    with multiprocessing.get_context('spawn').Pool(8) as pool:
+        loads = pool.starmap(cold_load, [(folder, 3) for folder in folders for _ in range(8)], chunksize=1)
+    assert loads == [expected] * len(loads)
+    for folder in folders:
+        assert [file for file in os.listdir(folder) if file.endswith('.npz')] == os.listdir(folder)
+        assert_same_instance(model.load_instance_cache(f'{folder}/{os.listdir(folder)[0]}'),
+                             model.read_instance(3, use_cache=False))
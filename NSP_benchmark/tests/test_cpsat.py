@@ -0,0 +1,17 @@
+import model
+from cpsat import CPSATModel
+
+
+def test_updates_keep_model_size():
+    instance = model.read_instance(1)
+    nsp_model = CPSATModel(instance, symmetry=True)
+    sizes = []
+    for round in range(3):
+        nsp_model.set_preferences({nurse.nurse_ID: 0.1 * (round + 1) for nurse in instance.N})
+        nsp_model.set_pareto('coverage', 'worst_off', total_dissat=100 - round, coverage=50)
+        nsp_model.set_min_minutes([(0, 7, 600, [], [], []), (1, 7, 600, [], [], [])])
+        nsp_model.set_symmetry(round % 2 == 0)
+        nsp_model.set_objective_mode()
+        nsp_model.set_min_minutes()
+        sizes.append(len(nsp_model.NSP.proto.constraints))
+    assert sizes == [sizes[0]] * 3
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import model
+from evaluate import evaluate
+
+
+# instance 1, for CPLEX community edition cut to its first nurses (its size limit)
+def instance_for(backend, tmp_path, monkeypatch):
+    instance = model.read_instance(1)
+    if backend == 'cplex':
+        instance.N = {nurse for nurse in instance.N if nurse.numerical_ID < 2}
+        instance.req_on_weights, instance.req_off_weights = instance.req_on_weights[:2], instance.req_off_weights[:2]
+    monkeypatch.setattr(model, 'instances_path', str(tmp_path))  # the solve writes its satisfaction scores there
+    return instance
+
+
+@pytest.mark.parametrize('backend', ['cpsat', 'cplex'])
+@pytest.mark.parametrize('include_satisf', [True, False])
+def test_matches_solver_objective(backend, include_satisf, tmp_path, monkeypatch):
+    instance = instance_for(backend, tmp_path, monkeypatch)
+    for nurse in instance.N:
+        nurse.pref_alpha = 0.5  # consecutiveness and requests both count
+    model.find_schedule(instance, vis_schedule=False, include_satisf=include_satisf, backend=backend, threads=1)
+    scores = evaluate(instance.solution, instance)
+    assert scores['coverage_penalty'] + (scores['worst_off'] if include_satisf else 0) == \
+           pytest.approx(instance.solve_details['objective'])
+    assert scores['coverage_penalty'] == pytest.approx(instance.solve_details['coverage_penalty'])
+    assert (scores['undercover'], scores['overcover']) == (instance.best_undercover, instance.best_overcover)
+    nurses = sorted(instance.N, key=lambda nurse: nurse.numerical_ID)
+    np.testing.assert_allclose(scores['satisfaction'], [nurse.satisfaction for nurse in nurses])
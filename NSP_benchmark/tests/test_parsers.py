@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+
+import model
+
+
+@pytest.mark.parametrize('inst_id', [1, 2])
+def test_txt_matches_csv(inst_id):
+    txt = model.import_instance(model.instance_file(inst_id), inst_id)
+    csv = model.read_instance_csv(inst_id)
+    assert (txt.instance_ID, txt.horizon) == (csv.instance_ID, csv.horizon)
+    assert sorted(txt.N, key=lambda nurse: nurse.numerical_ID) == sorted(csv.N, key=lambda nurse: nurse.numerical_ID)
+    assert sorted(txt.S, key=lambda shift: shift.numerical_ID) == sorted(csv.S, key=lambda shift: shift.numerical_ID)
+    for name in ['req_on_weights', 'req_off_weights', 'cover_req', 'cover_weight_under', 'cover_weight_over']:
+        np.testing.assert_array_equal(getattr(txt, name), getattr(csv, name))
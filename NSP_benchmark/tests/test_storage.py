@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import model
+from storage import append_schedules, export_schedule, read_schedules
+
+
+# random schedule arrays of an instance (shift index or -1 on days off)
+def random_schedules(instance, count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-1, len(instance.S), size=(count, len(instance.N), instance.horizon))
+
+
+def test_round_trip(tmp_path):
+    instance = model.read_instance(1)
+    file = str(tmp_path / 'schedules.bin')
+    solutions = random_schedules(instance, 4)
+    assert append_schedules(file, instance, solutions[0]) == [0]
+    assert append_schedules(file, instance, solutions[1:]) == [1, 2, 3]
+
+    header, schedules = read_schedules(file)
+    assert header['instance_ID'] == 1 and schedules.dtype == np.int8
+    np.testing.assert_array_equal(schedules, solutions)
+    for index in [0, 3]:
+        pd.testing.assert_frame_equal(export_schedule(file, index), model.schedule_frame(solutions[index], instance))
+        np.testing.assert_array_equal(model.schedule_solution(export_schedule(file, index), instance),
+                                      solutions[index])
+
+
+def test_other_instance_is_refused(tmp_path):
+    file = str(tmp_path / 'schedules.bin')
+    instance = model.read_instance(1)
+    append_schedules(file, instance, random_schedules(instance, 1)[0])
+    other = model.read_instance(2)
+    with pytest.raises(ValueError):
+        append_schedules(file, other, random_schedules(other, 1)[0])
+    assert len(read_schedules(file)[1]) == 1